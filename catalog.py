@@ -0,0 +1,101 @@
+from astropy.io import fits
+import astropy.time
+
+import numpy as np
+import json, os, util
+
+#persistent index of the FITS files that have already been downloaded to a directory (./data/hmi by default)
+#files are identified by their record time (T_REC, or DATE-OBS if there is no T_REC), series and cadence, which are read from the FITS headers only - the image data is never decompressed
+#the index is saved as json next to the files, so rescanning only has to read headers of files that are new or have changed since the last scan
+class Catalog():
+    path = "./data/hmi" #directory that is indexed
+    name = "index.json" #name of the index file inside of [path]
+
+    def __init__(self, path=None):
+        if path is not None:
+            self.path = path
+        self.entries = {} #file name -> {'time': unix time (utc), 'series', 'cadence', 'size', 'mtime'}
+        self.load()
+        self.scan()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.path, self.name), 'r') as fh:
+                self.entries = json.load(fh)
+        except (OSError, ValueError): #missing or broken index - everything will be rescanned
+            self.entries = {}
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, self.name + ".tmp")
+        with open(tmp, 'w') as fh:
+            json.dump(self.entries, fh)
+        os.replace(tmp, os.path.join(self.path, self.name)) #replace in one step so a crash never leaves a half written index
+
+    #updates the index with any files that were added, changed or removed since the last scan
+    def scan(self):
+        if not os.path.isdir(self.path):
+            return
+        changed = False
+        found = set()
+        for file in os.listdir(self.path):
+            if not file.lower().endswith(('.fits', '.fts', '.fits.gz')):
+                continue
+            found.add(file)
+            stat = os.stat(os.path.join(self.path, file))
+            entry = self.entries.get(file)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            entry = self.read_header(file)
+            changed = True
+            if entry is None:
+                self.entries.pop(file, None)
+                continue
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime
+            self.entries[file] = entry
+        for file in list(self.entries.keys()):
+            if file not in found:
+                del self.entries[file]
+                changed = True
+        if changed:
+            self.save()
+
+    def read_header(self, file):
+        try:
+            with fits.open(os.path.join(self.path, file)) as hdul:
+                header = hdul[-1].header #hmi files are tile compressed, so the image header is in the last hdu
+                t_rec = header.get('T_REC')
+                cadence = header.get('CADENCE')
+                date = header.get('DATE-OBS')
+        except (OSError, IndexError): #broken or partially downloaded file
+            return None
+        try:
+            if t_rec is not None:
+                #T_REC is in TAI and formatted like 2017.01.21_09:45:00_TAI
+                time = astropy.time.Time(t_rec[0:19].replace('.', '-').replace('_', 'T'), scale='tai', format='isot').utc
+            elif date is not None:
+                time = astropy.time.Time(date.rstrip('Z'), scale='utc', format='isot')
+            else:
+                return None
+        except ValueError:
+            return None
+        return {'time': float(time.unix), 'series': self.get_series(file, cadence), 'cadence': cadence}
+
+    def get_series(self, file, cadence): #hmi headers do not contain the series name, so it is determined from the cadence or file name
+        if cadence is not None:
+            return "hmi.m_%ds" % (int(cadence + 0.5))
+        name = file.lower().replace('_', '.')
+        for series in ("hmi.m.720s", "hmi.m.45s"):
+            if name.startswith(series):
+                return series.replace("m.", "m_")
+        return None
+
+    #returns the file closest to each time in [times] with the given series, or None if there isn't one within [tolerance] seconds
+    def find(self, times: astropy.time.Time, series, tolerance):
+        files = [file for file, entry in self.entries.items() if entry['series'] == series]
+        if len(files) == 0:
+            return [None] * len(times)
+        known = np.array([self.entries[file]['time'] for file in files])
+        idx, err = util.select_frames(known, times.unix)
+        return [os.path.join(self.path, files[i]) if abs(e) <= tolerance else None for i, e in zip(idx, err)]
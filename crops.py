@@ -0,0 +1,73 @@
+import numpy as np
+
+#cuts boxes out of frames for the movie player - the parts of a box that are outside of the frame are filled with [pad]
+#every crop is written straight into its output once: the part inside the frame is copied and only the edges outside of it are filled, instead of padding with np.append, which copies the whole crop again for every side
+#the crops of one call are written into a single (frames x width x height) buffer that is kept and reused by the next call, so zooming and tracking don't allocate a new stack every time
+#a Cropper belongs to one viewer - the crops it returns are views of its buffer, which are overwritten by its next call
+#boxes are (x1, x2, y1, y2) in display orientation (see Projection_.transform), like the boxes MList.crop works out
+class Cropper():
+    pad = 0 #value of the pixels outside of the frame - 0, or np.nan to leave them blank
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+        self.buffer = None
+
+    #crops every frame in [frames] to its box in [boxes] and returns the crops as a list
+    #a frame is either an array in display orientation, or a (shape, read) pair for frames that are read a box at a time - shape is the shape of the frame in display orientation and read(x1, x2, y1, y2) returns a box inside of it
+    #crops that are inside an array are views of that array, and nothing is copied for them
+    def crop(self, frames, boxes, dtype=np.float32):
+        copies = [j for j, (frame, box) in enumerate(zip(frames, boxes)) if not (isinstance(frame, np.ndarray) and inside(frame.shape, box))]
+        stack = self.stack(len(copies), max((boxes[j][1] - boxes[j][0] for j in copies), default=0), max((boxes[j][3] - boxes[j][2] for j in copies), default=0), dtype)
+        ans = []
+        k = 0 #next crop of the stack
+        for frame, (x1, x2, y1, y2) in zip(frames, boxes):
+            if isinstance(frame, np.ndarray) and inside(frame.shape, (x1, x2, y1, y2)):
+                ans.append(frame[x1:x2, y1:y2])
+                continue
+            if isinstance(frame, np.ndarray):
+                shape, read = frame.shape, lambda xa, xb, ya, yb, frame=frame: frame[xa:xb, ya:yb]
+            else:
+                shape, read = frame
+            out = stack[k, :x2 - x1, :y2 - y1]
+            k += 1
+            xa, xb, ya, yb = clip(shape, (x1, x2, y1, y2))
+            self.fill(out, xa - x1, xb - x1, ya - y1, yb - y1)
+            if xa < xb and ya < yb:
+                out[xa - x1:xb - x1, ya - y1:yb - y1] = read(xa, xb, ya, yb)
+            ans.append(out)
+        return ans
+
+    #crops frames [indices] of [data], a (frames x width x height) array in display orientation, all to the same box - in one step for every frame
+    def crop_stack(self, data, indices, box, dtype=np.float32):
+        x1, x2, y1, y2 = box
+        if inside(data.shape[1:], box):
+            return [data[i, x1:x2, y1:y2] for i in indices]
+        out = self.stack(len(indices), x2 - x1, y2 - y1, dtype)
+        xa, xb, ya, yb = clip(data.shape[1:], box)
+        self.fill(out, xa - x1, xb - x1, ya - y1, yb - y1)
+        if xa < xb and ya < yb:
+            out[:, xa - x1:xb - x1, ya - y1:yb - y1] = data[indices, xa:xb, ya:yb]
+        return list(out)
+
+    def stack(self, n, w, h, dtype): #(n x w x h) contiguous array in the buffer - a larger buffer is only made when it doesn't fit
+        size = n*w*h
+        if self.buffer is None or self.buffer.dtype != dtype or self.buffer.size < size:
+            self.buffer = np.empty(size, dtype=dtype)
+        return self.buffer[:size].reshape((n, w, h))
+
+    def fill(self, out, xa, xb, ya, yb): #fills everything in [out] (one crop, or a stack of them) outside of out[xa:xb, ya:yb] with pad
+        xa, xb = max(xa, 0), max(xb, xa, 0)
+        ya, yb = max(ya, 0), max(yb, ya, 0)
+        out[..., :xa, :] = self.pad
+        out[..., xb:, :] = self.pad
+        out[..., xa:xb, :ya] = self.pad
+        out[..., xa:xb, yb:] = self.pad
+
+def inside(shape, box): #True if box is completely inside a frame of the given shape
+    x1, x2, y1, y2 = box
+    return 0 <= x1 <= x2 <= shape[0] and 0 <= y1 <= y2 <= shape[1]
+
+def clip(shape, box): #part of box that is inside a frame of the given shape
+    x1, x2, y1, y2 = box
+    return min(max(x1, 0), shape[0]), min(max(x2, 0), shape[0]), min(max(y1, 0), shape[1]), min(max(y2, 0), shape[1])
@@ -0,0 +1,115 @@
+import sunpy.map
+import astropy.time
+
+import numpy as np
+import util
+
+#one level of an MList (hpc4096, cea2048...) stored as a single contiguous (frames x height x width) array plus a table of per-frame header values
+#it behaves like the list of sunpy maps it replaces: cube[i] is a sunpy map whose data is a view of data[i], and frames can be inserted with insert
+#frames stored as int16 (see util.encode) are decoded by cube[i] - data and raw(i) hold them as they are stored
+#operations over every frame (cropping, statistics, differencing...) can work on the data array directly instead of looping over maps
+class FrameCube():
+    keys = ('crpix1', 'crpix2', 'crval1', 'crval2', 'cdelt1', 'cdelt2', 'crota2', 'rsun_obs', 'dsun_obs', 'hgln_obs', 'hglt_obs') #header values copied into table - frames without one get nan
+
+    def __init__(self, maps=()):
+        self.meta = [] #header of every frame
+        self.maps = [] #sunpy map for every frame, created the first time it is used
+        self.n = 0
+        self._data = None #data of every frame, with room for more frames at the end - only the first n are used
+        self._table = None
+        maps = list(maps)
+        if len(maps) > 0: #allocated at exactly the number of frames - only frames inserted later make room for more
+            first = np.asarray(maps[0].data)
+            self._data = np.empty((len(maps),) + first.shape, dtype=first.dtype)
+        for m in maps:
+            self.insert(self.n, m)
+
+    @property
+    def data(self): #(frames x height x width) array of every frame
+        if self._data is None:
+            return np.zeros((0, 0, 0))
+        return self._data[:self.n]
+
+    @property
+    def table(self): #structured array with one row per frame: 'time' (unix time of the observation) and every header value in keys
+        if self._table is None:
+            table = np.full(self.n, np.nan, dtype=[('time', float)] + [(key, float) for key in self.keys])
+            for i, meta in enumerate(self.meta):
+                for key in self.keys:
+                    if key in meta:
+                        table[key][i] = float(meta[key])
+            if self.n > 0:
+                table['time'] = astropy.time.Time([meta.get('date-obs', meta.get('date_obs')) for meta in self.meta], scale='utc').unix
+            self._table = table
+        return self._table
+
+    @property
+    def times(self): #unix time of every frame
+        return self.table['time']
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        return util.decoded(self.raw(i))
+
+    def raw(self, i): #frame i as it is stored
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError("FrameCube index out of range")
+        if self.maps[i] is None:
+            self.maps[i] = sunpy.map.Map((self._data[i], self.meta[i]))
+        return self.maps[i]
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
+
+    def insert(self, i, m): #inserts map m before frame i, like list.insert
+        data = np.asarray(m.data)
+        if self._data is None:
+            self._data = np.empty((1,) + data.shape, dtype=data.dtype)
+        if data.shape != self._data.shape[1:]:
+            raise ValueError(f"Frame of shape {data.shape} does not fit in a cube of {self._data.shape[1:]} frames")
+        i = max(0, min(self.n, i if i >= 0 else self.n + i))
+        if self.n == len(self._data): #out of room - the array is doubled so appending frames one at a time doesn't copy everything every time
+            new = np.empty((2*len(self._data),) + self._data.shape[1:], dtype=self._data.dtype)
+            new[:self.n] = self._data[:self.n]
+            self._data = new
+            self.maps = [None] * self.n #maps still point into the old array
+        self._data[i + 1:self.n + 1] = self._data[i:self.n]
+        self._data[i] = data
+        self.meta.insert(i, m.meta)
+        self.maps = self.maps[:i] + [None] * (self.n + 1 - i) #maps after i point to the wrong frame now
+        self.n += 1
+        self._table = None
+
+    def append(self, m):
+        self.insert(self.n, m)
+
+    def __getstate__(self): #the unused room at the end of the array and the sunpy maps aren't pickled
+        return {'_data': None if self._data is None else self.data.copy(), 'meta': self.meta, 'maps': [None] * self.n, 'n': self.n, '_table': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+#frames of a level that are memory mapped from disk (framestore.LazyMaps), kept in a plain list so they aren't loaded into ram
+#like FrameCube, frames stored as int16 are decoded when they are indexed and raw(i) gives them as they are stored
+class FrameList(list):
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return util.decoded(self.raw(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def raw(self, i):
+        return list.__getitem__(self, i)
+
+    def __reduce__(self): #pickled as stored
+        return (FrameList, ([self.raw(i) for i in range(len(self))],))
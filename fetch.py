@@ -0,0 +1,289 @@
+import sunpy.map
+from sunpy.net import Fido, fido_factory
+from sunpy.net import attrs as a
+
+from astropy.io import fits
+from astropy.utils.exceptions import AstropyUserWarning
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests, parfive, threading, time, math, os, hashlib, random, warnings
+
+#downloads search results with a bounded pool of workers and decodes each file as soon as it lands
+#unlike fetching in fixed batches, a new transfer is started the moment one finishes, so there are always [max_workers] downloads in flight until the queue runs dry
+#every file gets an entry in [timings], which can be used to tune max_workers for a given connection
+class FetchEngine():
+    max_workers = 8 #maximum number of files being downloaded at the same time
+    path = "./data/hmi" #directory files are downloaded to
+    overwrite = False #if False, files that have already been downloaded are reused
+    manager = None #DownloadManager used to download each file - a default one is created if not given
+    store = None #if a framestore.FrameStore is given, files are decompressed into it and returned as memory mapped LazyMaps instead of sunpy maps
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+        self.timings = [] #one dict per file: index, file, queued (seconds spent waiting for a worker), fetch and decode (seconds), total
+        self.failed = [] #(index, row) of every file that could not be downloaded
+        self.lock = threading.Lock()
+        if self.manager is None:
+            self.manager = DownloadManager(path=self.path)
+
+    #fetches every row in [rows] (search results, or paths of files that have already been downloaded) and yields (index, map) pairs in the order in which they finish, where index is the position of the row in [rows]
+    #files that still can't be downloaded after [manager.retries] attempts are skipped and listed in [failed]
+    def run(self, rows):
+        start = time.perf_counter()
+        remote = [i for i, row in enumerate(rows) if not isinstance(row, (str, os.PathLike))]
+        resolved = [None] * len(rows)
+        for i, r in zip(remote, self.manager.resolve_many([rows[i] for i in remote])): #all urls are found up front (one jsoc export instead of one per file) - the workers only download
+            resolved[i] = r
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.fetch_one, i, row, start, resolved[i]) for i, row in enumerate(rows)]
+            for future in as_completed(futures):
+                i, m = future.result()
+                if m is not None:
+                    yield i, m
+
+    #same as run, but blocks until everything is done and returns the maps in the same order as [rows]
+    def fetch(self, rows):
+        maps = [None] * len(rows)
+        for i, m in self.run(rows):
+            maps[i] = m
+        return [m for m in maps if m is not None]
+
+    def fetch_one(self, i, row, start=None, resolved=None): #resolved is the (url, filename) of row if it is already known
+        t0 = time.perf_counter()
+        local = isinstance(row, (str, os.PathLike)) #files that are already on disk only need to be opened
+        try:
+            file = row if local else self.manager.fetch(row, self.overwrite, resolved)
+            t1 = time.perf_counter()
+            try:
+                m = self.decode(file)
+            except OSError: #in case the file is broken even though it passed verification - only this file is downloaded again
+                self.manager.quarantine(file)
+                if local:
+                    raise DownloadError(f"{file} is broken")
+                file = self.manager.fetch(row, True, resolved)
+                m = self.decode(file)
+        except (DownloadError, OSError) as e:
+            print(f"Skipping file: {e}")
+            with self.lock:
+                self.failed.append((i, row))
+            return i, None
+        t2 = time.perf_counter()
+
+        with self.lock:
+            self.timings.append({
+                'index': i,
+                'file': str(file),
+                'queued': t0 - start if start is not None else 0,
+                'fetch': t1 - t0,
+                'decode': t2 - t1,
+                'total': t2 - t0,
+            })
+        return i, m
+
+    def decode(self, file):
+        if self.store is not None:
+            return self.store.open(file)
+        return sunpy.map.Map(file)
+
+    #summary of the recorded timings - useful for comparing different values of max_workers
+    def stats(self):
+        if len(self.timings) == 0:
+            return {}
+        fetch = sorted(t['fetch'] for t in self.timings)
+        decode = sorted(t['decode'] for t in self.timings)
+        wall = max(t['queued'] + t['total'] for t in self.timings)
+        return {
+            'files': len(self.timings),
+            'max_workers': self.max_workers,
+            'wall': wall,
+            'files_per_second': len(self.timings)/wall if wall > 0 else math.inf,
+            'fetch_median': fetch[len(fetch)//2],
+            'fetch_max': fetch[-1],
+            'decode_median': decode[len(decode)//2],
+            'decode_max': decode[-1],
+        }
+
+#downloads single files with bounded retries instead of refetching whole batches
+#search results are resolved to urls through Fido (see URLRecorder) and then downloaded here, so that:
+# - every file is retried on its own with exponential backoff, up to [retries] attempts
+# - partially downloaded files are kept as .part files and resumed with an http range request
+# - files are only accepted once their FITS CHECKSUM/DATASUM keywords (if present) match the data. Files that fail are moved to [quarantine] instead of being reused
+class DownloadManager():
+    path = "./data/hmi" #directory files are downloaded to
+    quarantine_path = "./data/hmi/quarantine" #directory broken files are moved to
+    retries = 5 #maximum number of attempts per file
+    backoff = 1 #seconds to wait before the first retry - doubles after every failed attempt
+    max_backoff = 60 #maximum number of seconds to wait between attempts
+    timeout = 60 #seconds to wait for the server before an attempt fails
+    chunk_size = 1 << 20 #bytes written to disk at a time
+    verify = True #if True, checksums are verified before a file is accepted
+    source = None #where search results are resolved to urls - FidoSource by default
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self.session = requests.Session()
+        if self.source is None:
+            self.source = FidoSource()
+
+    def fetch(self, row, overwrite=False, resolved=None): #downloads the file for a single search result row and returns its path - resolved is its (url, filename) if resolve_many already found it
+        return self.download(*(resolved or self.retry(self.resolve, row)), overwrite=overwrite)
+
+    def resolve(self, row): #finds the url and file name for a search result row without downloading it
+        return self.source.resolve(row, self.path)
+
+    #finds the (url, filename) of every row at once if the source can (see FidoSource.resolve_many) - rows that could not be resolved are None and are resolved on their own by fetch
+    def resolve_many(self, rows):
+        if len(rows) == 0 or not hasattr(self.source, 'resolve_many'):
+            return [None] * len(rows)
+        try:
+            return self.retry(self.source.resolve_many, rows, self.path)
+        except DownloadError as e:
+            print(f"Resolving files one at a time: {e}")
+            return [None] * len(rows)
+
+    #downloads [url] to the name given by [filename] (a file name, or a function of (response, url) like the ones Fido clients give parfive)
+    def download(self, url, filename, overwrite=False):
+        guess = self.filename(filename, None, url)
+        if not overwrite and os.path.exists(guess) and self.check(guess): #already downloaded
+            return guess
+        return self.retry(self.attempt, url, filename, overwrite)
+
+    def attempt(self, url, filename, overwrite):
+        os.makedirs(self.path, exist_ok=True)
+        part = os.path.join(self.path, "." + hashlib.sha1(url.encode()).hexdigest() + ".part") #partial downloads are named after the url so they can be found again
+        if overwrite and os.path.exists(part):
+            os.remove(part)
+        done = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': f"bytes={done}-"} if done > 0 else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 416: #nothing left to download
+                file = self.filename(filename, resp, url)
+            else:
+                resp.raise_for_status()
+                file = self.filename(filename, resp, url)
+                if not overwrite and os.path.exists(file) and self.check(file):
+                    return file
+                with open(part, 'ab' if resp.status_code == 206 else 'wb') as fh: #servers that ignore the range request send the whole file again
+                    for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                        fh.write(chunk)
+
+        if not self.check(part):
+            self.quarantine(part, os.path.basename(file))
+            raise DownloadError(f"{os.path.basename(file)} failed checksum verification")
+        os.replace(part, file)
+        return file
+
+    def retry(self, function, *args): #calls function until it succeeds, waiting longer after each failure
+        for attempt in range(self.retries):
+            try:
+                return function(*args)
+            except (requests.exceptions.RequestException, DownloadError, OSError) as e:
+                if attempt == self.retries - 1:
+                    raise DownloadError(f"Giving up after {self.retries} attempts: {e}")
+                delay = min(self.max_backoff, self.backoff * 2**attempt) * random.uniform(0.5, 1) #jitter keeps workers from retrying all at once
+                print(f"{e}: trying again in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def filename(self, filename, resp, url):
+        if callable(filename):
+            return str(filename(resp, url))
+        if filename is None:
+            filename = url.split('/')[-1].split('?')[0]
+        return os.path.join(self.path, os.path.basename(str(filename)))
+
+    def check(self, file): #returns True if file is a complete FITS file whose checksums match
+        if not self.verify:
+            return True
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", AstropyUserWarning) #astropy only warns about truncated files and bad checksums
+                with fits.open(file, memmap=False, disable_image_compression=True) as hdul: #checksums cover the compressed bytes, so nothing has to be decompressed
+                    for hdu in hdul:
+                        if 'DATASUM' in hdu.header and hdu.verify_datasum() == 0:
+                            return False
+                        if 'CHECKSUM' in hdu.header and hdu.verify_checksum() == 0:
+                            return False
+        except (OSError, ValueError, AstropyUserWarning):
+            return False
+        return True
+
+    def quarantine(self, file, name=None): #moves a broken file out of the way so it is never reused
+        if not os.path.exists(file):
+            return
+        os.makedirs(self.quarantine_path, exist_ok=True)
+        name = name or os.path.basename(file)
+        os.replace(file, os.path.join(self.quarantine_path, f"{int(time.time())}_{name}"))
+
+#searches for hmi magnetograms and resolves the results to urls through Fido (vso for hmi.m_45s, jsoc for hmi.m_720s)
+#fido can be any sunpy UnifiedDownloaderFactory instead of sunpy.net.Fido - the offline stand-in in tests/standin.py gives one that only knows its own client
+#any object with search and resolve methods can also be given to util.get_maps as a source instead
+class FidoSource():
+    fido = Fido
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+
+    def search(self, start, end, m720s=False, email=None): #returns a table of results with 'Start Time' (or 'T_REC' for hmi.m_720s) columns
+        if not m720s:
+            r = self.fido.search(a.Time(start, end), a.Instrument.hmi, a.Physobs.los_magnetic_field)
+        else:
+            r = self.fido.search(a.Time(start, end), a.jsoc.Series("hmi.m_720s"), a.jsoc.Notify(email))
+        return r[0]
+
+    def resolve(self, row, path): #returns (url, filename) for a single result - filename can also be a function of (response, url)
+        resolved = self.resolve_many([row], path)[0]
+        if resolved is None:
+            raise DownloadError("Search result did not resolve to a url")
+        return resolved
+
+    #returns (url, filename) for every row in [rows], or None for rows that did not resolve
+    #rows from the same search are resolved by a single Fido.fetch - jsoc always exports every file of the original search, so fetching rows one at a time would export the whole search once per row
+    def resolve_many(self, rows, path):
+        resolved = [None] * len(rows)
+        tables = {}
+        for k, row in enumerate(rows):
+            tables.setdefault(id(row.table), (row.table, []))[1].append(k)
+        for table, ks in tables.values():
+            recorder = URLRecorder()
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", message="Downloading of sliced JSOC results") #expected - the urls of the other files are ignored below
+                self.fido.fetch(fido_factory.UnifiedResponse(table[[rows[k].index for k in ks]]), path=path, downloader=recorder, progress=False)
+            if len(recorder.queue) == len(ks): #one file per row, in the same order
+                for k, r in zip(ks, recorder.queue):
+                    resolved[k] = r
+                continue
+            for k in ks: #otherwise files are matched to rows by their record time (hmi.m_720s.20170121_094500_TAI.1.magnetogram.fits)
+                stamp = record_stamp(rows[k])
+                for url, filename in recorder.queue:
+                    if stamp is not None and stamp in (url if callable(filename) or filename is None else os.path.basename(str(filename))):
+                        resolved[k] = (url, filename)
+                        break
+        return resolved
+
+#record time of a search result formatted like in jsoc file names (20170121_094500), or None if it has no T_REC
+def record_stamp(row):
+    if 'T_REC' not in row.colnames:
+        return None
+    t_rec = str(row['T_REC'])[:19] #2017.01.21_09:45:00
+    return t_rec.replace('.', '').replace(':', '')
+
+#parfive downloader that records the urls Fido clients give it instead of downloading them
+class URLRecorder(parfive.Downloader):
+    def __init__(self):
+        super().__init__(progress=False)
+        self.queue = [] #(url, filename)
+
+    def enqueue_file(self, url, path=None, filename=None, **kwargs):
+        if filename is None and path is not None:
+            filename = os.path.join(str(path), url.split('/')[-1])
+        self.queue.append((url, filename))
+
+    def download(self, *args, **kwargs):
+        return parfive.Results()
+
+class DownloadError(Exception):
+    pass
@@ -0,0 +1,157 @@
+import sunpy.map
+import astropy.time
+
+import numpy as np
+import json, os, hashlib, tiles
+
+#on-disk cache of decompressed frames
+#FITS files are decompressed once into uncompressed .npy files, which are then memory mapped, so a frame only takes up ram while its pixels are actually being used
+#frames are handed out as LazyMaps, which behave like sunpy maps but only hold a file name and the header until the data is needed
+class FrameStore():
+    path = "./data/cache" #directory the decompressed frames are kept in
+    decompress = True #if False, FITS files are not decompressed into the cache - their LazyMaps read the compressed file directly, so crops only decompress the tiles they need (see tiles.py)
+
+    def __init__(self, path=None, decompress=None):
+        if path is not None:
+            self.path = path
+        if decompress is not None:
+            self.decompress = decompress
+        os.makedirs(self.path, exist_ok=True)
+
+    def open(self, file): #returns a LazyMap for a FITS file, decompressing it into the cache the first time it is opened
+        stat = os.stat(file)
+        name = "%s-%d-%d" % (os.path.basename(file).split('.fits')[0], stat.st_size, int(stat.st_mtime)) #a new copy of the file gets a new name
+        if not self.decompress:
+            m = LazyMap(None, tiles.read_header(file), name, source=file)
+        elif not self.has(name):
+            m = self.put(sunpy.map.Map(file), name)
+        else:
+            m = self.get(name)
+        m.digest = self.digest(file, name)
+        return m
+
+    def digest(self, file, name): #sha1 of the contents of a FITS file - it is only computed the first time the file is opened, and kept next to the cached frame
+        sidecar = self.file(name, '.sha1')
+        if os.path.exists(sidecar):
+            with open(sidecar, 'r') as fh:
+                return fh.read().strip()
+        sha = hashlib.sha1()
+        with open(file, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 22), b''):
+                sha.update(block)
+        with open(sidecar + ".tmp", 'w') as fh:
+            fh.write(sha.hexdigest())
+        os.replace(sidecar + ".tmp", sidecar)
+        return sha.hexdigest()
+
+    def get(self, name): #returns the LazyMap for a frame that is already in the cache
+        with open(self.file(name, '.json'), 'r') as fh:
+            meta = json.load(fh)
+        return LazyMap(self.file(name, '.npy'), meta, name)
+
+    def has(self, name): #True if a frame is in the cache
+        return os.path.exists(self.file(name, '.json'))
+
+    def put(self, m, name): #writes a sunpy map to the cache and returns a LazyMap for it
+        data = np.lib.format.open_memmap(self.file(name, '.npy') + ".tmp", mode='w+', dtype=m.data.dtype, shape=m.data.shape)
+        data[:] = m.data
+        data.flush()
+        del data
+        os.replace(self.file(name, '.npy') + ".tmp", self.file(name, '.npy'))
+        with open(self.file(name, '.json') + ".tmp", 'w') as fh:
+            json.dump(dict(m.meta), fh, default=str)
+        os.replace(self.file(name, '.json') + ".tmp", self.file(name, '.json')) #the header is written last, so a frame only counts as cached once both files are complete
+        return self.get(name)
+
+    def file(self, name, ext):
+        return os.path.join(self.path, name + ext)
+
+    def name(self, m): #name for a frame that didn't come from a file in the store
+        return name(m)
+
+    def source(self, m): #identifies the source data of a frame for content addressed names - the hash of its FITS file if it was opened from one, name(m) otherwise
+        if isinstance(m, LazyMap) and m.digest is not None:
+            return m.digest
+        return self.name(m)
+
+    def clear(self): #removes every cached frame
+        for file in os.listdir(self.path):
+            if file.endswith(('.npy', '.json', '.sha1', '.tmp')):
+                os.remove(os.path.join(self.path, file))
+
+def name(m): #name of a frame - LazyMaps keep theirs, other maps are named after their date and a sample of their data
+    if isinstance(m, LazyMap) and m.name is not None:
+        return m.name
+    return "%s-%s" % (m.date.strftime("%Y%m%d_%H%M%S"), hashlib.sha1(np.ascontiguousarray(m.data[::64, ::64]).tobytes()).hexdigest()[:12])
+
+#stands in for a sunpy map whose data lives in a .npy file
+#the sunpy map itself is only created on first use and its data is a read only memory map of the file, so pages are read from disk when they are touched and can be dropped by the os at any time
+#any attribute that isn't defined here (wcs, superpixel, reproject_to...) is passed on to the sunpy map
+#the .npy file can also hold a stack of frames (see moviefile.py) - index is then the frame of the stack this map stands for
+#a LazyMap can also stand in for a compressed FITS file that was never decompressed into the cache (file is None and source is the FITS file) - the whole image is then only decompressed (into ram) when all of the data is needed
+class LazyMap():
+    def __init__(self, file, meta, name=None, source=None, digest=None, index=None):
+        self.file = file
+        self.meta = meta
+        self.name = name
+        self.source = source
+        self.digest = digest #sha1 of the FITS file the frame came from, if it is known (see FrameStore.open)
+        self.index = index
+        self._map = None
+
+    @property
+    def map(self):
+        if self._map is None:
+            if self.file is None:
+                self._map = sunpy.map.Map(self.source)
+            else:
+                self._map = sunpy.map.Map((self.array(), self.meta))
+        return self._map
+
+    @property
+    def data(self):
+        return self.map.data
+
+    @property
+    def loaded(self): #True if the sunpy map (and, for compressed files, the whole image) is currently in memory
+        return self._map is not None
+
+    @property
+    def date(self): #time of the observation, read from the header so the map isn't created (sorting frames by date would load all of them otherwise)
+        if self._map is not None or 'date-obs' not in self.meta:
+            return self.map.date
+        scale = str(self.meta.get('timesys', 'utc')).lower()
+        return astropy.time.Time(self.meta['date-obs'], scale=scale if scale in astropy.time.Time.SCALES else 'utc')
+
+    @property
+    def shape(self): #shape of the data, read from the FITS or .npy header so nothing has to be loaded
+        if self._map is not None:
+            return self._map.data.shape
+        if self.file is None:
+            return int(self.meta['naxis2']), int(self.meta['naxis1'])
+        return self.array().shape
+
+    def read_box(self, r1, r2, c1, c2): #returns data[r1:r2, c1:c2] while only reading that part of the frame from disk
+        if self._map is not None:
+            return np.array(self._map.data[r1:r2, c1:c2])
+        if self.file is None:
+            return tiles.read_box(self.source, r1, r2, c1, c2) #only the tiles intersecting the box are decompressed
+        return np.array(self.array()[r1:r2, c1:c2])
+
+    def array(self): #read only memory map of the data in file
+        data = np.load(self.file, mmap_mode='r')
+        return data if self.index is None else data[self.index]
+
+    def release(self): #drops the sunpy map - it will be recreated from the file the next time it is needed
+        self._map = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_map', 'file', 'meta', 'name', 'source', 'digest', 'index'): #keeps copy and pickle from creating the map
+            raise AttributeError(name)
+        return getattr(self.map, name)
+
+    def __getstate__(self): #only the file names and header are pickled, not the data
+        return {'file': self.file, 'meta': self.meta, 'name': self.name, 'source': self.source, 'digest': self.digest, 'index': self.index, '_map': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update({'digest': None, 'index': None, **state})
@@ -10,7 +10,8 @@ while True:
         m = str(e)[17:-1].replace('-', '_')
         subprocess.call(["python", "-m", "pip", "install", "--trusted-host", "pypi.org", "--trusted-host", "files.pythonhosted.org", m, "-vvv"])
             
-def get_files(d):
+#host and port can be changed to point at a mirror or the offline stand-in in tests/standin.py
+def get_files(d, host='ftp.swpc.noaa.gov', port=21):
     def get_ar_number(date, num): #ar numbers are only 4 digits so some are repeated - need to make a distinction
         if date[:4] == "2002": #2002 is only year with both 9999 and 0000s
             if int(num) > 5000:
@@ -51,7 +52,8 @@ def get_files(d):
         # print(data)
         return data
 
-    ftp = FTP('ftp.swpc.noaa.gov')
+    ftp = FTP()
+    ftp.connect(host, port)
     ftp.login()
     ftp.cwd('pub/warehouse')
 
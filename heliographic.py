@@ -0,0 +1,231 @@
+from astropy.wcs import WCS
+import sunpy.map
+
+import numpy as np
+import remap
+
+#closed form helioprojective <-> heliographic <-> cylindrical equal area transforms in numpy, given the observer's b0, l0, distance and the roll of the image - astropy's wcs and frame machinery isn't used
+#everything works on arrays of points at once and follows the fits wcs conventions (Calabretta & Greisen 2002) for the TAN and CEA projections, so results agree with sunpy/astropy to far below a pixel
+#angles are in degrees except for helioprojective coordinates, which are in arcsec like hmi headers. Heliographic coordinates are stonyhurst unless said otherwise
+#internally points are kept as cartesian vectors (tuples of 3 arrays), which avoids most of the trigonometry: the TAN projection of a vector is just two divisions
+RSUN = 695700000 #m - sunpy's default solar radius, for headers without rsun_ref
+
+#position of the observer in heliographic stonyhurst coordinates
+#carrington is the carrington longitude of the observer minus its stonyhurst longitude, which is all that is needed to go between the two
+class Observer():
+    lon = 0 #hgln_obs
+    lat = 0 #hglt_obs (b0)
+    distance = 149597870700 #dsun_obs, m
+    rsun = RSUN #m
+    carrington = None
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+
+    @classmethod
+    def from_meta(cls, meta):
+        observer = cls(lon=float(meta.get('hgln_obs', 0)), lat=float(meta.get('hglt_obs', 0)), distance=float(meta.get('dsun_obs', cls.distance)), rsun=float(meta.get('rsun_ref', RSUN)))
+        if 'crln_obs' in meta:
+            observer.carrington = float(meta['crln_obs']) - observer.lon
+        return observer
+
+    def position(self): #heliographic cartesian position in m
+        return self.distance * np.array(unit(self.lon, self.lat))
+
+    #rows turn a heliographic cartesian vector into helioprojective cartesian (towards the sun, to solar west, to solar north)
+    def axes(self):
+        z = np.array(unit(self.lon, self.lat)) #towards the observer
+        x = np.cross([0, 0, 1], z)
+        x = x / np.linalg.norm(x)
+        return np.stack([-z, x, np.cross(z, x)])
+
+    def to_hpc(self, p, visible=False): #helioprojective vectors (not normalized) of heliographic points p (m) - if visible, points behind the sun give nan
+        o = self.position()
+        v = rotate(self.axes(), (p[0] - o[0], p[1] - o[1], p[2] - o[2]))
+        if visible:
+            hidden = o[0]*p[0] + o[1]*p[1] + o[2]*p[2] < self.rsun**2
+            v = tuple(np.where(hidden, np.nan, c) for c in v)
+        return v
+
+    def to_hg(self, s): #heliographic points (m) seen along helioprojective unit vectors s - the closest intersection of the line of sight with the sun, nan if it misses
+        o = self.position()
+        d = rotate(self.axes().T, s)
+        b = o[0]*d[0] + o[1]*d[1] + o[2]*d[2]
+        with np.errstate(invalid='ignore'):
+            t = -b - np.sqrt(b**2 - (self.distance**2 - self.rsun**2))
+        return o[0] + t*d[0], o[1] + t*d[1], o[2] + t*d[2]
+
+#pixel grid of a map with a TAN (helioprojective) or CEA (heliographic) projection, read from its header
+#to_vector and to_pixel convert between 0 based pixel coordinates and unit vectors in the frame of the map, pixel_to_world and world_to_pixel between pixels and coordinates in degrees
+class Grid():
+    def __init__(self, meta):
+        ctype = str(meta.get('ctype1', 'HPLN-TAN'))
+        self.projection = ctype[5:8]
+        if self.projection not in ('TAN', 'CEA'):
+            raise ProjectionError(f"{ctype} projections are not supported")
+        self.frame = ctype[:2] #HP, HG (stonyhurst) or CR (carrington)
+        self.crpix = np.array([float(meta['crpix1']), float(meta['crpix2'])])
+        self.units = np.array([to_degrees(meta.get(f'cunit{i}', 'deg')) for i in (1, 2)])
+        self.crval = np.array([float(meta.get('crval1', 0)), float(meta.get('crval2', 0))]) * self.units
+        self.matrix = self.linear(meta) * self.units[:, None] #pixel offsets -> intermediate coordinates in degrees
+        self.inverse = np.linalg.inv(self.matrix)
+        self.cea = float(meta.get('pv2_1', 1)) #lambda of the CEA projection
+        self.rotation = self.sphere(meta)
+
+    def linear(self, meta): #cd matrix of the header, from cd, pc and cdelt or crota2
+        if 'cd1_1' in meta:
+            return np.array([[float(meta.get(f'cd{i}_{j}', 0)) for j in (1, 2)] for i in (1, 2)])
+        cdelt = np.array([float(meta.get('cdelt1', 1)), float(meta.get('cdelt2', 1))])
+        if 'pc1_1' in meta:
+            pc = np.array([[float(meta.get(f'pc{i}_{j}', float(i == j))) for j in (1, 2)] for i in (1, 2)])
+        else:
+            rho = np.radians(float(meta.get('crota2', meta.get('crota1', 0))))
+            pc = np.array([[np.cos(rho), -np.sin(rho)*cdelt[1]/cdelt[0]], [np.sin(rho)*cdelt[0]/cdelt[1], np.cos(rho)]])
+        return cdelt[:, None] * pc
+
+    #rotation from native spherical coordinates of the projection to the coordinates of the frame, from the reference point and the native longitude of the pole (lonpole)
+    def sphere(self, meta):
+        a0, d0 = self.crval
+        if self.projection == 'TAN': #zenithal - the reference point is the native pole
+            phi0, theta0 = 0, 90
+            lonpole = float(meta.get('lonpole', 180 if d0 < 90 else 0))
+            dp = d0
+        else: #cylindrical - the reference point is on the native equator
+            phi0, theta0 = 0, 0
+            lonpole = float(meta.get('lonpole', 0 if d0 >= 0 else 180))
+            latpole = float(meta.get('latpole', 90))
+            c = np.cos(np.radians(lonpole - phi0))
+            dp = np.degrees(np.arccos(np.clip(np.sin(np.radians(d0)) / c, -1, 1))) if abs(c) > 1e-12 else 90
+            dp = dp if abs(dp - latpole) <= abs(dp + latpole) else -dp #of the two solutions, the one closest to latpole
+        #the reference point and the celestial pole are known in both systems, which fixes the rotation
+        native = triad(np.array(unit(phi0, theta0)), np.array(unit(lonpole, dp)))
+        frame = triad(np.array(unit(a0, d0)), np.array([0., 0., 1.]))
+        return frame @ native.T
+
+    def to_vector(self, x, y): #unit vectors of 0 based pixel coordinates - nan for pixels outside of the projection
+        x, y = np.asarray(x, dtype=float) + 1 - self.crpix[0], np.asarray(y, dtype=float) + 1 - self.crpix[1]
+        ix = np.radians(self.matrix[0, 0]*x + self.matrix[0, 1]*y)
+        iy = np.radians(self.matrix[1, 0]*x + self.matrix[1, 1]*y)
+        if self.projection == 'TAN':
+            r = np.sqrt(1 + ix**2 + iy**2)
+            n = (-iy/r, ix/r, 1/r)
+        else:
+            s = iy * self.cea
+            with np.errstate(invalid='ignore'):
+                c = np.where(np.abs(ix) <= np.pi, np.sqrt(1 - s**2), np.nan)
+            n = (c*np.cos(ix), c*np.sin(ix), s)
+        return rotate(self.rotation, n)
+
+    def to_pixel(self, v): #0 based pixel coordinates of vectors (TAN doesn't need them to be normalized) - nan for the far hemisphere of TAN
+        n = rotate(self.rotation.T, v)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.projection == 'TAN':
+                z = np.where(n[2] > 0, n[2], np.nan)
+                ix, iy = np.degrees(n[1]/z), np.degrees(-n[0]/z)
+            else:
+                ix = np.degrees(np.arctan2(n[1], n[0]))
+                iy = np.degrees(n[2]/np.sqrt(n[0]**2 + n[1]**2 + n[2]**2)) / self.cea
+        return self.inverse[0, 0]*ix + self.inverse[0, 1]*iy + self.crpix[0] - 1, self.inverse[1, 0]*ix + self.inverse[1, 1]*iy + self.crpix[1] - 1
+
+    def pixel_to_world(self, x, y): #returns (lon, lat) in degrees
+        return lonlat(self.to_vector(x, y))
+
+    def world_to_pixel(self, lon, lat):
+        return self.to_pixel(unit(lon, lat))
+
+#helioprojective (arcsec) -> heliographic stonyhurst (degrees) - nan off the disk
+def hpc_to_hg(tx, ty, observer):
+    return lonlat(observer.to_hg(unit(np.asarray(tx)/3600, np.asarray(ty)/3600)))
+
+#heliographic stonyhurst (degrees) -> helioprojective (arcsec) of points on the surface of the sun
+#if visible is True, points on the far side of the sun give nan
+def hg_to_hpc(lon, lat, observer, visible=False):
+    tx, ty = lonlat(observer.to_hpc(surface(lon, lat, observer), visible=visible))
+    return tx*3600, ty*3600
+
+#conversions for sunpy maps (or anything with a .meta) - pixel coordinates are 0 based, like sunpy's
+def pixel_to_world(m, x, y): #coordinates in the frame of m, in its units (arcsec for helioprojective, degrees for heliographic) - what projections.get_lat_lon(m.wcs.pixel_to_world(x, y)) gives
+    grid = Grid(m.meta)
+    lon, lat = grid.pixel_to_world(x, y)
+    return lon / grid.units[0], lat / grid.units[1]
+
+def world_to_pixel(m, x, y): #inverse of pixel_to_world
+    grid = Grid(m.meta)
+    return grid.world_to_pixel(np.asarray(x) * grid.units[0], np.asarray(y) * grid.units[1])
+
+def pixel_to_hg(m, x, y): #heliographic stonyhurst coordinates (degrees) of pixels of m - nan off the disk
+    grid = Grid(m.meta)
+    observer = Observer.from_meta(m.meta)
+    if grid.frame == 'HP':
+        return lonlat(observer.to_hg(grid.to_vector(x, y)))
+    lon, lat = grid.pixel_to_world(x, y)
+    if grid.frame == 'CR':
+        lon = wrap(lon - carrington(observer))
+    return lon, lat
+
+def hg_to_pixel(m, lon, lat, visible=True): #pixel coordinates of heliographic stonyhurst coordinates on m - if visible, points behind the sun give nan
+    grid = Grid(m.meta)
+    observer = Observer.from_meta(m.meta)
+    if grid.frame == 'HP':
+        return grid.to_pixel(observer.to_hpc(surface(lon, lat, observer), visible=visible))
+    if grid.frame == 'CR':
+        lon = np.asarray(lon) + carrington(observer)
+    return grid.world_to_pixel(lon, lat)
+
+#reprojects helioprojective sunpy map m to the heliographic wcs in header (e.g. CylindricalEqualArea.header(m)), with bilinear interpolation - the same as reproject_to(header) but with the coordinates computed in closed form
+def reproject(m, header):
+    shape = (int(header['naxis2']), int(header['naxis1']))
+    px, py = source_pixels(m.meta, header)
+    data = remap.Gather(px, py, m.data.shape).apply(m.data, shape)
+    return sunpy.map.GenericMap(data, WCS(header).to_header(), plot_settings=m.plot_settings)
+
+#pixel coordinates on the helioprojective image with header meta of the center of every pixel of the heliographic image with header [header] - nan for pixels on the far side of the sun
+def source_pixels(meta, header):
+    out = Grid(header)
+    observer = Observer.from_meta(meta)
+    y, x = np.indices((int(header['naxis2']), int(header['naxis1'])), dtype=float)
+    v = out.to_vector(x, y)
+    if out.frame == 'CR':
+        v = rotate(spin(-carrington(observer)), v)
+    p = tuple(c*observer.rsun for c in v)
+    return Grid(meta).to_pixel(observer.to_hpc(p, visible=True))
+
+def surface(lon, lat, observer): #heliographic cartesian points (m) on the surface of the sun
+    return tuple(c*observer.rsun for c in unit(lon, lat))
+
+def unit(lon, lat): #unit vectors of spherical coordinates in degrees
+    lon, lat = np.radians(lon), np.radians(lat)
+    c = np.cos(lat)
+    return c*np.cos(lon), c*np.sin(lon), np.sin(lat) + 0*lon
+
+def lonlat(v): #spherical coordinates in degrees of vectors - longitude is in [-180, 180)
+    r = np.sqrt(v[0]**2 + v[1]**2 + v[2]**2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return wrap(np.degrees(np.arctan2(v[1], v[0]))), np.degrees(np.arcsin(np.clip(v[2]/r, -1, 1)))
+
+def rotate(matrix, v): #matrix @ v for a tuple of 3 arrays
+    return tuple(matrix[i, 0]*v[0] + matrix[i, 1]*v[1] + matrix[i, 2]*v[2] for i in range(3))
+
+def spin(angle): #rotation by angle (degrees) around the solar axis
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+def triad(a, b): #orthonormal basis (as columns) with a as its first vector and b in the plane of the first two
+    b = b - np.dot(a, b)*a
+    b = b / np.linalg.norm(b)
+    return np.stack([a, b, np.cross(a, b)], axis=1)
+
+def wrap(lon):
+    return (np.asarray(lon) + 180) % 360 - 180
+
+def to_degrees(cunit):
+    return {'arcsec': 1/3600, 'arcmin': 1/60, 'deg': 1, 'rad': 180/np.pi}.get(str(cunit).strip().lower(), 1)
+
+def carrington(observer):
+    if observer.carrington is None:
+        raise ProjectionError("The header has no crln_obs, so carrington longitudes can't be converted")
+    return observer.carrington
+
+class ProjectionError(Exception):
+    pass
@@ -1,31 +1,30 @@
 from PyQt5.QtWidgets import *
 import matplotlib.pyplot as plt
-import movie, sys, pickle, time, warnings, util, search, projections
+import movie, os, sys, time, warnings, util, search, projections, framestore, moviefile
 from PyQt5.QtCore import Qt
 import sunpy.map
 import astropy.time
 import astropy.units as u
 
 
+#downloads and projects the movie and saves it to ./data/movie - runs before the window (and QApplication) is made, so the pool of processes that projects the frames isn't started from inside the gui
+def load():
+    start = time.time()
+    n = 20
+    interval = 3*u.hour
+    tstart = astropy.time.Time('2017-01-21T09:45:00', scale='utc', format='isot')
+    tend = tstart + n*interval + 1*u.s
+    maps = util.get_maps(tstart, tend, interval=interval, overwrite=True, lazy=True) #lazy - frames are memory mapped LazyMaps that carry the hash of their file, which the store below names its frames after
+    maps = movie.MList(maps, store=framestore.FrameStore(), dtype="float32") #frames projected in an earlier run are read back from the store instead of being projected again
+    maps.transform(projections.CylindricalEqualArea, workers=os.cpu_count(), progress=lambda done, total: print(f"Projected {done}/{total} frames", end="\r")) #projected right away by a pool of processes, so that save has every frame to write
+    moviefile.MovieFile('./data/movie').save(maps)
+    print(time.time() - start)
+    return moviefile.MovieFile('./data/movie').load()
+
 class AppQT(QMainWindow):
-    def __init__(self):
+    def __init__(self, maps):
         super().__init__()
 
-        start = time.time()
-        n = 20
-        interval = 3*u.hour
-        tstart = astropy.time.Time('2017-01-21T09:45:00', scale='utc', format='isot')
-        tend = tstart + n*interval + 1*u.s
-        maps = util.get_maps(tstart, tend, interval=interval, overwrite=True)
-        maps = movie.MList(maps)
-        maps.transform(projections.CylindricalEqualArea)
-        with open('maps.pkl', 'wb') as fh:
-            pickle.dump(maps, fh)
-        print(time.time() - start)
-        
-        with open('maps.pkl', 'rb') as fh:
-            maps = pickle.load(fh)
-
         # #checkerboard pattern for testing
         # for map in maps['hpc1024']:
         #     for i in range(1024):
@@ -61,10 +60,12 @@ if __name__ == '__main__':
 
     sys.excepthook = except_hook
 
+    maps = load()
+
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
 
-    window = AppQT()
+    window = AppQT(maps)
     sys.exit(app.exec_())
 
     # ar.update_ar_data()
\ No newline at end of file
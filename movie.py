@@ -1,14 +1,80 @@
-from PyQt5.QtCore import pyqtSignal, QThread, Qt, QRectF, QPointF
-from PyQt5.QtGui import QTransform, QPen, QFont
+from PyQt5.QtCore import pyqtSignal, QThread, Qt, QRectF, QPointF, QTimer
+from PyQt5.QtGui import QTransform, QPen, QFont, QKeySequence
 from PyQt5.QtWidgets import *
 
+from collections import OrderedDict, deque
+
 from astropy.coordinates import SkyCoord
 import astropy.units as u
 
 import pyqtgraph as pg
 from widgets import *
 import numpy as np
-import time, util, resources, math, projections, sunpy
+import time, util, resources, math, projections, sunpy.map, bisect, hashlib, threading, itertools, json, framestore, cube, pyramid, parallel, heliographic, crops, quantize
+
+#ring buffer of how long each stage of showing a movie takes (frame swaps, setImage, mouseMove, setTicks, crops, calc_ticks, setViewBox...)
+#stages are timed with start = timings.now() ... timings.add(stage, frame, start) - both return right away while timing is off, so it costs next to nothing unless it is turned on
+#the last [size] records can be summarized (see MoviePlayerQT.setOverlay) or exported as csv or as a chrome trace (chrome://tracing or ui.perfetto.dev)
+class Timings():
+    size = 4096 #number of records kept
+    enabled = False
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+        self.stages = [] #stage names - records keep the index of their stage
+        self.lock = threading.Lock() #stages can be added from the gui, prefetch and loader threads at once
+        self.records = np.zeros(self.size, dtype=[('stage', np.int16), ('frame', np.int32), ('start', np.float64), ('duration', np.float64), ('thread', np.uint64)])
+        self.count = itertools.count() #next record - next() on it is atomic, so stages can be recorded from any thread
+        self.n = 0 #number of records written
+
+    def now(self):
+        return time.perf_counter() if self.enabled else 0
+
+    def add(self, stage, frame, start): #records [stage] of [frame] as having taken from start until now
+        if not self.enabled:
+            return
+        end = time.perf_counter()
+        if stage not in self.stages:
+            with self.lock:
+                if stage not in self.stages: #another thread may have added it in the meantime
+                    self.stages.append(stage)
+        n = next(self.count)
+        self.records[n % self.size] = (self.stages.index(stage), -1 if frame is None else frame, start, end - start, threading.get_ident())
+        self.n = max(self.n, n + 1)
+
+    def last(self): #the records that are kept, oldest first
+        if self.n > self.size:
+            return np.roll(self.records, -(self.n % self.size))
+        return self.records[:self.n].copy()
+
+    def summary(self): #stage -> (count, mean, 95th percentile, max) of its durations in ms
+        records = self.last()
+        ans = {}
+        for k, stage in enumerate(self.stages):
+            duration = records['duration'][records['stage'] == k]*1000
+            if len(duration) > 0:
+                ans[stage] = (len(duration), duration.mean(), np.percentile(duration, 95), duration.max())
+        return ans
+
+    def csv(self, file): #one row per record: stage, frame, start and duration (ms)
+        records = self.last()
+        with open(file, 'w') as fh:
+            fh.write("stage,frame,start_ms,duration_ms,thread\n")
+            for r in records:
+                fh.write("%s,%d,%.4f,%.4f,%d\n" % (self.stages[r['stage']], r['frame'], r['start']*1000, r['duration']*1000, r['thread']))
+
+    def trace(self, file): #chrome trace event json - every record is a complete event, in microseconds
+        records = self.last()
+        threads = {int(t): k for k, t in enumerate(np.unique(records['thread']))}
+        events = [{'name': self.stages[r['stage']], 'ph': "X", 'ts': r['start']*1e6, 'dur': r['duration']*1e6, 'pid': 0, 'tid': threads[int(r['thread'])], 'args': {'frame': int(r['frame'])}} for r in records]
+        with open(file, 'w') as fh:
+            json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, fh)
+
+    def clear(self):
+        self.__init__(size=self.size, enabled=self.enabled)
+
+timings = Timings() #shared by every movie player
 
 class Movie(pg.GraphicsView):
 
@@ -22,6 +88,7 @@ class Movie(pg.GraphicsView):
     imgs = [] #raw np arrays of image data; the movie player will handle the transforming and cutting the data as needed
     frames = [] #represents the location of each frame within the original image
     clim = 1000 #clipping value for color scales
+    pad = 0 #value of the space outside of the image when zoomed in on an edge - 0 or np.nan
     scale = None #image scale (determined by height)
     
     #button states
@@ -34,7 +101,14 @@ class Movie(pg.GraphicsView):
     pos = None #pointer location
     last_i = 0
     ticks = None
+    shownTicks = None #ticks of the frame that is shown
     lines = [[]]
+    prefetch = 8 #frames prepared ahead of the player (see Prefetcher)
+    quantize = None #None, "uint8" or "uint16" - if set, the crops are quantized once over [-qrange, qrange] and contrast and colormap changes only change the lookup table of the image (see quantize.py)
+    qrange = 1200 #range of quantized crops - the largest contrast of the clipping slider, so values outside of it are always clipped anyway
+    cmap = None #colormap of quantized crops - a pyqtgraph ColorMap or an (n x 4) rgba table, gray if None
+    imgs = [] #crops of every frame (see CroppedFrames)
+    tracking = None #(center, date, w, h) of the tracked region if the current view is being tracked
 
     def __init__(self, **kwargs): 
         super().__init__(useOpenGL=True)
@@ -42,9 +116,9 @@ class Movie(pg.GraphicsView):
         for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
             setattr(self, key, value)
         self.scale = list(self.type.get_scales())[-1]
-        self.player.updateIdx.connect(self.updateImage) #connect player to self - when player emits the signal, the command to switch frames will run
-
-        self.imgs = self.maps.getData(self.type, self.scale) #get transformed images for movie player (HMI returns flipped images) with right resolution
+        self.player.updateIdx.connect(self.showFrame) #connect player to self - when player emits the signal, the command to switch frames will run
+        self.player.attach()
+        self.prefetcher = Prefetcher(self.player, size=self.prefetch)
 
         self.ci = pg.GraphicsLayout()
         self.setCentralItem(self.ci)
@@ -66,13 +140,26 @@ class Movie(pg.GraphicsView):
         self.plot.getAxis('bottom').setLabel(text=f"{self.type.cname} Longitude", units=self.type.unit)
         self.plot.getAxis('bottom').enableAutoSIPrefix(enable=False)
         self.plot.addItem(self.img)
+        self.prefetcher.start()
 
     def updateImage(self, i): #called by Player object
-        self.img.setImage(self.imgs[i]) #change actual image data
-        self.img.setLevels([-self.clim, self.clim]) #set contrast for new image
+        start = timings.now()
+        if self.quantize is None and self.prefetcher.clim != self.clim: #contrast changed - quantized frames don't depend on it, as contrast and colormap are in the lookup table of the image
+            self.prefetcher.reset(self.imgs, self.clim)
+        img = self.prefetcher.get(i) #the frame is cropped and already scaled to the contrast, or quantized (see Prefetcher)
+        timings.add('prefetch', i, start)
+        start = timings.now()
+        self.img.setImage(img, autoLevels=False) #change actual image data
+        timings.add('setImage', i, start)
+        start = timings.now()
         self.mouseMove(self.pos) #update pointer location
-        self.plot.getAxis('left').setTicks([self.ticks[i][1]])
-        self.plot.getAxis('bottom').setTicks([self.ticks[i][0]])
+        timings.add('mouseMove', i, start)
+        if self.shownTicks is not self.ticks[i] and self.shownTicks != self.ticks[i]: #ticks are usually the same from frame to frame
+            start = timings.now()
+            self.plot.getAxis('left').setTicks([self.ticks[i][1]])
+            self.plot.getAxis('bottom').setTicks([self.ticks[i][0]])
+            self.shownTicks = self.ticks[i]
+            timings.add('setTicks', i, start)
 
         #UNCOMMENT FOR LON/LAT LINES
         # for item in self.lines[self.last_i]:
@@ -83,6 +170,16 @@ class Movie(pg.GraphicsView):
         #         self.plot.addItem(line)
         # self.last_i = i
 
+    def stop(self): #stops the prefetch thread and waits for it to finish
+        self.prefetcher.stop()
+        self.prefetcher.wait()
+
+    def showFrame(self, i): #called by Player object - tells it when the frame has been shown, so it can keep time
+        start = timings.now()
+        self.updateImage(i)
+        self.player.done()
+        timings.add('frame', i, start)
+
     def mouseClick(self, event):
         if self.rect is None and self.crop: #start crop border
             self.rect = QGraphicsRectItem(event.scenePos().x(), event.scenePos().y(), 0, 0)
@@ -118,41 +215,38 @@ class Movie(pg.GraphicsView):
         #update mouse position and value measurements
         self.pos = pos
         pos = self.plot.getViewBox().mapSceneToView(pos)
-        try: 
-            x, y = (int(pos.x() + 0.5), int(pos.y() + 0.5))
-            # print(x, y)
-            value = self.imgs[self.player.i][x][y]
-            if value is not None and not math.isnan(value):
-                v = "%07.3fG" % (float(value/((4096/self.scale)**2)))
-            else:
-                v = " ---.---G"
-        except IndexError:
-            v = " ---.---G"
         
-        #since current coordinates are probably from a scaled down or cropped version, the pixel coordinates might be different from those of the original map
-        try:
-            xp, yp = self.type.inverse_transform((pos.x(), pos.y()), self.scale) #wcs.pixel_to_world seems to be swapping lat and lon from the input
-            x, y = self.type.get_lat_lon(self.maps[str(self.type) + str(self.scale)][self.player.i].wcs.pixel_to_world(yp, xp))
-            self.moviePlayerQTParent.pointerupdate.emit(['''%04d"''' % (x), '''%04d"''' % (y), v])
-        except ValueError:
-            x = "---"
-            y = "---"
+        #since current coordinates are from a scaled down and cropped version, they are converted to pixel coordinates on the whole frame of level self.scale first - the crop covers self.frames[i], which is in coordinates of the largest scale
+        i = self.player.i
+        w1, h1 = self.imgs.shape(i)
+        frame = self.frames[i]
+        ratio = self.scale/list(self.type.get_scales())[-1]
+        x = (frame.left() + pos.x()*frame.width()/w1)*ratio
+        y = (frame.top() + pos.y()*frame.height()/h1)*ratio
+        xp, yp = self.type.inverse_transform((x, y), self.scale) #wcs.pixel_to_world seems to be swapping lat and lon from the input
+        x, y, value = self.maps.locate(str(self.type) + str(self.scale), i, yp, xp) #value is read from the full resolution frame
+        v = "%07.3fG" % (value) if not math.isnan(value) else " ---.---G"
+        if math.isnan(x) or math.isnan(y):
             self.moviePlayerQTParent.pointerupdate.emit(["---", "---", v])
+        else:
+            self.moviePlayerQTParent.pointerupdate.emit(['''%04d"''' % (x), '''%04d"''' % (y), v])
 
         #print(pos.x(), pos.y())
 
     def setViewBox(self, frame=None): 
+        total = timings.now()
         h = list(self.type.get_scales())[-1]
         w = h * self.type.ratio
         #IMPORTANT: self.frames must be scaled to within original resolution for crop to work
+        self.tracking = None
         if frame is None:
-            self.frames = [QRectF(0, 0, w, h)] * len(self.imgs)
+            self.frames = [QRectF(0, 0, w, h)] * len(self.maps)
         elif not self.track:
             #gets coordinates of input frame
             tl = frame.topLeft()
             br = frame.bottomRight()
             #gets coordinate range of input frame
-            w1, h1 = self.imgs[self.player.i].shape
+            w1, h1 = self.imgs.shape(self.player.i)
             #gets output range for self.frames
             tl1 = self.frames[self.player.i].topLeft()
             br1 = self.frames[self.player.i].bottomRight()
@@ -161,13 +255,13 @@ class Movie(pg.GraphicsView):
             y2 = util.scale(br.y(), (0, h1), (tl1.y(), br1.y()))
             x1 = util.scale(tl.x(), (0, w1), (tl1.x(), br1.x()))
             y1 = util.scale(tl.y(), (0, h1), (tl1.y(), br1.y()))
-            self.frames = [QRectF(x1, y1, x2 - x1, y2 - y1)] * len(self.imgs)
+            self.frames = [QRectF(x1, y1, x2 - x1, y2 - y1)] * len(self.maps)
         else: 
             #gets coordinates of input frame
             tl = frame.topLeft()
             br = frame.bottomRight()
             #gets coordinate range of input frame
-            w1, h1 = self.imgs[self.player.i].shape
+            w1, h1 = self.imgs.shape(self.player.i)
             #gets output range for self.frames
             tl1 = self.frames[self.player.i].topLeft()
             br1 = self.frames[self.player.i].bottomRight()
@@ -184,24 +278,78 @@ class Movie(pg.GraphicsView):
             xp, yp = self.type.inverse_transform((x, y), list(self.type.get_scales())[-1]) #x, y, w, h assume max scaling
             # print(xp, yp)
             #creates SkyCoord from original image
-            center = self.maps[str(self.type) + str(list(self.type.get_scales())[-1])][self.player.i].wcs.pixel_to_world(yp, xp)
-            self.frames = []
+            m = self.maps[str(self.type) + str(list(self.type.get_scales())[-1])][self.player.i]
+            lon, lat = heliographic.pixel_to_hg(m, yp, xp)
+            center = SkyCoord(lon*u.deg, lat*u.deg, frame=sunpy.coordinates.HeliographicStonyhurst, obstime=m.date)
+            self.tracking = (center, self.maps[str(self.type) + str(self.scale)][self.player.i].date, w, h)
             # print(center)
-            for i in range(len(self.maps)):
-                m = self.maps[str(self.type) + str(list(self.type.get_scales())[-1])][i]
-                # print(type(m.coordinate_frame))
-                c = util.rotate(center, (m.date - self.maps[str(self.type) + str(self.scale)][self.player.i].date).to(u.day), out_frame=m.coordinate_frame)
-                # print(c)
-                b, a = self.type.transform_coord(m.wcs.world_to_pixel(c), list(self.type.get_scales())[-1])
-                self.frames.append(QRectF(a - w/2, b - h/2, w, h))
-                # print(self.frames[-1])
+            self.frames = [self.trackFrame(i) for i in range(len(self.maps))]
 
         # print(self.views[0].topLeft().x(), self.views[0].topLeft().y(), self.views[0].bottomRight().x(), self.views[0].bottomRight().y())
-        self.imgs, self.scale = self.maps.crop(self.frames, self.type)
+        self.imgs = CroppedFrames(self.maps, self.type, self.frames, pad=self.pad) #frames are only cropped when they are about to be shown
+        self.scale = self.imgs.scale(self.player.i)
+        self.requantize()
+        start = timings.now()
         self.calc_ticks()
+        timings.add('calc_ticks', None, start)
+        self.updateImage(self.player.i)
+        timings.add('setViewBox', self.player.i, total)
+
+    def requantize(self): #hands the crops to the prefetcher - quantized if quantize is set (see quantize.py), in which case the lookup table of the image is set too
+        self.prefetcher.reset(self.imgs, self.clim, None if self.quantize is None else (np.dtype(self.quantize), self.qrange))
+        if self.quantize is not None:
+            self.updateTable()
+
+    def updateTable(self): #lookup table of quantized crops for the current contrast and colormap
+        colors = self.cmap.getLookupTable(0.0, 1.0, 256, alpha=True) if hasattr(self.cmap, 'getLookupTable') else self.cmap
+        self.img.setLookupTable(quantize.table(self.qrange, self.clim, np.dtype(self.quantize), colors))
+        self.img.setLevels([0, np.iinfo(np.dtype(self.quantize)).max])
+
+    def setClim(self, clim): #changes the contrast - for quantized crops that is only a new lookup table
+        self.clim = clim
+        if self.quantize is not None:
+            self.updateTable()
+        else:
+            self.updateImage(self.player.i)
+
+    def setColormap(self, cmap): #colormaps are only used for quantized crops
+        self.cmap = cmap
+        if self.quantize is not None:
+            self.updateTable()
+
+    def setQuantize(self, quantize): #switches quantized crops on ("uint8", "uint16") or off (None)
+        self.quantize = quantize
+        self.requantize()
+        if self.quantize is None:
+            self.img.setLookupTable(None)
+            self.img.setLevels(None)
         self.updateImage(self.player.i)
 
-    def calc_ticks(self, lines=False, res=1): 
+    def trackFrame(self, i): #location of the tracked region in frame i - the center saved by setViewBox is rotated to the time of frame i
+        center, date, w, h = self.tracking
+        m = self.maps[str(self.type) + str(list(self.type.get_scales())[-1])].raw(i) #only the header is needed
+        # print(type(m.coordinate_frame))
+        c = util.rotate(center, (m.date - date).to(u.day))
+        # print(c)
+        b, a = self.type.transform_coord(heliographic.hg_to_pixel(m, c.lon.degree, c.lat.degree, visible=False), list(self.type.get_scales())[-1])
+        return QRectF(a - w/2, b - h/2, w, h)
+
+    def insertFrame(self, i): #called when a new frame has been inserted into self.maps at index i (see MoviePlayerQT.addFrame) - only the new frame gets ticks calculated
+        if self.tracking is not None:
+            frame = self.trackFrame(i)
+        else:
+            frame = self.frames[max(0, min(i, len(self.frames)) - 1)] if len(self.frames) > 0 else QRectF(0, 0, list(self.type.get_scales())[-1] * self.type.ratio, list(self.type.get_scales())[-1])
+        self.frames.insert(i, frame) #self.imgs crops the new frame when it is shown
+        self.requantize() #prepared frames after i have moved
+        start = timings.now()
+        ticks, lines = self.calc_ticks(indices=[i])
+        timings.add('calc_ticks', i, start)
+        self.ticks.insert(i, ticks[0])
+        if len(lines) > 0:
+            self.lines.insert(i, lines[0])
+
+    def calc_ticks(self, lines=False, res=1, indices=None): 
+        #indices are the frames to calculate ticks for - if not given, ticks are calculated for every frame and saved to self.ticks. The calculated ticks are returned either way
         #res indicates the number of extra points calculated to generate lines - higher means slower but more curved if lines are straight, then use res=1
         #lines must be true for graphs with curved lon/lat lines, otherwise ticks will be inaccurate
         #WARNING, setting lines=True is REALLY messed up it's slow and messy, but it works. Remember to uncomment corresponding part in update_image
@@ -210,18 +358,18 @@ class Movie(pg.GraphicsView):
         
         lines = []
         ticks = []
-        for n in range(len(self.frames)):
+        for n in (range(len(self.frames)) if indices is None else indices):
             m = self.maps[str(self.type) + str(list(self.type.get_scales())[-1])][n]
-            wp, hp = self.type.transform(m.data).shape
+            wp, hp = self.type.display_shape(m.shape if isinstance(m, framestore.LazyMap) else m.data.shape) #frames on disk aren't read
             m2 = self.maps[str(self.type) + str(self.scale)][n]
             # print(self.frames[i].topRight().x())
 
-            bl = m.wcs.pixel_to_world(self.frames[n].bottomLeft().x(), self.frames[n].topRight().y()).transform_to(sunpy.coordinates.HeliographicStonyhurst)
-            tr = m.wcs.pixel_to_world(int(self.frames[n].topRight().x() - 0.99), int(self.frames[n].bottomLeft().y() - 0.99)).transform_to(sunpy.coordinates.HeliographicStonyhurst)
+            bl_lon, bl_lat = heliographic.pixel_to_hg(m, self.frames[n].bottomLeft().x(), self.frames[n].topRight().y())
+            tr_lon, tr_lat = heliographic.pixel_to_hg(m, int(self.frames[n].topRight().x() - 0.99), int(self.frames[n].bottomLeft().y() - 0.99))
             # print(bl, tr)
 
-            hd = tr.lat.degree - bl.lat.degree
-            wd = tr.lon.degree - bl.lon.degree
+            hd = tr_lat - bl_lat
+            wd = tr_lon - bl_lon
 
             if hd <= 15:
                 hi = 1
@@ -242,10 +390,10 @@ class Movie(pg.GraphicsView):
 
             yticks = []
             for i in range(-2, int(hd/hi + 0.5) + 2):
-                yticks.append(bl.lat.degree - bl.lat.degree%hi + hi*(i + 1))
+                yticks.append(bl_lat - bl_lat%hi + hi*(i + 1))
             xticks = []
             for i in range(-2, int(wd/wi + 0.5) + 2):
-                xticks.append(bl.lon.degree - bl.lon.degree%wi + wi*(i + 1))
+                xticks.append(bl_lon - bl_lon%wi + wi*(i + 1))
 
             # print(xticks, yticks)
             if not lines:
@@ -255,13 +403,13 @@ class Movie(pg.GraphicsView):
                     xmin, xmax = self.type.xrange
                     if t < xmin or t > xmax:
                         continue
-                    yp, xp = self.type.transform_coord(m2.wcs.world_to_pixel(SkyCoord(t*self.type.u, 0*self.type.u, frame=m2.coordinate_frame)))
+                    yp, xp = self.type.transform_coord(heliographic.world_to_pixel(m2, t, 0))
                     xtickpixels.append((xp - self.frames[n].topLeft().x() * self.scale/list(self.type.get_scales())[-1], str(int(t))))
                 for t in yticks:
                     ymin, ymax = self.type.yrange
                     if t < ymin or t > ymax:
                         continue
-                    yp, xp = self.type.transform_coord(m2.wcs.world_to_pixel(SkyCoord(0*self.type.u, t*self.type.u, frame=m2.coordinate_frame)))
+                    yp, xp = self.type.transform_coord(heliographic.world_to_pixel(m2, 0, t))
                     ytickpixels.append((yp - self.frames[n].topLeft().y() * self.scale/list(self.type.get_scales())[-1], str(int(t))))
                 ticks.append([xtickpixels, ytickpixels])
                 continue
@@ -289,7 +437,7 @@ class Movie(pg.GraphicsView):
                     ymin, ymax = self.type.yrange
                     if x < xmin or x > xmax or y < ymin or y > ymax:
                         continue
-                    yp, xp = self.type.transform_coord(m2.wcs.world_to_pixel(SkyCoord(x*self.type.u, y*self.type.u, frame=m2.coordinate_frame)))
+                    yp, xp = self.type.transform_coord(heliographic.world_to_pixel(m2, x, y))
                     if xp >= 0 and xp < wp and yp >= 0 and yp < hp:
                         pos = True
                     if low and yp > 0:
@@ -317,7 +465,7 @@ class Movie(pg.GraphicsView):
                     ymin, ymax = self.type.yrange
                     if x < xmin or x > xmax or y < ymin or y > ymax:
                         continue
-                    yp, xp = self.type.transform_coord(m2.wcs.world_to_pixel(SkyCoord(x*self.type.u, y*self.type.u, frame=m2.coordinate_frame)))
+                    yp, xp = self.type.transform_coord(heliographic.world_to_pixel(m2, x, y))
                     if xp >= 0 and xp < wp and yp >= 0 and yp < hp:
                         pos = True
                     if low and xp > 0:
@@ -335,21 +483,27 @@ class Movie(pg.GraphicsView):
                 ylines.append(line)
             lines.append([xlines, ylines])
             ticks.append([xtickpixels, ytickpixels])
-        self.lines = lines
-        self.ticks = ticks
-        print(self.ticks)
+        if indices is None:
+            self.lines = lines
+            self.ticks = ticks
+        return ticks, lines
 
 
 
 
 
 class Player(QThread): #used to control all frame changes in Movie class(es) - all instances of Movie should be connected to one player
+    #frames are timed with the monotonic clock: each frame is due [speed] seconds after the last one was due, so the time it takes to show a frame doesn't slow the movie down
+    #the player waits for every Movie to show a frame (see attach and done) before it moves on - if they fall behind, frames are skipped to keep up with the clock (or, with skip=False, the movie plays slower)
+    #the thread sleeps until the next frame is due, and is woken right away by play, seek and speed changes
 
     updateIdx = pyqtSignal(int) #emitted whenever player.i is changed
     updateSlider = pyqtSignal(int) #emitted whenever the player increments i - used to update slider in MoviePlayerQt Class
     reverseSignal = pyqtSignal(bool) #used when bounce is enabled - emitted whenever the player 'bounces' and therefore needs to update the reverse button state
+    fpsSignal = pyqtSignal(float, float) #emitted about once a second while playing with the achieved and the target frames per second
 
     speed = 0.1 #time interval between frames
+    skip = True #skip frames when the movies can't keep up with speed
 
     i = 0 #current state of movie - all Movie classes and slider should be bound to this variable in some way
     fp = 0 #front pointer - minimum value for i depending on rangeslider
@@ -362,77 +516,595 @@ class Player(QThread): #used to control all frame changes in Movie class(es) - a
     def __init__(self, size):
         self.bp = size
         super().__init__()
-
-    def run(self): #constantly increments i with time interval [speed] whenever [paused] is false
+        self.condition = threading.Condition()
+        self.deadline = None #monotonic time the next frame is due - None when playback has just started or the movie was seeked
+        self.panels = 0 #number of Movies that report shown frames
+        self.waiting = 0 #Movies that haven't shown the last frame yet
+        self.shown = deque(maxlen=64) #monotonic times at which the last frames were shown
+        self.skipped = 0 #frames skipped to keep up
+        self.reported = 0
+
+    def run(self): #advances i every [speed] seconds whenever [paused] is false
         while True:
-            while self.paused:
-                time.sleep(0.1)
-            self.inc()
-            time.sleep(self.speed)
-
-    def inc(self): #function for incrementing i = checks to make sure i does not exceed fp and bp and adjusts according to reverse/rock state
-        if self.reverse: self.i -= 1
-        else: self.i += 1
-        if self.rock and self.i >= self.bp:
-            self.i -= 2
-            self.reverse = (not self.reverse)
-            self.reverseSignal.emit(True)
-        elif self.rock and self.i < self.fp:
-            self.i += 2
-            self.reverse = (not self.reverse)
-            self.reverseSignal.emit(False)
-        else: self.i = self.fp + (self.i - self.fp) % (self.bp - self.fp)
+            with self.condition:
+                while self.paused:
+                    self.deadline = None
+                    self.condition.wait()
+                now = time.monotonic()
+                if self.deadline is None:
+                    self.deadline = now
+                    self.shown.clear()
+                if now < self.deadline or (self.waiting > 0 and now < self.deadline + 1): #not due yet, or the last frame is still being shown (waits at most a second for a Movie that doesn't report back)
+                    self.condition.wait(self.deadline - now if self.waiting == 0 else self.deadline + 1 - now)
+                    continue
+                late = int((now - self.deadline)/self.speed) if self.skip else 0 #frames that should already have been shown
+                self.skipped += late
+                self.deadline = self.deadline + (late + 1)*self.speed if self.skip else max(self.deadline + self.speed, now)
+                self.waiting = self.panels
+                if self.panels == 0:
+                    self.record(now)
+            self.inc(late + 1)
+
+    def inc(self, n=1): #function for incrementing i = checks to make sure i does not exceed fp and bp and adjusts according to reverse/rock state - n > 1 skips frames
+        i, reverse = self.i, self.reverse
+        for _ in range(n):
+            i, reverse = self.step(i, reverse)
+        if reverse != self.reverse: #bounced
+            self.reverseSignal.emit(reverse)
+        self.i, self.reverse = i, reverse
         self.updateIdx.emit(self.i)
         self.updateSlider.emit(self.i)
 
+    def attach(self): #called by every Movie that calls done once it has shown a frame
+        with self.condition:
+            self.panels += 1
+
+    def done(self):
+        with self.condition:
+            self.waiting = max(self.waiting - 1, 0)
+            if self.waiting == 0:
+                self.record(time.monotonic())
+                self.condition.notify()
+
+    def record(self, now): #keeps the time a frame was shown and reports the frame rate once a second
+        if self.paused:
+            return
+        self.shown.append(now)
+        if len(self.shown) > 1 and now - self.reported >= 1:
+            self.reported = now
+            self.fpsSignal.emit((len(self.shown) - 1)/(self.shown[-1] - self.shown[0]), 1/self.speed)
+
+    def fps(self): #frames per second achieved over the last frames
+        with self.condition:
+            if len(self.shown) < 2:
+                return 0
+            return (len(self.shown) - 1)/(self.shown[-1] - self.shown[0])
+
+    def setPaused(self, paused):
+        with self.condition:
+            self.paused = paused
+            self.condition.notify()
+
+    def setSpeed(self, speed):
+        with self.condition:
+            self.speed = speed
+            if self.deadline is not None:
+                self.deadline = min(self.deadline, time.monotonic() + speed)
+            self.shown.clear()
+            self.condition.notify()
+
+    def step(self, i, reverse): #returns the (i, reverse) that come after frame i when going in direction [reverse], without changing anything
+        if reverse: i -= 1
+        else: i += 1
+        if self.rock and i >= self.bp:
+            return i - 2, not reverse
+        if self.rock and i < self.fp:
+            return i + 2, not reverse
+        return self.fp + (i - self.fp) % (self.bp - self.fp), reverse
+
+    def upcoming(self, n): #the next n frames the player will show, in order
+        i, reverse = self.i, self.reverse
+        ans = []
+        for _ in range(n):
+            i, reverse = self.step(i, reverse)
+            ans.append(i)
+        return ans
+
     def set(self, i): #used to manually set [i] - this is usually connected to the progress slider in MoviePlayerQt
-        self.i = i
+        with self.condition: #playback goes on from frame i one interval later
+            self.i = i
+            if self.deadline is not None:
+                self.deadline = time.monotonic() + self.speed
+            self.condition.notify()
         self.updateIdx.emit(i)
 
+#prepares the frames the player is about to show off the gui thread, so showing a frame only swaps in an image that is ready to be drawn
+#frames are prepared as gray rgba images (values from -clim to clim scaled to 0-255, nan transparent) - pyqtgraph draws those without scaling them again
+#the next frames in the direction the player is going (see Player.upcoming) are kept in a ring of [size] images - more of them the longer a frame takes to prepare compared to player.speed. Images of frames that have been passed are reused for the next ones
+class Prefetcher(QThread):
+    size = 8 #most frames kept ready
+
+    def __init__(self, player, **kwargs):
+        super().__init__()
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+        self.player = player
+        self.imgs = [] #frames to prepare (see reset)
+        self.clim = None
+        self.quantized = None #(dtype, range) if frames are prepared as quantized codes (see quantize.py) instead of images
+        self.ready = OrderedDict() #frame index -> prepared image
+        self.spare = [] #images that can be written over
+        self.current = None #image that was handed out last - it is never written over, as it may still be drawn
+        self.generation = 0 #incremented by reset, so images prepared from old frames are dropped
+        self.cost = 0 #average time it takes to prepare a frame
+        self.hits = self.misses = 0
+        self.condition = threading.Condition()
+        self.running = True
+
+    def reset(self, imgs, clim, quantized=None): #drops every prepared image - called when the frames or the contrast change. imgs is only indexed for the frames that are prepared, so it can make them when they are used (see CroppedFrames)
+        with self.condition:
+            self.imgs = imgs
+            self.clim = clim
+            self.quantized = quantized
+            for img in self.ready.values():
+                self.recycle(img)
+            self.ready.clear()
+            self.generation += 1
+            self.condition.notify()
+
+    def get(self, i): #the image of frame i - prepared on the spot if it isn't ready yet
+        with self.condition:
+            img = self.ready.get(i)
+            if img is not None:
+                self.current = img
+            imgs, clim, quantized, generation = self.imgs, self.clim, self.quantized, self.generation
+            self.condition.notify()
+        if img is None:
+            self.misses += 1
+            start = timings.now()
+            img = self.render(imgs[i], clim, quantized=quantized)
+            timings.add('render', i, start)
+            self.current = img
+            self.keep(i, img, generation)
+        else:
+            self.hits += 1
+        if quantized is not None:
+            return img
+        return img.view(np.uint8).reshape(img.shape + (4,))
+
+    def depth(self): #number of frames to keep ready
+        return max(2, min(self.size, int(self.cost/max(self.player.speed, 1e-3)) + 2))
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                upcoming = [i for i in self.player.upcoming(self.depth()) if i < len(self.imgs)]
+                for i in [i for i in self.ready if i not in upcoming and i != self.player.i]: #frames that have been passed
+                    self.recycle(self.ready.pop(i))
+                todo = [i for i in upcoming if i not in self.ready]
+                if len(todo) == 0: #woken up by reset, get (every time a frame is shown) or stop
+                    self.condition.wait()
+                    continue
+                i, imgs, clim, quantized, generation = todo[0], self.imgs, self.clim, self.quantized, self.generation
+                out = self.spare.pop() if len(self.spare) > 0 else None
+            start = time.perf_counter()
+            img = self.render(imgs[i], clim, out, quantized) #includes making the crop
+            self.cost = 0.8*self.cost + 0.2*(time.perf_counter() - start)
+            timings.add('render', i, start)
+            self.keep(i, img, generation)
+
+    def keep(self, i, img, generation):
+        with self.condition:
+            if generation == self.generation:
+                self.ready[i] = img
+                while len(self.ready) > self.size:
+                    self.recycle(self.ready.popitem(last=False)[1])
+
+    def recycle(self, img): #called with self.condition held
+        if img is not self.current and len(self.spare) < self.size:
+            self.spare.append(img)
+
+    #data as an image of little endian 32 bit pixels, which are rgba bytes - written into [out] if it has the right shape
+    #values are scaled to 0-255 in float32 and turned into gray pixels in one multiply, with nan pixels set to 0 (transparent)
+    #if quantized is given, data is turned into quantized codes instead - their colors come from the lookup table of the image (see Movie.updateTable)
+    def render(self, data, clim, out=None, quantized=None):
+        if quantized is not None:
+            dtype, limit = quantized
+            return quantize.codes(data, limit, dtype, out if out is not None and out.shape == data.shape and out.dtype == dtype else None)
+        if out is None or out.shape != data.shape or out.dtype != np.dtype('<u4'):
+            out = np.empty(data.shape, dtype='<u4')
+        value = np.multiply(data, np.float32(255/(2*clim)), dtype=np.float32)
+        value += np.float32(127.5)
+        np.clip(value, 0, 255, out=value)
+        blank = np.isnan(value)
+        value[blank] = 0
+        np.multiply(value.astype(np.uint8), 0x010101, out=out, dtype='<u4')
+        out |= 0xFF000000
+        out[blank] = 0
+        return out
+
+    def stop(self): #the thread finishes after the frame it is preparing - wait() on it to be sure it has
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+#frames of one level of an MList in display orientation, like the array MList.displayed makes - but every frame is only transformed (and decoded and read from disk) when it is used, so levels larger than the memory of the MList can be shown
+class Frames():
+    def __init__(self, maps, type, scale):
+        self.maps = maps
+        self.type = type
+        self.key = str(type) + str(scale)
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        level = self.maps[self.key]
+        if isinstance(level, cube.FrameCube): #no need to create a sunpy map
+            frame = self.type.transform(util.decode(level.data[i], level.meta[i]))
+        else:
+            m = level.raw(i)
+            frame = self.type.transform(util.decode(m.data, m.meta))
+            self.maps.release(m)
+        gain = self.maps.gain(self.key)
+        return frame if gain == 1 else frame * gain
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+#the crops of every frame of a movie - frame i cut to views[i] (see MList.crop) - each made when it is used instead of all at once, so a movie only has the frames it is about to show in memory (see Prefetcher), however long it is
+#views is the list of the Movie itself, so frames inserted into it are picked up
+class CroppedFrames():
+    def __init__(self, maps, type, views, pad=0):
+        self.maps = maps
+        self.type = type
+        self.views = views
+        self.pad = pad
+
+    def __len__(self):
+        return len(self.views)
+
+    def __getitem__(self, i): #a new array, or a view of a display array of the MList (see MList.crop) - never a buffer that is reused
+        start = timings.now()
+        imgs, _ = self.maps.crop([self.views[i]], self.type, indices=[i], cropper=crops.Cropper(pad=self.pad))
+        timings.add('crop', i, start)
+        return imgs[0]
+
+    def shape(self, i): #shape of crop i, without making it
+        _, x1, x2, y1, y2 = self.maps.box(self.views[i], self.type)
+        return x2 - x1, y2 - y1
+
+    def scale(self, i): #level crop i is cut out of
+        return self.maps.box(self.views[i], self.type)[0]
+
+class Loader(QThread): #pulls (slot, map) pairs from an iterator such as util.iter_maps in the background and hands them to the gui thread one at a time
+
+    loaded = pyqtSignal(int, object) #emitted with (slot, levels) for every frame - levels are built by MList.prepare
+
+    def __init__(self, maps, frames):
+        super().__init__()
+        self.maps = maps #MList the frames will be added to
+        self.frames = frames #iterator of (slot, map)
+
+    def run(self):
+        for slot, m in self.frames:
+            self.loaded.emit(slot, self.maps.prepare(m))
+
 class MList(dict): #handles all data processing related tasks - note that this is a modified dictionary and can therefore be accessed like a dict
-    def __init__(self, maps): #maps are assumed to be in hpc coordinates - all maps are automatically downscaled on init
+    #the full resolution frames (hpc4096) are kept as a cube.FrameCube - a single (frames x height x width) array that can still be used like a list of maps. Frames that are memory mapped from disk (see store) are kept in a cube.FrameList of framestore.LazyMaps
+    #every other level (hpc2048, hpc1024 and the levels added by transform) is a pyramid.PyramidLevel - a frame is only downscaled or projected the first time it is used, and kept in self.cache until the cache runs out of room
+    def __init__(self, maps, slots=None, store=None, dtype=None, cache_bytes=None, reduce="nanmean", display_bytes=None): #maps are assumed to be in hpc coordinates
         super().__init__()
-        self['hpc4096'] = maps
-        self['hpc2048'] = [m.superpixel([2, 2]*u.pix) for m in self['hpc4096']]
-        self['hpc1024'] = [m.superpixel([2, 2]*u.pix) for m in self['hpc2048']]
+        #slots are the positions of the maps in the requested cadence (see util.iter_maps) - frames that are inserted later are placed using these
+        if slots is None:
+            slots = list(range(len(maps)))
+        else:
+            maps = [m for _, m in sorted(zip(slots, maps), key=lambda x: x[0])]
+        self.slots = sorted(slots)
+        self.ids = list(range(len(maps))) #permanent id of every frame, so cached levels still belong to the right frame after frames are inserted
+        self.next_id = len(maps)
+        self.projections = {} #projection code -> (projection, kwargs) for every projection added with transform, so that new frames can be projected the same way
+        self.store = store #if a framestore.FrameStore is given, every level is written to disk and memory mapped instead of kept in ram
+        self.dtype = dtype #storage type of every level - None keeps the data as it is (float64), "float32" or "int16" (see util.encode) use a half or a quarter of the memory
+        self.cache = pyramid.LevelCache(cache_bytes) #computed levels - cache_bytes is the most memory they can take up (2 GB by default)
+        self.reduce = reduce #how pixels are combined when downscaling - "nanmean" (default), "mean" or "sum" (see util.block_reduce). Levels of sums are scaled back to G for display (see gain)
+        self.display = pyramid.DisplayCache(display_bytes) #levels in display orientation (see displayed) - display_bytes is the most memory they can take up (1 GB by default)
+        self.saved = {} #(level key, frame id) -> frames of pyramid levels that were read from a movie file (see moviefile.py), used instead of computing them
+        self.grids = {} #(level key, frame id) -> (heliographic.Grid, heliographic.Observer, position and axes of the observer) of every frame that was pointed at (see locate)
+        self['hpc4096'] = self.level(self.keep(m, m, 'hpc4096') for m in maps)
+        for scale in (2048, 1024):
+            self['hpc' + str(scale)] = pyramid.PyramidLevel(self, 'hpc' + str(scale), projections.HelioprojectiveCartesian, scale)
 
     def __len__(self): #length should be number of frames total instead of number of keys in the dictionary
         return len(self['hpc4096'])
         
-    def getData(self, type, scale): #returns a list of data transformed for use by Movie class (raw data is sometimes rotated or upside down)
-        return [type.transform(m.data) for m in self[str(type) + str(scale)]]
-
-    def transform(self, projection, **kwargs): #projects to new map projection (should be Projection class - see projections.py) **kwargs is transferred to the projections from_hpc method
-        scales = list(projection.get_scales())
-        scales.reverse()
-        self[str(projection) + str(scales[0])] = [projection.from_hpc(m, h=scales[0], **kwargs) for m in self['hpc4096']]
-        for i, scale in enumerate(scales[1:]):
-            ratio = int(scales[i]/scale + 0.1) #i is shifted down because we are iterating through cut down list
-            self[str(projection) + str(scale)] = [m.superpixel([ratio, ratio]*u.pix) for m in self[str(projection) + str(scales[i])]] 
-
-    def crop(self, views, type): #returns a list of cropped images given by frames in the list [views] - automatically upscales depending on zoom and automatically fills null space with zeros
+    def getData(self, type, scale): #returns a list of data transformed for use by Movie class (raw data is sometimes rotated or upside down) - every frame is a view of the array made by displayed
+        return list(self.displayed(type, scale))
+
+    #level [scale] of projection [type] in display orientation (transformed and decoded), as one contiguous (frames x width x height) array that is only made once and kept in self.display
+    #when frames have been inserted since the array was made, the frames that were already in it are copied over instead of being transformed again
+    #levels that don't fit in self.display (or would have to be read from disk - see resident) aren't made into an array at all: they are returned as Frames, which transforms a frame when it is used
+    def displayed(self, type, scale):
+        key = str(type) + str(scale)
+        cached = self.display.get(key)
+        if cached is not None and cached[0] == self.ids:
+            return cached[1]
+        if not self.resident(key):
+            return Frames(self, type, scale)
+        old = {} if cached is None else {id: j for j, id in enumerate(cached[0])}
+        level = self[key]
+        gain = self.gain(key)
+        if isinstance(level, pyramid.PyramidLevel):
+            self.fill(level, [i for i in range(len(self)) if self.ids[i] not in old])
+        data = np.zeros((0, 0, 0))
+        for i, id in enumerate(self.ids):
+            if id in old:
+                frame = cached[1][old[id]]
+            elif isinstance(level, cube.FrameCube): #no need to create a sunpy map for every frame
+                frame = type.transform(util.decode(level.data[i], level.meta[i]))
+            else:
+                m = level.raw(i)
+                frame = type.transform(util.decode(m.data, m.meta))
+                self.release(m)
+                if gain != 1:
+                    frame = frame * gain
+            if i == 0:
+                data = np.empty((len(self),) + frame.shape, dtype=frame.dtype)
+            data[i] = frame
+        self.display.put(key, self.ids, data)
+        return data
+
+    def gain(self, key): #factor that turns the values of level [key] into G - only levels downscaled with reduce="sum" need one, as they hold sums of blocks of pixels instead of averages
+        level = self[key]
+        if self.reduce != "sum" or not isinstance(level, pyramid.PyramidLevel):
+            return 1
+        scales = sorted(level.projection.get_scales())
+        return 1/int(scales[-1]/level.scale + 0.1)**2
+
+    def resident(self, key): #True if level [key] has a display array, or one can be made without reading frames from disk and fits in self.display
+        if key in self.display:
+            return True
+        level = self[key]
+        if isinstance(level, cube.FrameCube):
+            shape, dtype = level.data.shape[1:], level.data.dtype
+        elif isinstance(level, pyramid.PyramidLevel) and self.store is None and not any(name[0] == key for name in self.saved) and len(self) > 0:
+            shape, dtype = level.raw(0).data.shape, level.raw(0).data.dtype
+        else:
+            return False
+        itemsize = np.dtype(np.float32).itemsize if dtype == np.int16 else dtype.itemsize #int16 data is decoded to float32
+        return len(self) * int(np.prod(shape)) * itemsize <= self.display.budget
+
+    def transform(self, projection, workers=None, progress=None, cancel=None, **kwargs): #projects to new map projection (should be Projection class - see projections.py) **kwargs is transferred to the projections from_hpc method
+        #by default nothing is projected yet - each frame is projected the first time it is used
+        #if workers is given, every frame is projected right away by that many processes (see project) - progress and cancel are passed on to parallel.ProjectionPool
+        self.projections[str(projection)] = (projection, kwargs)
+        for scale in projection.get_scales():
+            self[str(projection) + str(scale)] = pyramid.PyramidLevel(self, str(projection) + str(scale), projection, scale)
+        self.cache.discard(str(projection) + str(scale) for scale in projection.get_scales()) #frames projected with different kwargs before
+        self.saved = {name: m for name, m in self.saved.items() if name[0].rstrip('0123456789') != str(projection)}
+        self.display.discard(str(projection) + str(scale) for scale in projection.get_scales())
+        self.grids = {name: grid for name, grid in self.grids.items() if name[0].rstrip('0123456789') != str(projection)}
+        if workers is not None:
+            self.project(projection, workers, progress, cancel)
+
+    #projects every frame that hasn't been projected yet to the largest scale of [projection] with a pool of [workers] processes, and returns the number of frames that were projected
+    #progress is called with (frames done, total) and cancel is a threading.Event that stops the projection early - frames that were finished are kept
+    #the projected frames go into self.cache, so cache_bytes has to be large enough to hold them (or a store has to be given)
+    def project(self, projection, workers=None, progress=None, cancel=None):
+        top = self[str(projection) + str(sorted(projection.get_scales())[-1])]
+        _, kwargs = self.projections[str(projection)]
+        indices = [i for i in range(len(self)) if (top.key, self.ids[i]) not in self.cache and (top.key, self.ids[i]) not in self.saved and not self.stored(top, self['hpc4096'].raw(i))]
+        ids = [self.ids[i] for i in indices]
+        frames = [self['hpc4096'].raw(i) for i in indices] #int16 frames are decoded by the pool, a chunk at a time
+        pool = parallel.ProjectionPool(workers=workers, progress=progress, cancel=cancel)
+        done = 0
+        for j, m in pool.run(frames, projection, dtype=np.float64 if self.dtype is None else np.float32, h=top.scale, **kwargs): #projections of levels stored as float32 or int16 don't need float64
+            self.cache.put((top.key, ids[j]), self.keep(m, frames[j], top.key))
+            self.release(frames[j])
+            done += 1
+        return done
+
+    def level(self, maps): #packs the frames of one level into a cube.FrameCube - frames that are memory mapped from disk (framestore.LazyMaps) are kept in a cube.FrameList so they aren't loaded into ram
+        maps = list(maps)
+        if any(isinstance(m, framestore.LazyMap) for m in maps):
+            return cube.FrameList(maps)
+        return cube.FrameCube(maps)
+
+    def build(self, level, i): #computes frame i of a pyramid.PyramidLevel
+        if (level.key, self.ids[i]) in self.saved:
+            return self.saved[(level.key, self.ids[i])]
+        return self.compute(level, self['hpc4096'].raw(i), lambda key: self[key].raw(i)) #frames as they are stored - compute decodes them itself
+
+    #computes one frame of [level] from its full resolution map [base] - get(key) has to return the same frame in another level
+    #the largest scale of a projection is projected from base and every other scale is block reduced from the largest scale
+    def compute(self, level, base, get):
+        if self.stored(level, base): #computed before and still on disk
+            return self.store.get(self.entry(level.key, base))
+        scales = sorted(level.projection.get_scales())
+        if level.scale == scales[-1]:
+            projection, kwargs = self.projections[str(level.projection)]
+            m = projection.from_hpc(base if kwargs.get('extent') is not None else self.expand(base), h=level.scale, **kwargs) #region of interest projections only read (and decode) the part of the frame they need
+        else:
+            top = get(str(level.projection) + str(scales[-1]))
+            ratio = int(scales[-1]/level.scale + 0.1)
+            m = sunpy.map.Map((util.block_reduce(util.decode(top.data, top.meta), ratio, self.reduce), util.block_meta(top.meta, ratio)))
+        self.release(base)
+        return self.keep(m, base, level.key)
+
+    #computes every frame of [level] in [indices] (all frames by default) that isn't in the cache yet
+    #downscaled levels are block reduced [batch] frames at a time as one stack, straight out of the cube of the largest scale when there is one - every other downscaled level of the projection is built from the same stack on the way
+    def fill(self, level, indices=None, batch=16):
+        if indices is None:
+            indices = range(len(self))
+        indices = [i for i in indices if (level.key, self.ids[i]) not in self.cache and (level.key, self.ids[i]) not in self.saved]
+        scales = sorted(level.projection.get_scales())
+        if level.scale == scales[-1] or self.store is not None: #projections are done one frame at a time anyway, and stored frames may just have to be read
+            for i in indices:
+                level.raw(i)
+            return
+        top = self[str(level.projection) + str(scales[-1])]
+        factors = [int(scales[-1]/scale + 0.1) for scale in reversed(scales[:-1]) if scale >= level.scale] #every level down to this one
+        scales = [scale for scale in reversed(scales[:-1]) if scale >= level.scale]
+        for start in range(0, len(indices), batch):
+            chunk = indices[start:start + batch]
+            if isinstance(top, cube.FrameCube) and top.data.dtype != np.int16: #int16 frames each have their own scale, so they are decoded one at a time
+                stack, metas = top.data[chunk], [top.meta[i] for i in chunk]
+            else:
+                frames = [top.raw(i) for i in chunk]
+                stack, metas = np.stack([util.decode(m.data, m.meta) for m in frames]), [m.meta for m in frames]
+            for scale, factor, reduced in zip(scales, factors, util.block_pyramid(stack, factors, self.reduce)):
+                key = str(level.projection) + str(scale)
+                for i, data, meta in zip(chunk, reduced, metas):
+                    self.cache.put((key, self.ids[i]), self.keep(sunpy.map.Map((data, util.block_meta(meta, factor))), None, key)) #base is only needed to name frames in self.store
+
+    def computed(self, key, i): #True if frame i of level [key] can be used without computing it - it is in self.cache or self.saved, or was written to self.store
+        level = self[key]
+        if not isinstance(level, pyramid.PyramidLevel):
+            return True
+        return (key, self.ids[i]) in self.cache or (key, self.ids[i]) in self.saved or self.stored(level, self['hpc4096'].raw(i))
+
+    def stored(self, level, base): #True if frame [base] of [level] has already been written to self.store (by this MList or an earlier one)
+        return self.store is not None and self.store.has(self.entry(level.key, base))
+
+    #name of level [key] of frame [base] in self.store - it is content addressed: the hash of the source file, the level, and a hash of everything else that changes the computed data (the from_hpc parameters of the projection, dtype and reduce)
+    #so frames computed in an earlier session are picked up again by an MList that projects the same files the same way, and frames computed with other parameters are never mixed up with them
+    def entry(self, key, base):
+        code = key.rstrip('0123456789')
+        _, kwargs = self.projections.get(code, (None, {}))
+        params = repr((sorted(kwargs.items()), str(self.dtype), self.reduce)) if key != 'hpc4096' else repr(str(self.dtype)) #every downscaled level (hpc ones too) depends on reduce
+        return "%s.%s.%s" % (self.store.source(base), key, hashlib.sha1(params.encode()).hexdigest()[:12])
+
+    def keep(self, m, base, key): #converts level [key] of frame [base] to self.dtype and writes it to self.store so it is memory mapped from disk
+        if key == 'hpc4096' and isinstance(m, framestore.LazyMap): #already on disk - converting it would load the whole frame into memory
+            return m
+        if self.dtype is not None:
+            data, keywords = util.encode(m.data, self.dtype)
+            meta = m.meta.copy()
+            meta.update(keywords)
+            m = sunpy.map.Map((data, meta))
+        if self.store is None:
+            return m
+        return self.store.put(m, self.entry(key, base))
+
+    def expand(self, m): #returns a map with the stored data converted back to values in G, for downscaling and reprojecting (int16 data can't be summed or interpolated as it is)
+        data = util.decode(m.data, m.meta)
+        if data is m.data:
+            return m
+        return sunpy.map.Map((data, m.meta))
+
+    #prepares one new hpc map to be added with insert and returns a dict of key -> map
+    #levels that are in use (have frames in the cache) are computed for it as well - this is the slow part of adding a frame, so it can be run in a background thread (see Loader)
+    def prepare(self, m):
+        m = self.keep(m, m, 'hpc4096')
+        levels = {'hpc4096': m}
+        def get(key):
+            if key not in levels:
+                levels[key] = self.compute(self[key], m, get)
+            return levels[key]
+        for key in self.cache.keys():
+            get(key)
+        self.release(m)
+        return levels
+
+    def release(self, m): #full resolution frames that are stored on disk are dropped from memory once a level has been computed from them - crops read them back from disk (see source)
+        if isinstance(m, framestore.LazyMap):
+            m.release()
+
+    def insert(self, slot, levels): #inserts a frame prepared by prepare in chronological order and returns its index
+        i = bisect.bisect(self.slots, slot)
+        self.slots.insert(i, slot)
+        self.ids.insert(i, self.next_id)
+        self.next_id += 1
+        for key, m in levels.items():
+            self[key].insert(i, m)
+        return i
+
+    def crop(self, views, type, indices=None, cropper=None): #returns a list of cropped images given by frames in the list [views] - automatically upscales depending on zoom and automatically fills null space with cropper.pad (zeros by default)
+        #indices are the frames that views belong to - if not given, views[i] is used for frame i
+        #crops that have to be copied are written into the buffer of [cropper] (a crops.Cropper), which is reused by its next crop - without one they go into a new buffer
+        if indices is None:
+            indices = range(len(views))
+        boxes = [self.box(view, type) for view in views]
+        scale = boxes[-1][0] #returned with the crops
+        dtype = np.float64 if self.dtype is None else np.float32
+        if cropper is None:
+            cropper = crops.Cropper()
+        shown = {s: self.displayed(type, s) for s in set(box[0] for box in boxes) if self.resident(str(type) + str(s))} #levels that are in ram are cropped out of their display arrays - crops inside the frame are views, so nothing is copied
+        if len(set(boxes)) == 1 and len(shown) == 1: #every frame is cut to the same box out of the same array, so they are all cropped at once
+            return cropper.crop_stack(shown[scale], list(indices), boxes[0][1:], dtype), scale
+        frames = [shown[s][i] if s in shown else self.source(self[str(type) + str(s)].raw(i), type, self.gain(str(type) + str(s))) for i, (s, *_) in zip(indices, boxes)] #source only reads and decodes the box
+        return cropper.crop(frames, [box[1:] for box in boxes], dtype), scale
+
+    def box(self, view, type): #(scale, x1, x2, y1, y2) - the level of [type] that a crop of [view] (in coordinates of the largest scale) is cut out of, and the box of the crop on it in display orientation
         h = list(type.get_scales())[-1]
         w = h * type.ratio
-        ans = []
-        for i, view in enumerate(views):
-            topLeft = view.topLeft()
-            bottomRight = view.bottomRight()
-            sl = max((bottomRight.x() - topLeft.x())/type.ratio, topLeft.y(), - bottomRight.y())
-            # print(sl)
-            scale = type.get_scale(sl)
-            # print(scale)
-            # print(w, h)
-            # print(topLeft.x(), topLeft.y(), bottomRight.x(), bottomRight.y())
-            x1 = int(util.scale(topLeft.x(), (0, w), (0, scale*type.ratio)) + 0.5)
-            y1 = int(util.scale(topLeft.y(), (0, h), (0, scale)) + 0.5)
-            x2 = int(util.scale(bottomRight.x(), (0, w), (0, scale*type.ratio)) + 0.5)
-            y2 = int(util.scale(bottomRight.y(), (0, h), (0, scale)) + 0.5)
-            #no need to transform coords here because we are slicing on transformed array
-            # print(x1, y1, x2, y2)
-            # print(type.transform(self[str(type) + str(scale)][i].data).shape)
-
-            ans.append(util.slice_extend(type.transform(self[str(type) + str(scale)][i].data), x1, x2, y1, y2))
-        return ans, scale
+        topLeft = view.topLeft()
+        bottomRight = view.bottomRight()
+        sl = max((bottomRight.x() - topLeft.x())/type.ratio, topLeft.y(), - bottomRight.y())
+        scale = type.get_scale(sl)
+        x1 = int(util.scale(topLeft.x(), (0, w), (0, scale*type.ratio)) + 0.5)
+        y1 = int(util.scale(topLeft.y(), (0, h), (0, scale)) + 0.5)
+        x2 = int(util.scale(bottomRight.x(), (0, w), (0, scale*type.ratio)) + 0.5)
+        y2 = int(util.scale(bottomRight.y(), (0, h), (0, scale)) + 0.5)
+        #no need to transform coords here because we are slicing on transformed array
+        return scale, x1, x2, y1, y2
+
+    #coordinates and value under pixel (x, y) (0 based, on the data - not in display orientation) of frame i of level [key], for the pointer readout of Movie
+    #returns (x, y, value): the coordinates in the frame of the level and in its units (arcsec for hpc, degrees for cea), and the value in G of the full resolution frame (hpc4096) at that point instead of the downscaled one - nan where there is none
+    #coordinates are computed in closed form (see heliographic.py) with the grids of the frames, which are only made the first time a frame is pointed at, and only one pixel of the full resolution frame is read - so a lookup takes microseconds instead of going through wcs.pixel_to_world
+    def locate(self, key, i, x, y):
+        grid, _, _ = self.grid(key, i)
+        base, observer, (o, axes) = self.grid('hpc4096', i)
+        v = grid.to_vector(x, y)
+        lon, lat = heliographic.lonlat(v)
+        if grid.frame != 'HP': #the point on the surface of the sun, as seen by the observer of the full resolution frame (Observer.to_hpc, with its position and axes only computed once)
+            if grid.frame == 'CR':
+                v = heliographic.rotate(heliographic.spin(-heliographic.carrington(observer)), v)
+            p = tuple(c*observer.rsun for c in v)
+            v = heliographic.rotate(axes, (p[0] - o[0], p[1] - o[1], p[2] - o[2])) if np.dot(o, p) >= observer.rsun**2 else (np.nan,)*3
+        c, r = base.to_pixel(v)
+        return lon / grid.units[0], lat / grid.units[1], self.pixel(i, r, c)
+
+    #(grid, observer, (position, axes) of the observer) of frame i of level [key], made the first time it is needed
+    def grid(self, key, i):
+        name = (key, self.ids[i])
+        if name not in self.grids:
+            level = self[key]
+            meta = level.meta[i] if isinstance(level, cube.FrameCube) else level.raw(i).meta #no need to create a sunpy map for a cube
+            observer = heliographic.Observer.from_meta(meta)
+            self.grids[name] = (heliographic.Grid(meta), observer, (observer.position(), observer.axes()))
+        return self.grids[name]
+
+    def pixel(self, i, r, c): #value in G of the pixel of the full resolution frame i nearest to (r, c) - nan outside of the frame. Only that pixel is read (or decompressed) from disk
+        if not (np.isfinite(r) and np.isfinite(c)):
+            return np.nan
+        r, c = math.floor(r + 0.5), math.floor(c + 0.5)
+        level = self['hpc4096']
+        if isinstance(level, cube.FrameCube):
+            data, meta = level.data[i], level.meta[i]
+        else:
+            data, meta = level.raw(i), level.raw(i).meta
+        h, w = data.shape
+        if not (0 <= r < h and 0 <= c < w):
+            return np.nan
+        value = data.read_box(r, r + 1, c, c + 1) if isinstance(data, framestore.LazyMap) else data[r:r + 1, c:c + 1]
+        return float(util.decode(value, meta)[0, 0])
+
+    #frame m of [type] as a (shape, read) pair for crops.Cropper - read(x1, x2, y1, y2) returns that box of type.transform(m.data), and only reads, converts and transforms the pixels inside the box
+    #for a framestore.LazyMap that isn't in memory, only that part of the frame is read from disk - and for frames that are still tile compressed FITS files (see framestore.FrameStore.decompress), only the compressed tiles that intersect the box are decompressed
+    #values are multiplied by gain (see MList.gain)
+    def source(self, m, type, gain=1):
+        if isinstance(m, framestore.LazyMap):
+            (h, w), read = m.shape, m.read_box
+        else:
+            (h, w), read = m.data.shape, lambda r1, r2, c1, c2: m.data[r1:r2, c1:c2]
+        def box(x1, x2, y1, y2):
+            data = type.transform(util.decode(read(*type.raw_box((x1, x2, y1, y2), (h, w))), m.meta))
+            return data if gain == 1 else data * gain
+        return type.display_shape((h, w)), box
 
 class MoviePlayerQT(QWidget): #main movie class - this is the only object that should be used outside of movie.py
 
@@ -442,7 +1114,8 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
     changezoom = pyqtSignal() #called by movie class whenever zoom is changed - this is used to uncheck the zoom button when zoom is completed
     pointerupdate = pyqtSignal(list) #called by movie class whenever pointer is updated - used to update pointer info labels
 
-    def __init__(self, maps, **kwargs): #loads widgets and initializes movie players
+    #frames can be an iterator of (slot, map) pairs (see util.iter_maps) - these are loaded in the background and added to the movie while it is already playing
+    def __init__(self, maps, frames=None, quantize=None, **kwargs): #loads widgets and initializes movie players - quantize is passed on to Movie
         super().__init__(**kwargs)
         self.size = len(maps)
 
@@ -460,7 +1133,7 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
         self.player = Player(self.size)
         self.start = self.player.start
 
-        self.movie = [[Movie(maps=self.maps, player=self.player, moviePlayerQTParent=self, type=projections.CylindricalEqualArea)]]
+        self.movie = [[Movie(maps=self.maps, player=self.player, moviePlayerQTParent=self, type=projections.CylindricalEqualArea, quantize=quantize)]]
         self.moviewidget = QWidget()
         self.movielayout = QGridLayout(self.moviewidget)
         self.controllayout.addWidget(self.moviewidget, 0, 0, 1, -1)
@@ -470,11 +1143,17 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
 
         self.loadControls()
         self.player.start()
+        QApplication.instance().aboutToQuit.connect(self.stop) #closing the main window doesn't close its child widgets
+
+        if frames is not None:
+            self.loader = Loader(self.maps, frames)
+            self.loader.loaded.connect(self.addFrame)
+            self.loader.start()
 
     def loadControls(self):
         #play/pause button
         self.pb = PlayButton()
-        self.pb.toggled.connect(lambda state: setattr(self.player, 'paused', state))
+        self.pb.toggled.connect(self.player.setPaused)
         self.addWidget(self.pb)
         self.pb.setToolTip("Play/Pause")
 
@@ -532,7 +1211,7 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
         self.ss.setMinimum(1)
         self.ss.setMaximum(40)
         self.ss.setValue(int(1/self.player.speed))
-        self.ss.sliderMoved.connect(lambda val: setattr(self.player, 'speed', 1/val))
+        self.ss.sliderMoved.connect(lambda val: self.player.setSpeed(1/val))
         self.ss.sliderMoved.connect(lambda val: self.si.setText("%2dfps" % (val)))
         self.ss.setMinimumWidth(30)
         self.addWidget(self.ss)
@@ -543,8 +1222,9 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
         self.si.setStyleSheet("QLabel { color: #FFFFFF }")
         self.si.setText("10fps")
         self.addWidget(self.si)
-        self.si.setToolTip("Speed")
-        self.si.setMinimumWidth(50)
+        self.si.setToolTip("Speed (achieved/set while playing)")
+        self.si.setMinimumWidth(70)
+        self.player.fpsSignal.connect(lambda achieved, target: self.si.setText("%2d/%2dfps" % (round(achieved), round(target))))
         self.si.setAlignment(Qt.AlignRight)
 
         #clipping range slider
@@ -619,6 +1299,67 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
         self.pl.setMinimumWidth(50)
         self.pl.setAlignment(Qt.AlignRight)
 
+        #performance overlay - F12 toggles it (see setOverlay)
+        self.ol = QLabel(self.moviewidget)
+        self.ol.setStyleSheet("QLabel { color: #FFFFFF; background: rgba(0, 0, 0, 160) }")
+        self.ol.setFont(QFont("Monospace", 8))
+        self.ol.move(5, 5)
+        self.ol.hide()
+        self.olt = QTimer(self)
+        self.olt.setInterval(500)
+        self.olt.timeout.connect(self.updateOverlay)
+        self.ols = QShortcut(QKeySequence(Qt.Key_F12), self)
+        self.ols.activated.connect(lambda: self.setOverlay(not self.ol.isVisible()))
+
+    #shows how long every stage of showing frames took (see Timings) over the movie - timing is only turned on while the overlay is shown
+    #the timings can also be exported, with timings.csv(file) or timings.trace(file)
+    def setOverlay(self, state):
+        timings.enabled = state
+        if state:
+            timings.clear()
+            self.updateOverlay()
+            self.ol.show()
+            self.ol.raise_()
+            self.olt.start()
+        else:
+            self.olt.stop()
+            self.ol.hide()
+
+    def updateOverlay(self):
+        lines = ["%-10s %5s %7s %7s %7s" % ("ms", "n", "mean", "p95", "max")]
+        for stage, (n, mean, p95, top) in timings.summary().items():
+            lines.append("%-10s %5d %7.2f %7.2f %7.2f" % (stage, n, mean, p95, top))
+        lines.append("%.1f/%.1ffps, %d skipped" % (self.player.fps(), 1/self.player.speed, self.player.skipped))
+        self.ol.setText("\n".join(lines))
+        self.ol.adjustSize()
+
+    def closeEvent(self, event):
+        self.stop()
+        super().closeEvent(event)
+
+    def stop(self): #stops the background threads of every movie, so qt doesn't destroy them while they are running
+        for row in self.movie:
+            for movie in row:
+                movie.stop()
+
+    def addFrame(self, slot, levels): #inserts a frame loaded by Loader into the movie
+        i = self.maps.insert(slot, levels)
+        grow = self.player.bp == self.size #only extend the playback range if it wasn't trimmed
+        self.size += 1
+        if grow:
+            self.player.bp = self.size
+        if self.player.i >= i and self.size > 1: #keep showing the same frame
+            self.player.i += 1
+        for movie in util.flatten(self.movie):
+            movie.insertFrame(i)
+
+        self.ms.setMaximum(self.size - 1)
+        self.ms.setValue(self.player.i)
+        self.ts.setMaximum(self.size - 1)
+        if grow:
+            self.ts.setValue((self.player.fp, self.size - 1))
+        self.pl.setText("%02d/%02d" % (self.player.i + 1, self.size))
+
     def addWidget(self, w): #helper function to append a widget to the controls bar (so I don't have to keep track of indexing)
         self.controllayout.addWidget(w, 1, self.widgets)
         self.widgets += 1
@@ -630,8 +1371,7 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
 
     def adjustClim(self, val:int):
         for movie in util.flatten(self.movie):
-            movie.clim = val
-            movie.updateImage(self.player.i)
+            movie.setClim(val)
 
     def updateRange(self, val:tuple):
         (u, l) = val 
@@ -644,4 +1384,12 @@ class MoviePlayerQT(QWidget): #main movie class - this is the only object that s
     
     def movieParam(self, param:str, val): #used to change [param] attrivute in all instances of Movie in self.Movie
         for movie in util.flatten(self.movie):
-            setattr(movie, param, val)
\ No newline at end of file
+            setattr(movie, param, val)
+
+#opens a MoviePlayerQT as soon as the first frame of [frames] is available (frames is an iterator of (slot, map) pairs such as util.iter_maps)
+#the rest of the frames are downloaded, projected and added while the movie is already playing. dtype is the storage type of the MList (see MList.__init__) and **kwargs is transferred to MList.transform
+def stream(frames, projection=projections.CylindricalEqualArea, dtype=None, **kwargs):
+    slot, m = next(frames)
+    maps = MList([m], slots=[slot], dtype=dtype)
+    maps.transform(projection, **kwargs)
+    return MoviePlayerQT(maps, frames=frames)
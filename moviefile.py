@@ -0,0 +1,177 @@
+from astropy.coordinates import SkyCoord
+import astropy.units as u
+import astropy.time
+
+import numpy as np
+import json, os, shutil, framestore, movie, projections
+
+#on-disk movie container - saves an MList to a directory, replacing pickling the whole MList (which copies every frame and needs all of them in ram to load)
+#every level is kept in chunk files of [chunk] frames each (<level>.<n>.npy, a (chunk x height x width) array) and index.json holds everything else: the slots of the frames, the header of every frame in every level, and the settings of the MList (dtype, reduce, projections and their kwargs)
+#opening a movie only reads index.json - every frame is a framestore.LazyMap memory mapped from its chunk, so only the pages of the frames (and parts of frames) that are displayed are read from disk
+#frames can be appended to a movie that is already on disk, without rewriting it
+#example:
+#   moviefile.MovieFile("./data/movie").save(maps)
+#   maps = moviefile.MovieFile("./data/movie").load()
+class MovieFile():
+    chunk = 16 #frames per chunk file - a chunk is created at full size when its first frame is written (as a sparse file, where the file system supports it)
+    version = 1
+
+    def __init__(self, path, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index = {'version': self.version, 'chunk': self.chunk, 'slots': [], 'dtype': None, 'reduce': "nanmean", 'projections': {}, 'levels': {}}
+        if os.path.exists(self.file('index.json')):
+            with open(self.file('index.json'), 'r') as fh:
+                self.index = json.load(fh)
+            if self.index['version'] > self.version:
+                raise MovieFileError(f"{path} was written by a newer version (movie file version {self.index['version']})")
+            self.chunk = self.index['chunk']
+
+    def __len__(self): #number of frames
+        return len(self.index['slots'])
+
+    #writes MList [maps] to the file, replacing anything that was in it
+    #levels are the keys of the levels to write (every level by default) - only frames that have already been computed (or were read from a store or a movie file) are written, so nothing is projected here (project the movie first, with MList.transform(..., workers=...), to save every frame). Levels and frames that aren't written are computed after loading, when they are used
+    #the movie is written to a temporary directory first and moved in at the end, so a movie that was loaded from this same file can be saved again - its frames are then pointed at the new files (see rebind)
+    def save(self, maps, levels=None):
+        if levels is None:
+            levels = list(maps.keys())
+        if 'hpc4096' not in levels:
+            raise MovieFileError("The full resolution frames (hpc4096) have to be saved")
+        settings = {code: pack(kwargs) for code, (_, kwargs) in maps.projections.items()}
+        shutil.rmtree(self.path + ".saving", ignore_errors=True) #left over from a save that failed
+        temp = MovieFile(self.path + ".saving", chunk=self.chunk)
+        temp.index['dtype'] = maps.dtype if maps.dtype is None else str(np.dtype(maps.dtype))
+        temp.index['reduce'] = maps.reduce
+        temp.index['projections'] = settings
+        for i in range(len(maps)):
+            temp.append({key: maps[key].raw(i) for key in levels if maps.computed(key, i)}, maps.slots[i], flush=False) #written as stored
+        temp.flush()
+        self.clear()
+        for file in sorted(os.listdir(temp.path), key=lambda file: file == 'index.json'): #index.json last, so the movie is only complete once every frame is in place
+            os.replace(temp.file(file), self.file(file))
+        os.rmdir(temp.path)
+        self.index = temp.index
+        self.rebind(maps)
+
+    #frames of [maps] that are memory mapped from the files of this movie (because it was loaded from it) are pointed at the files that were just saved
+    #frames of levels that weren't saved again are dropped from the MList, so they are computed again when they are used
+    def rebind(self, maps):
+        ids = {id: i for i, id in enumerate(maps.ids)}
+        frames = [('hpc4096', i, maps['hpc4096'].raw(i)) for i in range(len(maps))] if isinstance(maps['hpc4096'], list) else [] #a cube.FrameCube is in ram
+        frames += [(key, ids[id], m) for (key, id), m in maps.saved.items() if id in ids]
+        dropped = set()
+        for key, i, m in frames:
+            if not isinstance(m, framestore.LazyMap) or m.file is None or os.path.dirname(os.path.abspath(m.file)) != os.path.abspath(self.path):
+                continue
+            if self.has(key, i):
+                m.file, m.index = self.file(f"{key}.{i//self.chunk}.npy"), i % self.chunk
+            else:
+                dropped.add(key)
+        maps.saved = {name: m for name, m in maps.saved.items() if name[0] not in dropped}
+        maps.cache.discard(dropped) #the cache can hold the same frames
+
+    #adds one frame to the end of the file, given as a dict of level key -> map (like the ones MList.prepare returns) - hpc4096 has to be given, and levels that aren't are computed after loading
+    #frames don't have to be appended in order - load sorts them by slot (by default the frame goes after every other frame)
+    def append(self, levels, slot=None, flush=True):
+        if 'hpc4096' not in levels:
+            raise MovieFileError("Frames need a full resolution (hpc4096) map")
+        i = len(self)
+        if slot is None:
+            slot = max(self.index['slots'], default=-1) + 1
+        for key, m in levels.items():
+            self.write(key, i, m)
+        self.index['slots'].append(slot)
+        if flush:
+            self.flush()
+
+    def write(self, key, i, m): #writes map m as frame i of level [key]
+        data = np.asarray(m.data)
+        level = self.index['levels'].setdefault(key, {'shape': list(data.shape), 'dtype': data.dtype.str, 'frames': []})
+        if tuple(level['shape']) != data.shape or np.dtype(level['dtype']) != data.dtype:
+            raise MovieFileError(f"Frame of {data.dtype} {data.shape} does not fit in level {key} of {np.dtype(level['dtype'])} {tuple(level['shape'])} frames")
+        file = self.file(f"{key}.{i//self.chunk}.npy")
+        if os.path.exists(file):
+            chunk = np.load(file, mmap_mode='r+')
+        else:
+            chunk = np.lib.format.open_memmap(file, mode='w+', dtype=data.dtype, shape=(self.chunk,) + data.shape)
+        chunk[i % self.chunk] = data
+        chunk.flush()
+        del chunk
+        level['frames'] += [None] * (i + 1 - len(level['frames']))
+        level['frames'][i] = {'meta': json.loads(json.dumps(dict(m.meta), default=str)), 'name': framestore.name(m), 'digest': getattr(m, 'digest', None) if isinstance(m, framestore.LazyMap) else None}
+
+    def flush(self): #writes index.json - it is written last (and replaced in one step), so frames only count as saved once their data is complete
+        with open(self.file('index.json') + ".tmp", 'w') as fh:
+            json.dump(self.index, fh)
+        os.replace(self.file('index.json') + ".tmp", self.file('index.json'))
+
+    #opens the movie as an MList - cache_bytes and store are passed on to MList
+    #the full resolution frames are framestore.LazyMaps, and saved frames of the other levels are used instead of computing them (see MList.saved)
+    def load(self, cache_bytes=None, store=None):
+        if len(self) == 0:
+            raise MovieFileError(f"{self.path} has no frames")
+        order = sorted(range(len(self)), key=lambda i: self.index['slots'][i])
+        maps = movie.MList([self.frame('hpc4096', i) for i in order], slots=[self.index['slots'][i] for i in order], store=store, dtype=self.index['dtype'], cache_bytes=cache_bytes, reduce=self.index['reduce'])
+        for code, kwargs in self.index['projections'].items():
+            maps.transform(projection(code), **unpack(kwargs))
+        for key in self.index['levels']:
+            if key == 'hpc4096' or key not in maps:
+                continue
+            for j, i in enumerate(order):
+                if self.has(key, i):
+                    maps.saved[(key, maps.ids[j])] = self.frame(key, i)
+        return maps
+
+    def frame(self, key, i): #frame i of level [key] as a framestore.LazyMap
+        if not self.has(key, i):
+            raise MovieFileError(f"Frame {i} of level {key} is not in {self.path}")
+        frame = self.index['levels'][key]['frames'][i]
+        return framestore.LazyMap(self.file(f"{key}.{i//self.chunk}.npy"), frame['meta'], frame['name'], digest=frame['digest'], index=i % self.chunk)
+
+    def has(self, key, i): #True if frame i of level [key] was saved
+        frames = self.index['levels'].get(key, {'frames': []})['frames']
+        return i < len(frames) and frames[i] is not None
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def clear(self): #removes every frame
+        for file in os.listdir(self.path):
+            if file.endswith(('.npy', '.json', '.tmp')):
+                os.remove(self.file(file))
+        self.index = {'version': self.version, 'chunk': self.chunk, 'slots': [], 'dtype': None, 'reduce': "nanmean", 'projections': {}, 'levels': {}}
+
+def projection(code): #the projection (see projections.py) with the given code
+    for p in vars(projections).values():
+        if isinstance(p, projections.Projection_) and str(p) == code:
+            return p
+    raise MovieFileError(f"Unknown projection {code}")
+
+#kwargs of a projection as json - SkyCoords (like the center of a region of interest) are kept as their frame, longitude, latitude and obstime
+def pack(kwargs):
+    ans = {}
+    for key, value in kwargs.items():
+        if isinstance(value, SkyCoord):
+            s = value.spherical
+            value = {'skycoord': value.frame.name, 'lon': s.lon.degree, 'lat': s.lat.degree, 'obstime': None if value.obstime is None else value.obstime.isot}
+        elif isinstance(value, tuple):
+            value = list(value)
+        ans[key] = value
+    json.dumps(ans) #fails here, instead of after the frames are written, for kwargs that can't be saved
+    return ans
+
+def unpack(kwargs):
+    ans = {}
+    for key, value in kwargs.items():
+        if isinstance(value, dict) and 'skycoord' in value:
+            value = SkyCoord(value['lon']*u.deg, value['lat']*u.deg, frame=value['skycoord'], obstime=None if value['obstime'] is None else astropy.time.Time(value['obstime'], scale='utc'))
+        elif isinstance(value, list):
+            value = tuple(value)
+        ans[key] = value
+    return ans
+
+class MovieFileError(Exception):
+    pass
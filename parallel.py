@@ -0,0 +1,126 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import sunpy.map
+
+import numpy as np
+import os, util, framestore
+
+#projects many frames at once with a pool of worker processes - reproject is single threaded, so this is how MList.transform uses more than one core
+#maps are not pickled to the workers: frames are copied a chunk at a time into one block of shared memory that every worker reads from, and the workers write their projections into a second block
+#a chunk is as many frames as fit both blocks in [budget] bytes, so the shared memory in use doesn't grow with the number of workers or the size of the projection
+#frames that are memory mapped from disk (framestore.LazyMaps) are opened by the workers themselves, so they aren't copied at all
+class ProjectionPool():
+    workers = os.cpu_count() #number of worker processes
+    budget = 1 << 30 #bytes of shared memory used at a time, for the frames and their projections
+    chunk = None #if given, at most this many frames are copied into shared memory at a time - 2 per worker by default, which keeps every worker busy without copying the whole movie
+    progress = None #if given, called with (frames done, total frames) every time a frame is finished
+    cancel = None #threading.Event - once it is set, frames that haven't been started are dropped and run stops
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+        if self.workers is None:
+            self.workers = os.cpu_count()
+
+    #projects every map in [frames] with projection.from_hpc(m, **kwargs) and yields (index, projected map) pairs in the order in which they finish
+    #the projections are written (and yielded) as [dtype] - MList.project asks for float32 when it stores its levels as float32 or int16, which halves the output block
+    def run(self, frames, projection, dtype=np.float64, **kwargs):
+        if len(frames) == 0:
+            return
+        if not hasattr(projection, 'header'): #the size of the output has to be known before anything is projected
+            for i, m in enumerate(frames):
+                if self.cancelled():
+                    return
+                yield i, projection.from_hpc(m, **kwargs)
+                self.report(i + 1, len(frames))
+            return
+        header = projection.header(frames[0], **{key: value for key, value in kwargs.items() if key != 'algorithm'})
+        shape = (int(header['naxis2']), int(header['naxis1']))
+        dtype = np.dtype(dtype)
+        chunk = self.size(frames[0], shape, dtype)
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for start in range(0, len(frames), chunk):
+                if self.cancelled():
+                    return
+                block = frames[start:start + chunk]
+                sources, shared, inputs = self.share(block)
+                output = shared_memory.SharedMemory(create=True, size=len(block) * shape[0] * shape[1] * dtype.itemsize)
+                out = (output.name, (len(block),) + shape, dtype)
+                try:
+                    futures = {pool.submit(project, source, meta, inputs, out, j, projection, kwargs): j for j, (source, meta) in enumerate(sources)}
+                    for future in as_completed(futures):
+                        if future.cancelled():
+                            continue
+                        if self.cancelled():
+                            for f in futures:
+                                f.cancel()
+                        j = futures[future]
+                        meta = future.result()
+                        data = np.array(np.ndarray(out[1], dtype=out[2], buffer=output.buf)[j])
+                        done += 1
+                        self.report(done, len(frames))
+                        yield start + j, sunpy.map.Map((data, meta))
+                finally:
+                    for shm in (shared, output):
+                        if shm is not None:
+                            shm.close()
+                            shm.unlink()
+
+    #number of frames per chunk - as many as fit in [budget] with their projections (of [shape] and [dtype]), but at least one. Frames that are memory mapped from disk aren't copied, so only their projections count
+    def size(self, m, shape, dtype):
+        frame = 0 if isinstance(m, framestore.LazyMap) and not m.loaded else int(np.prod(m.data.shape)) * (4 if m.data.dtype == np.int16 else m.data.dtype.itemsize) #int16 data is decoded to float32
+        chunk = max(1, self.budget // (frame + int(np.prod(shape)) * dtype.itemsize))
+        return min(chunk, self.chunk or 2*self.workers)
+
+    #copies the maps in [block] that are in memory into a new block of shared memory
+    #returns a (source, meta) pair for every map, where source tells a worker where to find its data, the shared memory and (name, shape, dtype) of the block (None if nothing had to be copied)
+    def share(self, block):
+        sources = []
+        inside = []
+        for m in block:
+            if isinstance(m, framestore.LazyMap) and not m.loaded:
+                sources.append((('npy', (m.file, m.index)) if m.file is not None else ('fits', m.source), m.meta))
+            else:
+                sources.append((('shm', len(inside)), dict(m.meta)))
+                inside.append(m)
+        if len(inside) == 0:
+            return sources, None, None
+        first = util.decode(inside[0].data, inside[0].meta)
+        shape = (len(inside),) + first.shape
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * first.dtype.itemsize)
+        data = np.ndarray(shape, dtype=first.dtype, buffer=shm.buf)
+        for i, m in enumerate(inside):
+            data[i] = util.decode(m.data, m.meta)
+        del data
+        return sources, shm, (shm.name, shape, first.dtype)
+
+    def cancelled(self):
+        return self.cancel is not None and self.cancel.is_set()
+
+    def report(self, done, total):
+        if self.progress is not None:
+            self.progress(done, total)
+
+#runs in a worker process - projects one frame and writes it to frame j of the output block, then returns the header of the projection
+def project(source, meta, inputs, output, j, projection, kwargs):
+    kind, where = source
+    roi = kwargs.get('extent') is not None #region of interest projections only read the part of the frame they need, so frames on disk are left there
+    if kind == 'fits':
+        m = framestore.LazyMap(None, meta, source=where) if roi else sunpy.map.Map(where)
+    elif kind == 'npy':
+        m = framestore.LazyMap(where[0], meta, index=where[1])
+        if not roi:
+            m = sunpy.map.Map((util.decode(m.data, meta), meta))
+    else:
+        shm = shared_memory.SharedMemory(name=inputs[0]) #workers share the resource tracker of the main process, which is the only one that unlinks the block
+        data = np.array(np.ndarray(inputs[1], dtype=inputs[2], buffer=shm.buf)[where]) #copied so the shared memory can be closed right away
+        shm.close()
+        m = sunpy.map.Map((data, meta))
+    ans = projection.from_hpc(m, **kwargs)
+    shm = shared_memory.SharedMemory(name=output[0])
+    out = np.ndarray(output[1], dtype=output[2], buffer=shm.buf)
+    out[j] = ans.data
+    del out
+    shm.close()
+    return ans.meta
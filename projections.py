@@ -1,7 +1,9 @@
 from astropy.coordinates import SkyCoord
 import astropy.units as u
+import astropy.time
 import numpy as np
-import sunpy.map
+import sunpy.map, sunpy.coordinates
+import util, framestore, remap, heliographic
 
 # used alongside Movie class to determine movie properties (should be inherited from by other classes)
 # This makes it easier to implement differences in movie player functions across different types of images
@@ -27,6 +29,12 @@ class Projection_():
     def transform(self, data): #applies rotations, flips, etc to display image correctly on pyqtgraph
         return data
 
+    def display_shape(self, shape): #shape of transform(data) for data of the given shape
+        return shape
+
+    def raw_box(self, box, shape): #converts a box (x1, x2, y1, y2) on transformed data to (r1, r2, c1, c2) on the original data with the given shape, so that transform(data[r1:r2, c1:c2]) == transform(data)[x1:x2, y1:y2]
+        return box
+
     def transform_coord(self, coords, scale=None): #transforms from original coordinate system to one compatible with pyqtgraph
         return coords
 
@@ -55,7 +63,15 @@ class HelioprojectiveCartesian_(Projection_):
         return coord.Tx.arcsec, coord.Ty.arcsec
 
     def transform(self, data):
-        return np.flip(np.rot90(data), axis=1)/((4096/len(data))**2)
+        return np.flip(np.rot90(data), axis=1)
+
+    def display_shape(self, shape):
+        return shape[1], shape[0]
+
+    def raw_box(self, box, shape): #transformed data is the original rotated by 180 degrees and transposed
+        x1, x2, y1, y2 = box
+        h, w = shape
+        return h - y2, h - y1, w - x2, w - x1
     
     def transform_coord(self, coords, scale=None):
         if scale is None:
@@ -107,7 +123,14 @@ class CylindricalEqualArea_(Heliographic_):
     ratio = np.pi
 
     def transform(self, data):
-        return np.flip(np.rot90(data), axis=0)/((2048/len(data)))
+        return np.flip(np.rot90(data), axis=0)
+
+    def display_shape(self, shape):
+        return shape[1], shape[0]
+
+    def raw_box(self, box, shape): #transformed data is the original transposed
+        x1, x2, y1, y2 = box
+        return y1, y2, x1, x2
 
     def transform_coord(self, coords, scale=None): #transforms from original coordinate system to one compatible with pyqtgraph
         x, y = coords
@@ -122,7 +145,23 @@ class CylindricalEqualArea_(Heliographic_):
     #alternatively, the user can give origin_x and origin_y for the same effect. If origin_x and origin_y are not heliographic stonyhurst, frame can be set to the frame of these coordinates
     #if clip=True, the image will be clipped so that both dimensions are a multiple of 4. This allows easier downscaling without interpolation
     #instead of providing a specific dimension for the projection, the user can also provide a float, determining the scale in degrees per pixel of the image
-    def from_hpc(self, m, coord=None, h=4096, origin_x=0, origin_y=0, clip=True, frame="heliographic_stonyhurst", scale=None, algorithm='interpolation'):
+    #algorithm='interpolation' (the default), 'adaptive' and 'exact' use reproject_to. 'lut' interpolates with lookup tables that are shared by frames with the same geometry (see remap.py), 'analytic' computes the coordinates of every frame in closed form (see heliographic.py)
+    #region of interest mode: if extent=(width, height) in degrees is given, only a patch of that size centered on [center] is projected (like a SHARP cutout), at [scale] degrees per pixel - by default the resolution of the full projection with height h, so the patch matches a crop of it
+    #center is a SkyCoord or (lon, lat) in degrees (heliographic stonyhurst). If track=True and center is a SkyCoord with an obstime, the center is differentially rotated to the time of each frame so the patch follows the region
+    #in this mode only the pixels of m under the patch are read (just those tiles or pages for framestore.LazyMaps), and m may hold storage type data (see util.encode)
+    def from_hpc(self, m, coord=None, h=4096, origin_x=0, origin_y=0, clip=True, frame="heliographic_stonyhurst", scale=None, algorithm='interpolation', center=None, extent=None, track=True):
+        header = self.header(m, coord=coord, h=h, origin_x=origin_x, origin_y=origin_y, clip=clip, frame=frame, scale=scale, center=center, extent=extent, track=track)
+        if extent is not None:
+            m = self.cutout(m, header)
+        if algorithm == 'lut':
+            return remap.remapper.reproject(m, header)
+        if algorithm == 'analytic':
+            return heliographic.reproject(m, header)
+        return m.reproject_to(header, algorithm=algorithm)
+
+    def header(self, m, coord=None, h=4096, origin_x=0, origin_y=0, clip=True, frame="heliographic_stonyhurst", scale=None, center=None, extent=None, track=True): #header of the map from_hpc reprojects m to (takes the same parameters)
+        if extent is not None:
+            return self.roi(m, h, clip, scale, center, extent, track)
         if scale is not None:
             w = int(360/scale + 0.5)
             h = w/np.pi
@@ -138,8 +177,46 @@ class CylindricalEqualArea_(Heliographic_):
             h = int(h + 2 - (h + 2)%4)
         else:
             w = int(w + 0.5)
-        header = sunpy.map.make_fitswcs_header((h, w), frame_out, scale=(scale, scale)*u.deg/u.pix, projection_code="CEA") #since the deg/pix ratio for lattitude is not linear, giving the correct ratio makes the projection overcompensate for nonlinearity
-        return m.reproject_to(header, algorithm=algorithm)
+        return sunpy.map.make_fitswcs_header((h, w), frame_out, scale=(scale, scale)*u.deg/u.pix, projection_code="CEA") #since the deg/pix ratio for lattitude is not linear, giving the correct ratio makes the projection overcompensate for nonlinearity
+
+    def roi(self, m, h, clip, scale, center, extent, track): #header of a region of interest projection (see from_hpc) - only the header of m is used, so frames on disk aren't loaded
+        if scale is None:
+            scale = 360/(h*np.pi)
+        date = astropy.time.Time(m.meta['date-obs']) if 'date-obs' in m.meta else m.date
+        if isinstance(center, SkyCoord):
+            if track and center.obstime is not None:
+                center = util.rotate(center, (date - center.obstime).to(u.day))
+            center = center.transform_to(sunpy.coordinates.HeliographicStonyhurst)
+            lon, lat = center.lon.degree, center.lat.degree
+        else:
+            lon, lat = center if center is not None else (0, 0)
+        w, h = extent[0]/scale, extent[1]/scale
+        if clip:
+            w = int(w + 2 - (w + 2)%4)
+            h = int(h + 2 - (h + 2)%4)
+        else:
+            w, h = int(w + 0.5), int(h + 0.5)
+        coord = SkyCoord(lon*u.deg, lat*u.deg, frame="heliographic_stonyhurst", obstime=date, rsun=float(m.meta.get('rsun_ref', heliographic.RSUN))*u.m)
+        return sunpy.map.make_fitswcs_header((h, w), coord, scale=(scale, scale)*u.deg/u.pix, projection_code="CEA")
+
+    #the part of hpc map m that is needed to project to [header], as a map with the same wcs (crpix is shifted) and its data converted from the storage type
+    #the box is the smallest one holding every pixel the projection interpolates from - frames that are stored on disk only read that box
+    def cutout(self, m, header):
+        px, py = heliographic.source_pixels(m.meta, header)
+        h, w = m.shape if isinstance(m, framestore.LazyMap) else m.data.shape
+        finite = np.isfinite(px) & np.isfinite(py)
+        if finite.any():
+            c1, c2 = int(np.floor(px[finite].min())) - 1, int(np.ceil(px[finite].max())) + 2
+            r1, r2 = int(np.floor(py[finite].min())) - 1, int(np.ceil(py[finite].max())) + 2
+            c1, c2, r1, r2 = max(c1, 0), min(c2, w), max(r1, 0), min(r2, h)
+        if not finite.any() or c2 - c1 < 2 or r2 - r1 < 2: #the patch is on the far side of the sun - any small box gives a projection that is all nan
+            c1, c2, r1, r2 = 0, min(w, 2), 0, min(h, 2)
+        data = m.read_box(r1, r2, c1, c2) if isinstance(m, framestore.LazyMap) else m.data[r1:r2, c1:c2]
+        meta = m.meta.copy()
+        meta['crpix1'] = float(meta['crpix1']) - c1
+        meta['crpix2'] = float(meta['crpix2']) - r1
+        meta['naxis1'], meta['naxis2'] = c2 - c1, r2 - r1
+        return sunpy.map.Map((util.decode(data, meta), meta))
 
 #an instance of each usable Projection class should be created here
 CylindricalEqualArea = CylindricalEqualArea_()
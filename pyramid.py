@@ -0,0 +1,162 @@
+from collections import OrderedDict
+import threading, framestore, util
+
+#pyramid levels of an MList (hpc2048, hpc1024, cea2048...) that are only computed when a frame is first used
+#computed frames are kept in a LevelCache shared by every level of the MList. Once the cache is over its memory budget the least recently used frames are dropped, and computed again if they are needed later
+#level[i] gives frames in G, decoded if the MList stores them as int16 (see util.encode) - raw(i) gives them as they are stored
+class PyramidLevel():
+    def __init__(self, maps, key, projection, scale):
+        self.maps = maps #MList this level belongs to - frames are computed by maps.build
+        self.key = key
+        self.projection = projection
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return util.decoded(self.raw(i))
+
+    def raw(self, i): #frame i as it is stored (and cached)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("PyramidLevel index out of range")
+        return self.maps.cache.get((self.key, self.maps.ids[i]), lambda: self.maps.build(self, i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def insert(self, i, m): #frames are added to the MList, not to its levels - a precomputed frame just goes into the cache
+        self.maps.cache.put((self.key, self.maps.ids[i]), m)
+
+#least recently used cache of computed frames, limited to [budget] bytes of data
+#hits, misses, evictions and recomputes (misses for frames that had been computed before and were evicted) are counted, so the budget can be tuned for a movie
+class LevelCache():
+    budget = 2 << 30 #maximum number of bytes of frame data to keep
+
+    def __init__(self, budget=None):
+        if budget is not None:
+            self.budget = budget
+        self.entries = OrderedDict() #(key, frame id) -> map, least recently used first
+        self.sizes = {}
+        self.size = 0
+        self.evicted = set() #entries that have been dropped at least once
+        self.hits = self.misses = self.evictions = self.recomputes = 0
+        self.lock = threading.Lock() #frames can be added from the background thread that loads new frames (see movie.Loader)
+
+    def get(self, name, build): #returns the cached frame [name], or computes it with build() and caches it
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return self.entries[name]
+            self.misses += 1
+            if name in self.evicted:
+                self.recomputes += 1
+        m = build() #not locked, so other frames can be used while this one is being computed
+        self.put(name, m)
+        return m
+
+    def put(self, name, m):
+        with self.lock:
+            if name in self.entries:
+                self.size -= self.sizes[name]
+            self.entries[name] = m
+            self.entries.move_to_end(name)
+            self.sizes[name] = nbytes(m)
+            self.size += self.sizes[name]
+            while self.size > self.budget and len(self.entries) > 1: #the newest frame is always kept, even if it is over the budget on its own
+                old, _ = self.entries.popitem(last=False)
+                self.size -= self.sizes.pop(old)
+                self.evicted.add(old)
+                self.evictions += 1
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def keys(self): #level keys that have frames in the cache
+        with self.lock:
+            return set(key for key, _ in self.entries)
+
+    def discard(self, keys): #drops every cached frame of the levels in [keys]
+        keys = set(keys)
+        with self.lock:
+            for name in [name for name in self.entries if name[0] in keys]:
+                del self.entries[name]
+                self.size -= self.sizes.pop(name)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'budget': self.budget, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'recomputes': self.recomputes}
+
+    def __getstate__(self): #cached frames aren't pickled - they are computed again when needed
+        return {'budget': self.budget}
+
+    def __setstate__(self, state):
+        self.__init__(state['budget'])
+
+def nbytes(m): #bytes of ram used by the data of a map - maps that are memory mapped from disk (framestore.LazyMaps) don't count
+    if isinstance(m, framestore.LazyMap) and not m.loaded:
+        return 0
+    return m.data.nbytes
+
+#levels of an MList in display orientation (Projection_.transform applied and storage types decoded), each kept as one contiguous (frames x width x height) array
+#the movie player shows, crops and zooms with views of these arrays instead of transforming whole frames every time (see MList.displayed)
+#a level stays valid until its frames change - it is checked against the frame ids of the MList, and levels are dropped by MList.transform when they are projected again
+#whole levels are dropped, least recently used first, once they take up more than [budget] bytes
+class DisplayCache():
+    budget = 1 << 30 #maximum number of bytes of display data to keep
+
+    def __init__(self, budget=None):
+        if budget is not None:
+            self.budget = budget
+        self.levels = OrderedDict() #level key -> (frame ids, array), least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key): #returns (frame ids, array) of level [key], or None if it isn't cached
+        with self.lock:
+            if key not in self.levels:
+                return None
+            self.levels.move_to_end(key)
+            return self.levels[key]
+
+    def put(self, key, ids, data):
+        with self.lock:
+            if key in self.levels:
+                self.size -= self.levels.pop(key)[1].nbytes
+            if data.nbytes > self.budget: #too large to keep - it is made again every time it is needed
+                return
+            self.levels[key] = (list(ids), data)
+            self.size += data.nbytes
+            while self.size > self.budget:
+                _, (_, old) = self.levels.popitem(last=False)
+                self.size -= old.nbytes
+
+    def __contains__(self, key):
+        return key in self.levels
+
+    def discard(self, keys): #drops the levels in [keys]
+        with self.lock:
+            for key in set(keys) & set(self.levels):
+                self.size -= self.levels.pop(key)[1].nbytes
+
+    def clear(self):
+        with self.lock:
+            self.levels.clear()
+            self.size = 0
+
+    def __getstate__(self): #display arrays aren't pickled - they are made again when needed
+        return {'budget': self.budget}
+
+    def __setstate__(self, state):
+        self.__init__(state['budget'])
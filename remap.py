@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from astropy.coordinates import SkyCoord, UnitSphericalRepresentation
+from astropy.wcs import WCS
+import sunpy.map
+
+import numpy as np
+import threading
+
+#reprojection of many frames that share (nearly) the same geometry, like consecutive frames of a movie
+#reproject works out where every output pixel lands on the input image for every frame it reprojects, which is almost all of its work. Here that mapping is computed once per geometry and kept:
+#   - the position of every output pixel in the coordinates of the input (arcsec for hpc) only depends on the output header and the position of the observer, so it is cached under the observer position rounded to [angle] degrees and [distance] (relative)
+#   - those coordinates are then projected onto the plane of the input (its intermediate world coordinates), which only depends on its projection (ctype, crval), not on where it points. That is cached too, as crval hardly ever changes
+#   - the input pixel every output pixel comes from is an affine transform of the plane coordinates (crpix, crota and cdelt), so frames whose pointing drifts only pay for that and for building a gather table, instead of wcs.world_to_pixel
+#   - gather tables are kept under the pointing of the input frame rounded to [pixel] pixels. For frames that share it, reprojecting is just a bilinear gather from the input data
+#the result is the same as reproject_to(header, algorithm='interpolation') up to the rounding
+class Remapper():
+    angle = 1e-3 #degrees - observers closer than this share their coordinates
+    distance = 1e-5 #fraction of dsun
+    pixel = 1e-3 #input pixels - pointings closer than this share their lookup tables
+    size = 4 #number of lookup tables and plane coordinates kept - each takes about 16 bytes per output pixel, and coordinates take another 16
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items(): #take all params in kwargs and set them as attributes
+            setattr(self, key, value)
+        self.worlds = OrderedDict() #geometry -> input coordinates of every output pixel
+        self.planes = OrderedDict() #geometry + projection of the input -> its intermediate world coordinates of every output pixel
+        self.luts = OrderedDict() #geometry + pointing -> Gather
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    #reprojects sunpy map m to the wcs in header - the header must give the output size (naxis1, naxis2)
+    def reproject(self, m, header):
+        shape = (int(header['naxis2']), int(header['naxis1']))
+        geometry = self.geometry(m, header)
+        name = geometry + self.pointing(m)
+        lut = self.get(self.luts, name)
+        if lut is None:
+            x, y = self.pixels(m, header, shape, geometry)
+            lut = Gather(x, y, m.data.shape)
+            self.put(self.luts, name, lut, self.size)
+            self.misses += 1
+        else:
+            self.hits += 1
+        return sunpy.map.GenericMap(lut.apply(m.data, shape), WCS(header).to_header(), plot_settings=m.plot_settings)
+
+    #input pixel (x, y) of every output pixel - an affine transform of the cached plane coordinates, so only changes of the projection of m (or of the geometry) need wcslib
+    def pixels(self, m, header, shape, geometry):
+        wcs = m.wcs
+        name = geometry + self.projection(m)
+        plane = self.get(self.planes, name)
+        if plane is None or wcs.has_distortion:
+            world = self.get(self.worlds, geometry)
+            if world is None:
+                world = self.world(m, header, shape)
+                self.put(self.worlds, geometry, world, 2)
+            if wcs.has_distortion: #distortions aren't linear in the plane coordinates
+                return wcs.world_to_pixel_values(*world)
+            plane = self.plane(m, world)
+            self.put(self.planes, name, plane, self.size)
+        inverse = np.linalg.inv(wcs.wcs.get_cdelt()[:, None] * wcs.wcs.get_pc()) #plane = cdelt*pc @ (pixel - crpix)
+        crpix = wcs.wcs.crpix - 1 #0 based
+        return inverse[0, 0]*plane[0] + inverse[0, 1]*plane[1] + crpix[0], inverse[1, 0]*plane[0] + inverse[1, 1]*plane[1] + crpix[1]
+
+    #intermediate world coordinates of [world] (the coordinates of every output pixel) in the projection plane of m, as a (2, height, width) array - nan for pixels that aren't on the image
+    def plane(self, m, world):
+        lon, lat = np.ravel(world[0]), np.ravel(world[1])
+        plane = np.full((2, lon.size), np.nan)
+        valid = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        if len(valid) > 0:
+            ans = m.wcs.wcs.s2p(np.column_stack([lon[valid], lat[valid]]), 1) #with origin 0 astropy also shifts imgcrd by one
+            ok = ans['stat'] == 0
+            plane[:, valid[ok]] = ans['imgcrd'][ok].T
+        return plane.reshape((2,) + np.shape(world[0]))
+
+    #coordinates of the center of every output pixel in the frame of m, as values in the units of m's wcs - nan for pixels that aren't on the image
+    #pixels that don't map back onto themselves (e.g. the far side of the sun, which is hidden behind the near side) are dropped, like reproject does
+    def world(self, m, header, shape):
+        out = WCS(header)
+        y, x = np.indices(shape, dtype=float)
+        coords = out.pixel_to_world(x.ravel(), y.ravel()).transform_to(m.coordinate_frame)
+        units = m.wcs.world_axis_units
+        names = list(coords.frame.representation_component_names)[:2] #Tx and Ty for hpc, wrapped the same way as the wcs
+        lon, lat = getattr(coords, names[0]).to_value(units[0]), getattr(coords, names[1]).to_value(units[1])
+        back_x, back_y = out.world_to_pixel(SkyCoord(coords.frame.realize_frame(coords.represent_as(UnitSphericalRepresentation)))) #the distance is dropped, as it would be by going through the pixels of m
+        reset = ~(np.abs(back_x - x.ravel()) <= 1) | ~(np.abs(back_y - y.ravel()) <= 1)
+        lon[reset] = np.nan
+        lat[reset] = np.nan
+        return lon.reshape(shape), lat.reshape(shape)
+
+    def geometry(self, m, header): #cache key of the output header and the observer of m
+        observer = m.observer_coordinate
+        key = (round(observer.lon.deg/self.angle), round(observer.lat.deg/self.angle), round(np.log(observer.radius.m)/self.distance), round(m.coordinate_frame.rsun.to_value('m')))
+        times = ('date-obs', 'date_obs', 'date-beg', 'date-avg', 'date-end', 'mjd-obs', 'mjdref')
+        fixed = str(header.get('ctype1', '')).startswith('HGLN') #stonyhurst coordinates don't rotate with the sun, so the time of the output doesn't matter
+        return key + tuple(sorted((k, str(v)) for k, v in header.items() if not (fixed and k.lower() in times)))
+
+    def pointing(self, m): #cache key of the pixel grid of m
+        wcs = m.wcs.wcs
+        size = max(m.data.shape)
+        return (m.data.shape,) + tuple(round(v/self.pixel) for v in wcs.crpix) + tuple(round(v/wcs.cdelt[i]/self.pixel) for i, v in enumerate(wcs.crval)) \
+            + tuple(round(np.log(abs(v))*size/self.pixel) for v in wcs.cdelt) + tuple(round(v*size/self.pixel) for v in wcs.get_pc().ravel())
+
+    def projection(self, m): #cache key of the projection of m, without its pointing
+        wcs = m.wcs.wcs
+        return tuple(str(v) for v in wcs.ctype) + tuple(round(v/wcs.cdelt[i]/self.pixel) for i, v in enumerate(wcs.crval)) + (round(wcs.lonpole/self.angle), round(wcs.latpole/self.angle))
+
+    def get(self, cache, name):
+        with self.lock:
+            if name in cache:
+                cache.move_to_end(name)
+                return cache[name]
+        return None
+
+    def put(self, cache, name, value, size):
+        with self.lock:
+            cache[name] = value
+            cache.move_to_end(name)
+            while len(cache) > size:
+                cache.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.worlds.clear()
+            self.planes.clear()
+            self.luts.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'tables': len(self.luts), 'planes': len(self.planes), 'geometries': len(self.worlds)}
+
+    def __getstate__(self): #tables are computed again when needed
+        return {key: value for key, value in self.__dict__.items() if key in ('angle', 'distance', 'pixel', 'size')}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+#bilinear interpolation of an image at fixed positions (x, y), in pixels, with everything that doesn't depend on the image worked out beforehand
+#positions within half a pixel of the edge are moved onto the edge and positions further out give nan, the same as reproject
+class Gather():
+    def __init__(self, x, y, shape):
+        h, w = shape
+        x, y = np.ravel(x), np.ravel(y)
+        valid = (x >= -0.5) & (x <= w - 0.5) & (y >= -0.5) & (y <= h - 0.5) #false for nan too
+        self.where = np.flatnonzero(valid)
+        x = np.clip(x[self.where], 0, w - 1)
+        y = np.clip(y[self.where], 0, h - 1)
+        x0 = np.minimum(x.astype(np.intp), max(w - 2, 0))
+        y0 = np.minimum(y.astype(np.intp), max(h - 2, 0))
+        self.fx = (x - x0).astype(np.float32)
+        self.fy = (y - y0).astype(np.float32)
+        self.index = y0*w + x0 #top left of the four pixels that are interpolated
+        self.width = min(w, 2) - 1 #offset of the next column and row (0 for images that are one pixel wide)
+        self.height = (min(h, 2) - 1)*w
+        self.shape = shape
+
+    def apply(self, data, shape): #returns data interpolated at every position as an array of the given shape, nan where there isn't one
+        if data.shape != self.shape:
+            raise ValueError(f"Lookup table for {self.shape} images used on one of {data.shape}")
+        flat = np.ravel(data)
+        top = np.take(flat, self.index)
+        top = top + (np.take(flat, self.index + self.width) - top)*self.fx
+        bottom = np.take(flat, self.index + self.height)
+        bottom = bottom + (np.take(flat, self.index + self.height + self.width) - bottom)*self.fx
+        ans = np.full(shape[0]*shape[1], np.nan)
+        ans[self.where] = top + (bottom - top)*self.fy
+        return ans.reshape(shape)
+
+remapper = Remapper() #used by projections
@@ -0,0 +1,121 @@
+#end to end benchmark of the fetch pipeline against the offline stand-in in standin.py
+#measures search, frame selection, download and decode throughput for several numbers of workers, then a full util.get_maps call (cold and with the local catalog)
+#then downloads frames from a server that breaks some downloads halfway and corrupts others, to check that broken downloads are resumed from their .part files and corrupted ones are quarantined and downloaded again
+#example: python tests/bench_fetch.py --frames 50 --size 1024 --workers 1,4,8 --bandwidth 2000000 --breaks 3 --corrupt 1 --json bench.json
+
+import sys
+import os
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import astropy.time
+import astropy.units as u
+import numpy as np
+import argparse, json, shutil, tempfile, time, warnings
+
+import util, fetch, standin
+
+def bench(frames=20, interval=45, size=1024, workers=(1, 4, 8), latency=0, bandwidth=None, root=None, breaks=3, corrupt=1):
+    root = root or tempfile.mkdtemp(prefix="hmi_bench_")
+    server = standin.StandInServer(root=os.path.join(root, "server"), size=size, latency=latency, bandwidth=bandwidth).start()
+    source = standin.StandInSource(server.url)
+    t = astropy.time.Time('2017-01-21T09:45:00', scale='utc', format='isot')
+    tend = t + frames * interval * u.s
+    ans = {'frames': frames, 'interval': interval, 'size': size, 'latency': latency, 'bandwidth': bandwidth}
+
+    #the stand-in has a file every 45 s - with a longer interval, selection has to pick frames out of many more search results
+    start = time.perf_counter()
+    r = source.search(t - 22.5*u.s, tend + 22.5*u.s)
+    ans['search'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    requested = t + (interval * u.s) * np.arange(frames)
+    idx, err = util.select_frames(util.result_times(r).unix, requested.unix)
+    ans['select'] = time.perf_counter() - start
+    ans['candidates'] = len(r)
+    rows = [r[i] for i in idx]
+
+    for row in rows: #generate every file up front so generation time isn't counted as download time
+        server.generate(os.path.basename(row['url']))
+    mb = sum(os.path.getsize(os.path.join(server.root, os.path.basename(row['url']))) for row in rows) / 1e6
+
+    ans['fetch'] = []
+    for n in workers:
+        path = os.path.join(root, "client%d" % n)
+        engine = fetch.FetchEngine(max_workers=n, path=path, manager=fetch.DownloadManager(source=source, path=path, quarantine_path=os.path.join(path, "quarantine")))
+        start = time.perf_counter()
+        maps = engine.fetch(rows)
+        wall = time.perf_counter() - start
+        stats = engine.stats()
+        stats.update({'wall': wall, 'frames_per_second': len(maps)/wall, 'mb_per_second': mb/wall})
+        ans['fetch'].append(stats)
+        shutil.rmtree(path)
+
+    path = os.path.join(root, "get_maps")
+    start = time.perf_counter()
+    maps = util.get_maps(t, tend, interval=interval*u.s, source=source, path=path, max_conn=max(workers))
+    ans['get_maps'] = time.perf_counter() - start
+    start = time.perf_counter()
+    maps = util.get_maps(t, tend, interval=interval*u.s, source=source, path=path, max_conn=max(workers))
+    ans['get_maps_cached'] = time.perf_counter() - start
+
+    server.stop()
+    ans['faults'] = faults(os.path.join(root, "faults"), min(frames, 8), size, max(workers), breaks, corrupt)
+    shutil.rmtree(root)
+    return ans
+
+#downloads [frames] files through util.get_maps from a server that cuts off the first [breaks] downloads halfway and flips a byte in the next [corrupt] ones
+#every file should still arrive intact: broken downloads are resumed with a range request from their .part files, and corrupted ones fail verification, are quarantined and downloaded again
+def faults(root, frames=8, size=1024, workers=4, breaks=3, corrupt=1):
+    server = standin.StandInServer(root=os.path.join(root, "server"), size=size, breaks=breaks, corrupt=corrupt).start()
+    source = standin.StandInSource(server.url)
+    t = astropy.time.Time('2017-01-21T09:45:00', scale='utc', format='isot')
+    tend = t + frames * 45 * u.s
+    path = os.path.join(root, "client")
+    engine = fetch.FetchEngine(max_workers=workers, path=path, manager=fetch.DownloadManager(source=source, path=path, quarantine_path=os.path.join(path, "quarantine"), backoff=0.05,
+                                                                                             chunk_size=1 << 14)) #small enough that part of every broken download reaches the .part file
+    start = time.perf_counter()
+    maps = list(util.iter_maps(t, tend, interval=45*u.s, source=source, path=path, engine=engine, use_catalog=False))
+    wall = time.perf_counter() - start
+    files = [file for file in os.listdir(path) if file.endswith('.fits')]
+    intact = all(open(os.path.join(path, file), 'rb').read() == open(os.path.join(server.root, file), 'rb').read() for file in files)
+    quarantine = os.path.join(path, "quarantine")
+    ans = {'frames': len(maps), 'requested': frames, 'breaks': breaks, 'corrupt': corrupt, 'wall': wall, 'resumed': server.resumed, 'requests': server.requests,
+           'quarantined': len(os.listdir(quarantine)) if os.path.exists(quarantine) else 0, 'parts left': len([file for file in os.listdir(path) if file.endswith('.part')]),
+           'intact': intact, 'failed': len(engine.failed)}
+    server.stop()
+    return ans
+
+def report(ans):
+    print(f"{ans['frames']} frames of {ans['size']}x{ans['size']} ({ans['candidates']} search results)")
+    print(f"search        {ans['search']*1000:9.1f} ms")
+    print(f"select        {ans['select']*1000:9.1f} ms")
+    print("workers   wall (s)   frames/s    MB/s   fetch median (s)   decode median (s)")
+    for s in ans['fetch']:
+        print("%7d %10.2f %10.2f %7.1f %18.3f %19.3f" % (s['max_workers'], s['wall'], s['frames_per_second'], s['mb_per_second'], s['fetch_median'], s['decode_median']))
+    print(f"get_maps      {ans['get_maps']:9.2f} s")
+    print(f"get_maps (catalog) {ans['get_maps_cached']:4.2f} s")
+    f = ans['faults']
+    print(f"faults: {f['frames']}/{f['requested']} frames in {f['wall']:.2f} s with {f['breaks']} broken and {f['corrupt']} corrupted downloads - {f['requests']} requests, {f['resumed']} resumed, "
+          f"{f['quarantined']} quarantined, {f['parts left']} .part files left, {f['failed']} failed, files {'intact' if f['intact'] else 'DIFFER FROM THE SERVER'}")
+
+if __name__ == '__main__':
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--interval', type=int, default=45, help="seconds between requested frames")
+    parser.add_argument('--size', type=int, default=1024, help="image width in pixels (4096 for real hmi data)")
+    parser.add_argument('--workers', default="1,4,8", help="comma separated list of worker counts to compare")
+    parser.add_argument('--latency', type=float, default=0, help="seconds before the first byte of every file")
+    parser.add_argument('--bandwidth', type=float, default=None, help="bytes per second per connection")
+    parser.add_argument('--breaks', type=int, default=3, help="downloads cut off halfway in the fault test")
+    parser.add_argument('--corrupt', type=int, default=1, help="downloads served with a flipped byte in the fault test")
+    parser.add_argument('--json', default=None, help="file to write the results to, for tracking regressions")
+    args = parser.parse_args()
+
+    ans = bench(args.frames, args.interval, args.size, [int(w) for w in args.workers.split(',')], args.latency, args.bandwidth, breaks=args.breaks, corrupt=args.corrupt)
+    report(ans)
+    if args.json is not None:
+        with open(args.json, 'w') as fh:
+            json.dump(ans, fh, indent=2)
@@ -0,0 +1,96 @@
+#accuracy check and benchmark of heliographic.py against astropy's wcs/sunpy's frames and reproject_to
+#point transforms are compared on random pixels of a synthetic magnetogram and of cea headers made by CylindricalEqualArea.header, then frames are reprojected both ways and compared pixel by pixel
+#exits with status 1 if any error is over its tolerance
+#example: python tests/bench_heliographic.py --size 4096 --height 1024
+
+import sys
+import os
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import astropy.time
+import astropy.units as u
+import sunpy.map
+import sunpy.coordinates
+import numpy as np
+import argparse, shutil, tempfile, time, warnings
+
+import heliographic, projections, standin
+
+PIXEL = 1e-4 #tolerance of point transforms, in pixels
+VALUE = 1e-3 #tolerance of reprojected values, as a fraction of the largest value
+
+def points(m, size, frames=2, height=512, n=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    errors = {}
+    x, y = rng.uniform(0, size - 1, n), rng.uniform(0, size - 1, n)
+
+    #helioprojective pixels <-> arcsec
+    c = m.wcs.pixel_to_world(x, y)
+    tx, ty = heliographic.pixel_to_world(m, x, y)
+    cdelt = m.meta['cdelt1']
+    errors['hpc pixel -> world'] = max(np.abs(tx - c.Tx.arcsec).max(), np.abs(ty - c.Ty.arcsec).max())/cdelt
+    px, py = heliographic.world_to_pixel(m, c.Tx.arcsec, c.Ty.arcsec)
+    errors['hpc world -> pixel'] = max(np.abs(px - x).max(), np.abs(py - y).max())
+
+    #helioprojective pixels <-> stonyhurst
+    hg = c.transform_to(sunpy.coordinates.HeliographicStonyhurst)
+    on = np.isfinite(hg.lon.deg)
+    lon, lat = heliographic.pixel_to_hg(m, x, y)
+    errors['off disk mismatches'] = int(np.sum(np.isfinite(lon) != on))
+    lon_err = np.abs((lon - hg.lon.deg + 180) % 360 - 180)[on] * np.cos(np.radians(lat[on]))
+    errors['hpc pixel -> hg'] = max(lon_err.max(), np.abs(lat - hg.lat.deg)[on].max()) * 3600/cdelt * m.rsun_obs.to_value(u.arcsec)/(180/np.pi*3600) #degrees on the sun -> pixels at disk center
+    px, py = heliographic.hg_to_pixel(m, hg.lon.deg[on], hg.lat.deg[on])
+    errors['hg -> hpc pixel'] = max(np.abs(px - x[on]).max(), np.abs(py - y[on]).max())
+
+    #cea pixels <-> stonyhurst, for a header centered on the disk and one that isn't
+    for name, kwargs in (('cea', {}), ('cea off center', {'origin_x': 30, 'origin_y': -20})):
+        header = projections.CylindricalEqualArea.header(m, h=height, **kwargs)
+        cea = sunpy.map.Map((np.zeros((int(header['naxis2']), int(header['naxis1']))), header))
+        x, y = rng.uniform(0, header['naxis1'] - 1, n), rng.uniform(0, header['naxis2'] - 1, n)
+        c = cea.wcs.pixel_to_world(x, y)
+        lon, lat = heliographic.pixel_to_world(cea, x, y)
+        errors[f'{name} pixel -> world'] = max(np.abs((lon - c.lon.deg + 180) % 360 - 180).max(), np.abs(lat - c.lat.deg).max())/header['cdelt1']
+        px, py = heliographic.world_to_pixel(cea, c.lon.deg, c.lat.deg)
+        errors[f'{name} world -> pixel'] = max(np.abs(px - x).max(), np.abs(py - y).max())
+    return errors
+
+def bench(frames=4, size=1024, height=512):
+    root = tempfile.mkdtemp(prefix="hmi_heliographic_")
+    t = astropy.time.Time('2017-06-21T09:45:00', scale='utc', format='isot')
+    maps = [sunpy.map.Map(standin.make_magnetogram(t + 3*k*u.hour, root, size=size, seed=k)) for k in range(frames)]
+    shutil.rmtree(root)
+    ans = {'frames': frames, 'size': size, 'height': height, 'errors': points(maps[0], size, height=height)}
+
+    headers = [projections.CylindricalEqualArea.header(m, h=height) for m in maps]
+    start = time.perf_counter()
+    ref = [m.reproject_to(header) for m, header in zip(maps, headers)]
+    ans['reproject_to'] = time.perf_counter() - start
+    start = time.perf_counter()
+    got = [heliographic.reproject(m, header) for m, header in zip(maps, headers)]
+    ans['analytic'] = time.perf_counter() - start
+
+    ans['nan mismatches'] = sum(int(np.sum(np.isnan(a.data) != np.isnan(b.data))) for a, b in zip(ref, got))
+    ans['errors']['reprojected values'] = max(float(np.nanmax(np.abs(a.data - b.data))/np.nanmax(np.abs(a.data))) for a, b in zip(ref, got))
+    return ans
+
+if __name__ == '__main__':
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=4)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=512, help="height of the cea projection")
+    args = parser.parse_args()
+
+    ans = bench(args.frames, args.size, args.height)
+    failed = False
+    print(f"{ans['frames']} frames of {ans['size']}x{ans['size']} -> cea {ans['height']} high")
+    for name, error in ans['errors'].items():
+        limit = VALUE if name == 'reprojected values' else 0 if name == 'off disk mismatches' else PIXEL
+        failed |= error > limit
+        print(f"{name:26s} {error:10.3g} {'ok' if error <= limit else 'FAILED'}")
+    print(f"reprojected nan mismatches {ans['nan mismatches']} (pixels on the edge of the disk)")
+    print(f"reproject_to  {ans['reproject_to']:8.2f} s")
+    print(f"analytic      {ans['analytic']:8.2f} s ({ans['reproject_to']/ans['analytic']:.1f}x)")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,61 @@
+#benchmark of parallel.ProjectionPool against projecting the frames one at a time in this process
+#synthetic magnetograms are projected to cea serially and then by pools of different sizes, with the output in float64 and in float32 (what MList.project asks for when dtype is set), and checked against the serial projections
+#example: python tests/bench_parallel.py --frames 16 --size 1024 --height 512 --workers 1 2 4 8
+
+import sys
+import os
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import astropy.time
+import astropy.units as u
+import sunpy.map
+import numpy as np
+import argparse, shutil, tempfile, time, warnings
+
+import parallel, projections, standin
+
+def bench(frames=16, size=1024, height=512, workers=(1, 2, 4), budget=None):
+    root = tempfile.mkdtemp(prefix="hmi_parallel_")
+    t = astropy.time.Time('2017-06-21T09:45:00', scale='utc', format='isot')
+    maps = [sunpy.map.Map(standin.make_magnetogram(t + 3*k*u.hour, root, size=size, seed=k)) for k in range(frames)]
+    shutil.rmtree(root)
+    projection = projections.CylindricalEqualArea
+
+    start = time.perf_counter()
+    ref = [projection.from_hpc(m, h=height).data for m in maps]
+    ans = {'serial': time.perf_counter() - start, 'pools': []}
+
+    for n in workers:
+        for dtype in (np.float64, np.float32):
+            pool = parallel.ProjectionPool(workers=n)
+            if budget is not None:
+                pool.budget = budget
+            header = projection.header(maps[0], h=height)
+            chunk = pool.size(maps[0], (int(header['naxis2']), int(header['naxis1'])), np.dtype(dtype))
+            got = [None] * frames
+            start = time.perf_counter()
+            for i, m in pool.run(maps, projection, dtype=dtype, h=height):
+                got[i] = m.data
+            wall = time.perf_counter() - start
+            error = max(float(np.nanmax(np.abs(a - b))/np.nanmax(np.abs(a))) for a, b in zip(ref, got))
+            shared = chunk * (maps[0].data.nbytes + ref[0].size * np.dtype(dtype).itemsize)
+            ans['pools'].append({'workers': n, 'dtype': np.dtype(dtype).name, 'wall': wall, 'chunk': chunk, 'shared': shared, 'error': error})
+    return ans
+
+if __name__ == '__main__':
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=16)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=512, help="height of the cea projection")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--budget', type=int, default=None, help="bytes of shared memory per chunk (ProjectionPool.budget by default)")
+    args = parser.parse_args()
+
+    ans = bench(args.frames, args.size, args.height, sorted(set(args.workers)), args.budget)
+    print(f"{args.frames} frames of {args.size}x{args.size} -> cea {args.height} high")
+    print(f"serial          {ans['serial']:8.2f} s")
+    for pool in ans['pools']:
+        print(f"{pool['workers']:2d} workers {pool['dtype']:7s} {pool['wall']:8.2f} s ({ans['serial']/pool['wall']:.1f}x) - {pool['chunk']} frames per chunk, {pool['shared']/2**20:.0f} MB of shared memory, largest error {pool['error']:.2g}")
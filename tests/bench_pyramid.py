@@ -0,0 +1,57 @@
+#benchmark of building the downscaled pyramid levels (hpc2048 and hpc1024) of a stack of frames
+#compares sunpy's superpixel, one map at a time, with util.block_pyramid over the whole stack plus util.block_meta for the headers
+#example: python tests/bench_pyramid.py --frames 16 --size 4096
+
+import sys
+import os
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import astropy.time
+import astropy.units as u
+import sunpy.map
+import numpy as np
+import argparse, shutil, tempfile, time, warnings
+
+import util, standin
+
+def bench(frames=16, size=4096, mode="nanmean", dtype=None):
+    root = tempfile.mkdtemp(prefix="hmi_pyramid_")
+    t = astropy.time.Time('2017-01-21T09:45:00', scale='utc', format='isot')
+    maps = [sunpy.map.Map(standin.make_magnetogram(t + 45*k*u.s, root, size=size, seed=k)) for k in range(frames)]
+    shutil.rmtree(root)
+    stack = np.stack([m.data for m in maps]).astype(dtype or np.float64)
+    ans = {'frames': frames, 'size': size, 'mode': mode, 'dtype': str(stack.dtype)}
+
+    start = time.perf_counter()
+    for m in maps:
+        half = m.superpixel([2, 2]*u.pix)
+        half.superpixel([2, 2]*u.pix).wcs
+    ans['superpixel'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    half, quarter = util.block_pyramid(stack, (2, 4), mode)
+    metas = [util.block_meta(m.meta, 4) for m in maps]
+    ans['block_reduce'] = time.perf_counter() - start
+
+    #the wcs of every level is the same as the one sunpy derives
+    check = sunpy.map.Map((quarter[0], metas[0]))
+    ref = maps[0].superpixel([4, 4]*u.pix)
+    ans['wcs_match'] = bool(np.allclose(check.wcs.wcs.crpix, ref.wcs.wcs.crpix) and np.allclose(check.wcs.wcs.cdelt, ref.wcs.wcs.cdelt))
+    return ans
+
+if __name__ == '__main__':
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=16)
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--float32', action='store_true', help="reduce float32 frames, like an MList with dtype=\"float32\"")
+    parser.add_argument('--mode', default="nanmean", help="nanmean, mean or sum")
+    args = parser.parse_args()
+
+    ans = bench(args.frames, args.size, args.mode, np.float32 if args.float32 else None)
+    print(f"{ans['frames']} frames of {ans['size']}x{ans['size']} ({ans['dtype']}), {ans['mode']}")
+    print(f"superpixel    {ans['superpixel']:8.2f} s")
+    print(f"block_reduce  {ans['block_reduce']:8.2f} s ({ans['superpixel']/ans['block_reduce']:.1f}x)")
+    print(f"wcs matches superpixel: {ans['wcs_match']}")
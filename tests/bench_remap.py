@@ -0,0 +1,73 @@
+#accuracy check and benchmark of the lookup table reprojection in remap.py (from_hpc(..., algorithm='lut')) against reproject_to
+#consecutive frames are reprojected to cea once with a steady pointing, where every frame after the first reuses the same gather table, and once with crpix and crota drifting from frame to frame like hmi's, where only the plane coordinates are reused
+#exits with status 1 if any reprojected value is off by more than VALUE
+#example: python tests/bench_remap.py --frames 8 --size 4096 --height 1024
+
+import sys
+import os
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import astropy.time
+import astropy.units as u
+import sunpy.map
+import numpy as np
+import argparse, shutil, tempfile, time, warnings
+
+import projections, remap, standin
+
+VALUE = 1e-3 #tolerance of reprojected values, as a fraction of the largest value
+
+def frames(n, size, drift):
+    root = tempfile.mkdtemp(prefix="hmi_remap_")
+    t = astropy.time.Time('2017-06-21T09:45:00', scale='utc', format='isot')
+    maps = []
+    for k in range(n):
+        m = sunpy.map.Map(standin.make_magnetogram(t + 45*k*u.s, root, size=size, seed=k))
+        if drift: #hmi's pointing moves by a fraction of a pixel between frames
+            m.meta['crpix1'] += 0.037*k
+            m.meta['crpix2'] -= 0.021*k
+            m.meta['crota2'] += 2e-4*k
+            m = sunpy.map.Map((m.data, m.meta))
+        maps.append(m)
+    shutil.rmtree(root)
+    return maps
+
+def bench(n=8, size=1024, height=512, drift=False):
+    maps = frames(n, size, drift)
+    projection = projections.CylindricalEqualArea
+    ans = {'drift': drift}
+
+    start = time.perf_counter()
+    ref = [projection.from_hpc(m, h=height) for m in maps]
+    ans['reproject_to'] = time.perf_counter() - start
+
+    remap.remapper.clear()
+    remap.remapper.hits = remap.remapper.misses = 0
+    start = time.perf_counter()
+    got = [projection.from_hpc(m, h=height, algorithm='lut') for m in maps]
+    ans['lut'] = time.perf_counter() - start
+    ans.update(remap.remapper.stats())
+
+    ans['nan mismatches'] = sum(int(np.sum(np.isnan(a.data) != np.isnan(b.data))) for a, b in zip(ref, got))
+    ans['error'] = max(float(np.nanmax(np.abs(a.data - b.data))/np.nanmax(np.abs(a.data))) for a, b in zip(ref, got))
+    return ans
+
+if __name__ == '__main__':
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=8)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=512, help="height of the cea projection")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{args.frames} frames of {args.size}x{args.size} -> cea {args.height} high")
+    for drift in (False, True):
+        ans = bench(args.frames, args.size, args.height, drift)
+        failed |= ans['error'] > VALUE
+        print(f"{'drifting' if drift else 'steady'} pointing: reproject_to {ans['reproject_to']:.2f} s, lut {ans['lut']:.2f} s ({ans['reproject_to']/ans['lut']:.1f}x)"
+              f" - {ans['hits']} hits, {ans['misses']} misses, {ans['planes']} planes")
+        print(f"    largest error {ans['error']:.3g} {'ok' if ans['error'] <= VALUE else 'FAILED'}, nan mismatches {ans['nan mismatches']} (pixels on the edge of the disk)")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,363 @@
+#offline stand-in for the services util.get_maps and getSRS.get_files normally talk to, so that they can be run and benchmarked without a network connection
+# - make_magnetogram writes synthetic HMI-like magnetograms: helioprojective WCS headers computed from the observation time, NaNs off the disk, scaled integers and Rice compression like the real files
+# - StandInServer is an http server with a search endpoint and a file endpoint (with range requests, optional latency and bandwidth limits, and downloads that break or arrive corrupted on request)
+# - StandInClient is a sunpy Fido client for it, and StandInSource a fetch.FidoSource that searches and resolves through a Fido that only knows that client, so util.get_maps goes through the same Fido, URLRecorder and DownloadManager code as with jsoc/vso
+# - make_srs_tree and StandInFTP mimic the pub/warehouse/<year>/SRS tree on ftp.swpc.noaa.gov
+#run this file directly to start both servers
+
+import sys
+import os
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from astropy.io import fits
+import astropy.time
+import astropy.units as u
+import sunpy.coordinates.sun
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from sunpy.net import attrs as a, fido_factory
+from sunpy.net.base_client import BaseClient, QueryResponseTable
+import requests, threading, json, time, zlib
+import fetch
+
+#writes a synthetic magnetogram observed at time t to [path] and returns the file name
+#size is the width of the image in pixels (4096 for real HMI data) - the plate scale is adjusted so the disk always covers the same part of the image
+def make_magnetogram(t: astropy.time.Time, path, size=4096, cadence=45, seed=None):
+    t_rec = record_time(t, cadence)
+    name = "hmi_m_%ds_%s_tai_magnetogram.fits" % (cadence, t_rec.tai.strftime("%Y_%m_%d_%H_%M_%S"))
+    file = os.path.join(path, name)
+    if os.path.exists(file):
+        return file
+
+    rsun = sunpy.coordinates.sun.angular_radius(t_rec).to_value(u.arcsec)
+    cdelt = 0.504365 * 4096/size
+    crpix = size/2 + 0.5 + 1.3 * 4096/size #hmi's disk center is never exactly in the middle
+    header = fits.Header()
+    header['DATE-OBS'] = t_rec.utc.isot
+    header['T_OBS'] = t_rec.tai.strftime("%Y.%m.%d_%H:%M:%S") + ".00_TAI"
+    header['T_REC'] = t_rec.tai.strftime("%Y.%m.%d_%H:%M:%S") + "_TAI"
+    header['CADENCE'] = float(cadence)
+    header['TELESCOP'] = 'SDO/HMI'
+    header['INSTRUME'] = 'HMI_FRONT2'
+    header['WAVELNTH'] = 6173.0
+    header['WAVEUNIT'] = 'angstrom'
+    header['CONTENT'] = 'MAGNETOGRAM'
+    header['BUNIT'] = 'Gauss'
+    header['CTYPE1'] = 'HPLN-TAN'
+    header['CTYPE2'] = 'HPLT-TAN'
+    header['CUNIT1'] = 'arcsec'
+    header['CUNIT2'] = 'arcsec'
+    header['CRPIX1'] = crpix
+    header['CRPIX2'] = crpix
+    header['CRVAL1'] = 0.0
+    header['CRVAL2'] = 0.0
+    header['CDELT1'] = cdelt
+    header['CDELT2'] = cdelt
+    header['CROTA2'] = 179.93 #hmi images are upside down
+    header['DSUN_OBS'] = sunpy.coordinates.sun.earth_distance(t_rec).to_value(u.m)
+    header['RSUN_OBS'] = rsun
+    header['RSUN_REF'] = 696000000.0
+    header['CRLN_OBS'] = sunpy.coordinates.sun.L0(t_rec).to_value(u.deg)
+    header['CRLT_OBS'] = sunpy.coordinates.sun.B0(t_rec).to_value(u.deg)
+    header['HGLN_OBS'] = 0.0
+    header['HGLT_OBS'] = header['CRLT_OBS']
+    header['BLANK'] = -2147483648
+
+    #like the real files, values are stored as integers in units of 0.1 G with BLANK off the disk
+    data = synthetic_field(size, rsun/cdelt, crpix - 1, seed if seed is not None else zlib.crc32(name.encode()))
+    ints = np.where(np.isnan(data), header['BLANK'], np.round(data/0.1)).astype(np.int32)
+    hdu = fits.CompImageHDU(data=ints, header=header, compression_type='RICE_1')
+    hdu.header['BSCALE'] = 0.1 #set after the data so astropy doesn't try to scale the integers again
+    hdu.header['BZERO'] = 0.0
+    os.makedirs(path, exist_ok=True)
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(file + ".tmp", checksum=True, overwrite=True)
+    os.replace(file + ".tmp", file)
+    return file
+
+#noise plus a handful of bipolar regions on a disk of radius r pixels centered on pixel c - NaN outside of the disk
+def synthetic_field(size, r, c, seed):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    x -= c
+    y -= c
+    data = rng.normal(0, 8, (size, size)).astype(np.float32)
+    for _ in range(rng.integers(3, 8)):
+        angle = rng.uniform(0, 2*np.pi)
+        dist = rng.uniform(0, 0.8) * r
+        cx, cy = dist * np.cos(angle), dist * np.sin(angle)
+        width = rng.uniform(0.005, 0.02) * r
+        sep = rng.uniform(1.5, 3) * width
+        strength = rng.uniform(500, 2500)
+        for sign, offset in ((1, -sep/2), (-1, sep/2)):
+            data += sign * strength * np.exp(-((x - cx - offset)**2 + (y - cy)**2)/(2*width**2))
+    data[x**2 + y**2 > r**2] = np.nan
+    return data
+
+def record_time(t, cadence): #rounds t to the closest record time of a series with the given cadence
+    return astropy.time.Time(np.round(t.unix/cadence)*cadence, format='unix', scale='utc')
+
+#http server standing in for jsoc/vso
+#  /search?start=<isot>&end=<isot>&cadence=<seconds> returns json rows with the record times and urls of every file in the time range
+#  /files/<name> serves a file, generating it the first time it is requested. Range requests are supported so resumed downloads can be tested
+#latency (seconds before the first byte) and bandwidth (bytes per second per connection) can be set to imitate a slow link
+#the next [breaks] file downloads are cut off halfway (so they have to be resumed from their .part file) and the next [corrupt] ones have a byte flipped (so they fail checksum verification and are quarantined)
+class StandInServer():
+    root = "./data/standin" #directory generated files are kept in
+    size = 4096 #width of generated images
+    latency = 0
+    bandwidth = None
+    breaks = 0
+    corrupt = 0
+    host = "127.0.0.1"
+    port = 0 #0 picks a free port
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.requests = 0 #number of file requests served
+        self.resumed = 0 #number of file requests that asked for a range (resumed downloads)
+        self.server = ThreadingHTTPServer((self.host, self.port), self.handler())
+        self.url = "http://%s:%d" % self.server.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def times(self, start, end, cadence):
+        t = np.arange(np.ceil(start.unix/cadence), np.floor(end.unix/cadence) + 1) * cadence
+        return astropy.time.Time(t, format='unix', scale='utc')
+
+    def generate(self, name): #generates the file with the given name if it doesn't exist yet
+        with self.lock:
+            lock = self.locks.setdefault(name, threading.Lock())
+        with lock: #two clients asking for the same file at once should not generate it twice
+            file = os.path.join(self.root, name)
+            if not os.path.exists(file):
+                parts = name.split('_')
+                cadence = int(parts[2][:-1])
+                t = astropy.time.Time.strptime('_'.join(parts[3:9]), "%Y_%m_%d_%H_%M_%S", scale='tai').utc
+                make_magnetogram(t, self.root, size=self.size, cadence=cadence)
+            return file
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/search':
+                    self.search(parse_qs(url.query))
+                elif url.path.startswith('/files/'):
+                    self.file(os.path.basename(url.path))
+                else:
+                    self.send_error(404)
+
+            def search(self, query):
+                start = astropy.time.Time(query['start'][0], scale='utc')
+                end = astropy.time.Time(query['end'][0], scale='utc')
+                cadence = int(query.get('cadence', ['45'])[0])
+                rows = []
+                for t in server.times(start, end, cadence):
+                    tai = t.tai.strftime("%Y_%m_%d_%H_%M_%S")
+                    rows.append({
+                        'start': t.isot,
+                        't_rec': t.tai.strftime("%Y.%m.%d_%H:%M:%S") + "_TAI",
+                        'url': "/files/hmi_m_%ds_%s_tai_magnetogram.fits" % (cadence, tai),
+                    })
+                body = json.dumps(rows).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def file(self, name):
+                try:
+                    file = server.generate(name)
+                except (ValueError, IndexError):
+                    self.send_error(404)
+                    return
+                with server.lock:
+                    server.requests += 1
+                    server.resumed += 'Range' in self.headers
+                    cut = server.breaks > 0
+                    server.breaks -= cut
+                    flip = not cut and 'Range' not in self.headers and server.corrupt > 0
+                    server.corrupt -= flip
+                size = os.path.getsize(file)
+                start = 0
+                if 'Range' in self.headers:
+                    start = int(self.headers['Range'].split('=')[1].split('-')[0])
+                    if start >= size:
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', "bytes %d-%d/%d" % (start, size - 1, size))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(size - start))
+                self.send_header('Content-Disposition', 'attachment; filename="%s"' % name)
+                self.end_headers()
+                time.sleep(server.latency)
+                with open(file, 'rb') as fh:
+                    fh.seek(start)
+                    chunk = 1 << 16
+                    sent = 0
+                    end = start + (size - start)//2 if cut else size #a broken download stops halfway, after the headers promised the whole file
+                    while sent < end - start:
+                        data = fh.read(min(chunk, end - start - sent))
+                        if not data:
+                            break
+                        if flip and start + sent <= size*3//4 < start + sent + len(data): #in the compressed image, which the checksums cover
+                            k = size*3//4 - start - sent
+                            data = data[:k] + bytes([data[k] ^ 0xff]) + data[k + 1:]
+                        self.wfile.write(data)
+                        sent += len(data)
+                        if server.bandwidth:
+                            time.sleep(len(data)/server.bandwidth)
+                    if cut:
+                        self.close_connection = True
+
+        return Handler
+
+#sunpy Fido client for a StandInServer - it answers the same queries fetch.FidoSource makes (hmi.m_45s through a.Instrument.hmi, hmi.m_720s through a.jsoc.Series)
+#like the vso client, hmi.m_45s files are given to the downloader with a function that names them after the response, and like the jsoc client hmi.m_720s files get a path
+#it isn't registered with sunpy.net.Fido - use fido(url) to get a Fido that only knows this client for the server at url
+class StandInClient(BaseClient):
+    url = None #server the client talks to - set by fido
+
+    def search(self, *query):
+        start = end = None
+        cadence = 45
+        for q in query:
+            if isinstance(q, a.Time):
+                start, end = q.start, q.end
+            elif isinstance(q, a.jsoc.Series) and '720' in q.value:
+                cadence = 720
+        params = {'start': start.utc.isot, 'end': end.utc.isot, 'cadence': cadence}
+        rows = requests.get(self.url + "/search", params=params).json()
+        return QueryResponseTable({
+            'Start Time': astropy.time.Time([row['start'] for row in rows], scale='utc', format='isot') if len(rows) > 0 else astropy.time.Time([], format='isot'),
+            'T_REC': [row['t_rec'] for row in rows],
+            'url': [row['url'] for row in rows],
+        }, client=self)
+
+    def fetch(self, query_results, *, path=None, downloader=None, **kwargs):
+        for row in query_results:
+            url = self.url + row['url']
+            name = url.split('/')[-1]
+            if '_720s_' in name:
+                downloader.enqueue_file(url, filename=str(path).format(file=name))
+            else:
+                downloader.enqueue_file(url, filename=lambda resp, url, path=path: str(path).format(file=attachment(resp) or url.split('/')[-1]))
+
+    @classmethod
+    def _can_handle_query(cls, *query):
+        return any(isinstance(q, a.Time) for q in query) and all(isinstance(q, (a.Time, a.Instrument, a.Physobs, a.jsoc.Series, a.jsoc.Notify)) for q in query)
+
+BaseClient._registry.pop(StandInClient, None) #sunpy registers every client with Fido
+
+def fido(url): #sunpy Fido (a UnifiedDownloaderFactory) that searches and fetches through a StandInClient for the server at url
+    client = type('StandInClient', (StandInClient,), {'url': url})
+    BaseClient._registry.pop(client, None)
+    return fido_factory.UnifiedDownloaderFactory(registry={client: client._can_handle_query}, additional_validation_functions=['_can_handle_query'])
+
+def attachment(resp): #file name in the Content-Disposition header of an http response, or None
+    if resp is None:
+        return None
+    disposition = resp.headers.get('Content-Disposition', '')
+    return disposition.split('filename=')[-1].strip('"') if 'filename=' in disposition else None
+
+#fetch.FidoSource for util.get_maps that talks to a StandInServer
+class StandInSource(fetch.FidoSource):
+    def __init__(self, url):
+        super().__init__(fido=fido(url))
+        self.url = url
+
+#writes synthetic solar region summaries for [days] days from [start] into root/pub/warehouse/<year>/SRS/<yyyymmdd>SRS.txt, the layout getSRS.get_files expects
+def make_srs_tree(root, start: astropy.time.Time, days=30, seed=0):
+    rng = np.random.default_rng(seed)
+    for day in range(days):
+        t = start + day * u.day
+        folder = os.path.join(root, "pub", "warehouse", t.strftime("%Y"), "SRS")
+        os.makedirs(folder, exist_ok=True)
+        lines = [
+            ":Product: %sSRS.txt" % t.strftime("%m%d"),
+            ":Issued: %s 0030 UTC" % t.strftime("%Y %b %d"),
+            "# Prepared jointly by the U.S. Dept. of Commerce, NOAA, Space Weather Prediction Center and the U.S. Air Force.",
+            "Joint USAF/NOAA Solar Region Summary",
+            "I.  Regions with Sunspots.  Locations Valid at %s/2400Z" % t.strftime("%d"),
+            "Nmbr Location  Lo  Area  Z   LL   NN Mag Type",
+        ]
+        for i in range(rng.integers(1, 6)):
+            lines.append("%04d %s%02d%s%02d %5d  %04d %-3s  %02d   %02d %s" % (
+                (2600 + day//5 + i) % 10000, "NS"[rng.integers(2)], rng.integers(0, 40), "EW"[rng.integers(2)], rng.integers(0, 90),
+                rng.integers(0, 360), rng.integers(10, 500), ["Axx", "Bxo", "Cao", "Dai", "Eki"][rng.integers(5)],
+                rng.integers(1, 15), rng.integers(1, 30), ["Alpha", "Beta", "Beta-Gamma"][rng.integers(3)]))
+        lines += [
+            "IA. H-alpha Plages without Spots.  Locations Valid at %s/2400Z" % t.strftime("%d"),
+            "Nmbr  Location  Lo",
+            "None",
+        ]
+        with open(os.path.join(folder, t.strftime("%Y%m%d") + "SRS.txt"), 'w') as fh:
+            fh.write("\n".join(lines) + "\n")
+
+#anonymous read only ftp server for a tree made by make_srs_tree - requires pyftpdlib
+class StandInFTP():
+    def __init__(self, root, host="127.0.0.1", port=2121):
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+
+        class Handler(FTPHandler):
+            def ftp_NLST(self, path): #like ftp.swpc.noaa.gov, files in other directories are listed with their path relative to the working directory
+                try:
+                    listing = sorted(self.run_as_current_user(self.fs.listdir, path))
+                except OSError as err:
+                    self.respond("550 %s." % err.strerror)
+                    return
+                prefix = os.path.relpath(self.fs.fs2ftp(path), self.fs.cwd)
+                if prefix != '.':
+                    listing = [prefix + '/' + name for name in listing]
+                self.push_dtp_data(("\r\n".join(listing) + "\r\n").encode(), cmd="NLST")
+                return path
+
+        Handler.authorizer = DummyAuthorizer()
+        Handler.authorizer.add_anonymous(os.path.abspath(root))
+        handler = Handler
+        self.server = ThreadedFTPServer((host, port), handler)
+        self.host, self.port = self.server.address[:2]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.close_all()
+
+if __name__ == '__main__':
+    server = StandInServer(root="./data/standin/hmi", port=8045).start()
+    print(f"http stand-in running at {server.url} - use util.get_maps(..., source=StandInSource('{server.url}'))")
+    make_srs_tree("./data/standin/ftp", astropy.time.Time('2017-01-01T00:00:00', scale='utc', format='isot'), days=60)
+    try:
+        ftp = StandInFTP("./data/standin/ftp").start()
+        print(f"ftp stand-in running at {ftp.host}:{ftp.port} - use getSRS.get_files(d, host='{ftp.host}', port={ftp.port})")
+    except ImportError:
+        print("pyftpdlib is not installed - the ftp stand-in is disabled")
+    while True:
+        time.sleep(1)
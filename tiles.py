@@ -0,0 +1,28 @@
+from astropy.io import fits
+
+import numpy as np
+
+#reads parts of tile compressed FITS images without decompressing the whole image
+#hmi magnetograms are rice compressed one tile at a time, so a box only needs the tiles it intersects - a 512x512 active region crop of a 4096x4096 image decompresses about 1/8 of the tiles (rows) and keeps 1/64 of the pixels
+
+def read_box(file, r1, r2, c1, c2): #returns data[r1:r2, c1:c2] of the image in [file] (rows r1 to r2, columns c1 to c2 of the original, untransformed image)
+    with fits.open(file) as hdul:
+        hdu = hdul[-1] #hmi files are tile compressed, so the image is in the last hdu
+        if isinstance(hdu, fits.CompImageHDU) and not hasattr(hdu, 'section'): #older versions of astropy can only decompress the whole image
+            return np.array(hdu.data[r1:r2, c1:c2])
+        return np.array(hdu.section[r1:r2, c1:c2]) #only decompresses the tiles that intersect the box - scaling and BLANK (as nan) are applied like in hdu.data
+
+def read_header(file): #returns the header of the image in [file] as a dict with lower case keys (like sunpy map meta), without decompressing anything
+    with fits.open(file) as hdul:
+        return {key.lower(): value for key, value in hdul[-1].header.items() if key not in ('COMMENT', 'HISTORY', '')}
+
+def tiles(file, r1, r2, c1, c2): #returns (number of tiles that intersect the box, total number of tiles) - useful for checking how much of a file read_box has to decompress
+    with fits.open(file, disable_image_compression=True) as hdul:
+        header = hdul[-1].header
+    if 'ZIMAGE' not in header:
+        return 1, 1
+    h, w = header['ZNAXIS2'], header['ZNAXIS1']
+    th, tw = header.get('ZTILE2', 1), header.get('ZTILE1', w) #tiles are whole rows unless ZTILEn says otherwise
+    rows = (min(r2, h) - 1)//th - max(r1, 0)//th + 1
+    cols = (min(c2, w) - 1)//tw - max(c1, 0)//tw + 1
+    return max(rows, 0) * max(cols, 0), -(-h//th) * -(-w//tw)
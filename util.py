@@ -1,6 +1,4 @@
 import sunpy.map, sunpy.io.fits
-from sunpy.net import attrs as a
-from sunpy.net import Fido, fido_factory
 
 import astropy.time
 import astropy.units as u
@@ -8,7 +6,7 @@ from astropy.coordinates import SkyCoord
 
 import numpy as np
 from operator import attrgetter
-import requests, math
+import math, os, fetch, catalog, framestore, crops
 
 def set_proxy(proxy):
     import os
@@ -25,87 +23,104 @@ def set_proxy(proxy):
 #proxy automatically sets a proxy
 #if m720s is True, get_maps will download from the hmi.m_720s series instead of hmi.m_45. Note that these images take significantly longer to download and require an interval > 720 seconds
 #an email registered with JSOC is required to download from hmi.m_720s
-def get_maps(t: astropy.time.Time, tend=None, interval=45 * u.s, overwrite=False, proxy=None, m720s=False, email=None):
+#max_conn is the number of files downloaded at the same time. A fetch.FetchEngine can be given instead through engine; its timings attribute will contain how long each file took to download and decode
+#if use_catalog is True, files already in [path] are found through catalog.Catalog without searching for them online. Only the times that are missing are searched for and downloaded
+#source is where maps are searched for and downloaded from - fetch.FidoSource (jsoc/vso) by default. path is the directory they are downloaded to
+#if lazy is True, files are decompressed once into ./data/cache and returned as framestore.LazyMaps, whose data is memory mapped from disk instead of being kept in ram
+#if lazy is "tiles", files are returned as LazyMaps without being decompressed at all - cropped views of the full resolution frames then only decompress the tiles they need (see tiles.py)
+#if callback is given, it is called with (slot, map) as soon as each map is available, where slot is the index of the requested time the map belongs to
+def get_maps(t: astropy.time.Time, tend=None, interval=45 * u.s, overwrite=False, proxy=None, m720s=False, email=None, max_conn=8, engine=None, use_catalog=True, callback=None, source=None, path="./data/hmi", lazy=False):
+    temp = []
+    for slot, m in iter_maps(t, tend, interval=interval, overwrite=overwrite, proxy=proxy, m720s=m720s, email=email, max_conn=max_conn, engine=engine, use_catalog=use_catalog, source=source, path=path, lazy=lazy):
+        if callback is not None:
+            callback(slot, m)
+        temp.append(m)
+    temp = sorted(temp, key=attrgetter('date')) # for some reason the array ends up out of chronological order
+    #print(temp)
+    if len(temp) == 1: return temp[0]
+    if len(temp) == 0: return None
+    #print(4)
+    return temp
+
+#streaming version of get_maps - takes the same parameters, but yields (slot, map) pairs as soon as each map has been downloaded and opened instead of returning everything at the end
+#slot is the index of the requested time (t, t + interval, t + 2*interval...) the map belongs to. Maps arrive in the order in which they finish, not in chronological order
+def iter_maps(t: astropy.time.Time, tend=None, interval=45 * u.s, overwrite=False, proxy=None, m720s=False, email=None, max_conn=8, engine=None, use_catalog=True, source=None, path="./data/hmi", lazy=False):
     if proxy is not None:
         set_proxy(proxy)
+    if source is None:
+        source = fetch.FidoSource()
     if tend is None or not isinstance(tend, astropy.time.Time): 
         tend = t + 22.5 * u.s
         t = t - 22.5 * u.s
-    results = []
+    times = t + np.arange(int((tend - t).to(u.s) / interval + 0.01)) * interval #requested times
+
+    #files that have already been downloaded are looked up in the local catalog first, so only the missing times have to be searched for
+    series = "hmi.m_720s" if m720s else "hmi.m_45s"
+    cat = None
+    if overwrite or not use_catalog or len(times) == 0:
+        files = [None] * len(times)
+    else:
+        cat = catalog.Catalog(path)
+        files = cat.find(times, series, (360 if m720s else 22.5))
+    missing = np.array([i for i, file in enumerate(files) if file is None], dtype=int) #slots that have to be downloaded
+    slots = [i for i, file in enumerate(files) if file is not None]
+    files = [file for file in files if file is not None]
 
     #print(0)
 
-    if not m720s:
-        r = Fido.search(a.Time(t - 22.5 * u.s, tend + 22.5 * u.s), a.Instrument.hmi, a.Physobs.los_magnetic_field)
+    results = []
+    if len(missing) > 0:
+        pad = (360 if m720s else 22.5) * u.s
+        r = source.search(times[missing[0]] - pad, times[missing[-1]] + pad, m720s=m720s, email=email)
+        # print(r)
+        #print(1)
+
+        # find closest result to each requested time
+        idx, _ = select_frames(result_times(r, m720s).unix, times[missing].unix)
+        rows, inverse = np.unique(idx, return_inverse=True) #slots closer together than the cadence can pick the same row - it is only fetched once, so two workers never write the same file
+        results = [r[i] for i in rows]
+        owners = [list(missing[inverse == k]) for k in range(len(rows))] #slots every result belongs to
     else:
-        r = Fido.search(a.Time(t - 360 * u.s, tend + 360 * u.s), a.jsoc.Series("hmi.m_720s"), a.jsoc.Notify(email))
-    # print(r)
-    #print(1)
-
-    j = 0
-    diff = math.inf
-    for i in range(
-            int((tend - t).to(u.s) / interval + 0.01)):  # find closest time to each given time requested, should be O(N)
-        time = t + i * interval
-        while True:  # iterate through all results to find closest time to given
-            if not m720s:
-                temp = astropy.time.Time(r[0]['Start Time'][j], scale='utc', format='isot')
-            else:
-                temp = astropy.time.Time(r[0]['T_REC'][j][0:-4].replace('.', '-').replace('_', 'T'), scale='utc', format='isot')
-            if abs((temp - time).to(
-                    u.s).value) > diff:  # stops when time difference begins to increase; picks last result
-                diff = math.inf
-                results.append(r[0][j - 1])
-                j -= 1
-                break
-            diff = abs((temp - time).to(u.s).value)
-            j += 1
+        owners = []
 
     #print (2)
     #print(results)
-    maps = []
-    # fido starts downloading huge .tar files when you download too many files at the same time (this is very inefficient)
-    for i in range(int(len(results)/8 + 0.9999)):
-        # print("2" + str(i))
-        r = fido_factory.UnifiedResponse(*tuple(results[i*8:min((i+1)*8, len(results))]))
-        while True:
-            try:
-                #print(r)
-                file = Fido.fetch(r, path=f"./data/hmi", max_conn=8, overwrite=overwrite)
-            except requests.exceptions.ConnectionError:
-                print("There was a a connection error: trying again...")
-                continue
-            break
-
-        try:
-            maps.extend(file)
-        except OSError:  # in case the existing file is broken
-            # except connection error again
-            while True:
-                try:
-                    file = Fido.fetch(r, path=f"./data/hmi", max_conn=8, overwrite=overwrite)
-                except requests.exceptions.ConnectionError:
-                    continue
-                break
-            maps.extend(file)
-
-    #print(3)
-
-
-    if not isinstance(maps, list):
-        maps = [maps]
-    # for i in range(len(maps)):
-    #     maps[i] = maps[i].rotate(order=3)
+    # files are fetched by a pool of [max_conn] workers and opened as soon as each one finishes downloading
+    if engine is None:
+        engine = fetch.FetchEngine(max_workers=max_conn, overwrite=overwrite, path=path, manager=fetch.DownloadManager(source=source, path=path, quarantine_path=os.path.join(path, "quarantine")),
+                                   store=framestore.FrameStore(decompress=(lazy != "tiles")) if lazy else None)
+    unique = list(dict.fromkeys(files)) #same for files from the catalog
+    owners += [[slot for slot, other in zip(slots, files) if other == file] for file in unique]
+    for i, m in engine.run(results + unique): #files from the catalog are only opened, not downloaded
+        for slot in owners[i]: #the map is yielded once for every slot it belongs to
+            yield int(slot), m
+    if len(results) > 0 and use_catalog:
+        (cat or catalog.Catalog(path)).scan() #indexes the new files so they can be found next time
 
-    temp = []
-    for map in maps:
-        temp.append(sunpy.map.Map(map))
-    temp = sorted(temp, key=attrgetter('date')) # for some reason the array ends up out of chronological order
-    #print(temp)
-    if len(temp) == 1: return temp[0]
-    if len(temp) == 0: return None
-    #print(4)
-    return temp
+#converts the record times of a search result to a single astropy.time.Time array
+#hmi.m_720s results only have T_REC strings (formatted like 2017.01.21_09:45:00_TAI) - these are reformatted all at once instead of one at a time
+def result_times(r, m720s=False):
+    if not m720s:
+        return astropy.time.Time(r['Start Time'], scale='utc', format='isot')
+    t_rec = np.asarray(r['T_REC']).astype('U19') #cuts off the _TAI suffix
+    t_rec = np.char.replace(np.char.replace(t_rec, '.', '-'), '_', 'T')
+    return astropy.time.Time(t_rec, scale='utc', format='isot')
+
+#finds the closest candidate to each requested time with a single sorted search
+#candidates and requested are numeric arrays of times in the same units (for example, Time.unix) - candidates do not have to be sorted
+#returns the index of the closest candidate for every requested time and the time error (candidate - requested)
+def select_frames(candidates, requested):
+    candidates = np.asarray(candidates, dtype=float)
+    requested = np.atleast_1d(np.asarray(requested, dtype=float))
+    if len(candidates) == 0:
+        return np.full(len(requested), -1), np.full(len(requested), np.inf)
+    order = np.argsort(candidates, kind='stable')
+    known = candidates[order]
+    right = np.searchsorted(known, requested) #first candidate at or after each requested time
+    left = np.maximum(right - 1, 0)
+    right = np.minimum(right, len(known) - 1)
+    closest = np.where(np.abs(known[left] - requested) <= np.abs(known[right] - requested), left, right)
+    return order[closest], known[closest] - requested
 
 #flattens list 
 #for example: flatten([1, 2, 3, [3, [[2], 3, 1]]]) returns [1, 2, 3, 3, 2, 3, 1]
@@ -140,22 +155,103 @@ def rotate(point, duration, out_frame=None):
         return new.transform_to(out_frame)
     else: return new
 
+#compact storage types for map data (see movie.MList dtype)
+#"float32" halves the size of the data. "int16" quarters it by storing round((value - BZERO)/BSCALE), like an integer FITS image, with BLANK in place of nans
+#with a BSCALE of 0.2 G, int16 covers +-6553 G, well past both the strongest hmi fields and the +-1000 G clip levels used for display. Frames with values past that range (like levels downscaled with reduce="sum") get a coarser BSCALE
+BSCALE = 0.2
+BZERO = 0
+BLANK = -32768
+
+def encode(data, dtype): #converts data in G to the storage type [dtype] (None, "float32" or "int16") - returns the new data and the header keywords needed to decode it, which should be added to the map's meta
+    if dtype is None:
+        return data, {}
+    if str(dtype) != "int16":
+        return np.asarray(data, dtype=dtype), {}
+    finite = np.abs(data[np.isfinite(data)])
+    bscale = max(BSCALE, float(finite.max())/32767 if len(finite) > 0 else 0)
+    ans = np.clip(np.round((data - BZERO)/bscale), -32767, 32767)
+    ans[np.isnan(data)] = BLANK
+    return ans.astype(np.int16), {'bscale': bscale, 'bzero': BZERO, 'blank': BLANK}
+
+def decode(data, meta=None): #converts data stored by encode back to values in G (as float32), using the keywords in [meta] - data that isn't int16 is returned as it is
+    if data.dtype != np.int16:
+        return data
+    meta = meta or {}
+    ans = data.astype(np.float32) * np.float32(meta.get('bscale', BSCALE)) + np.float32(meta.get('bzero', BZERO))
+    ans[data == meta.get('blank', BLANK)] = np.nan
+    return ans
+
+#map m with its data in G - maps stored as int16 (see encode) are decoded into a new sunpy map without the keywords, anything else is returned as it is
+#this is what the levels of an MList give out when they are indexed (level[i]) - their raw(i) gives the frames as they are stored
+def decoded(m):
+    if isinstance(m, framestore.LazyMap) and not m.loaded:
+        if m.file is None or m.array().dtype != np.int16: #checked on the memory map, so nothing is read from disk
+            return m
+    elif m.data.dtype != np.int16:
+        return m
+    meta = m.meta.copy()
+    for key in ('bscale', 'bzero', 'blank'):
+        meta.pop(key, None)
+    return sunpy.map.Map((decode(m.data, m.meta), meta))
+
+#downscales a frame, or a stack of frames (any number of leading dimensions), by reducing [factor] x [factor] blocks of pixels in one vectorized call
+#mode is "nanmean" (nans are ignored, so off limb pixels don't wipe out the pixels along the limb), "mean" or "sum". Rows and columns that don't fill a whole block are dropped
+def block_reduce(data, factor, mode="nanmean"):
+    return block_pyramid(data, (factor,), mode)[0]
+
+#block_reduce for several factors at once, in increasing order with each one a multiple of the one before - e.g. (2, 4) for hpc2048 and hpc1024 from hpc4096
+#every level is reduced from the previous one, so the extra levels cost a fraction of the first
+def block_pyramid(data, factors, mode="nanmean"):
+    h, w = data.shape[-2]//factors[-1]*factors[-1], data.shape[-1]//factors[-1]*factors[-1]
+    data = data[..., :h, :w]
+    count = None
+    if mode == "nanmean":
+        finite = np.isfinite(data)
+        data = np.where(finite, data, 0)
+        count = finite.view(np.uint8) if factors[-1] < 16 else finite.astype(np.uint16) #number of finite pixels in each block
+    ans = []
+    done = 1
+    for factor in factors:
+        data = block_sum(data, factor//done)
+        if count is not None:
+            count = block_sum(count, factor//done)
+        done = factor
+        if mode == "sum":
+            ans.append(data)
+        elif mode == "mean":
+            ans.append(data/(factor*factor))
+        else:
+            with np.errstate(invalid='ignore', divide='ignore'): #blocks without any finite pixels become nan
+                ans.append(data/count)
+    return ans
+
+def block_sum(data, factor): #sums [factor] x [factor] blocks by adding strided slices, which is much faster than summing over extra axes of a reshaped array
+    if factor == 1:
+        return data
+    cols = data[..., 0::factor] + data[..., 1::factor]
+    for i in range(2, factor):
+        cols += data[..., i::factor]
+    rows = cols[..., 0::factor, :] + cols[..., 1::factor, :]
+    for i in range(2, factor):
+        rows += cols[..., i::factor, :]
+    return rows
+
+#header of a frame downscaled by block_reduce - the wcs is scaled directly instead of being rebuilt through sunpy, and works the same way for every frame in a stack
+def block_meta(meta, factor):
+    meta = meta.copy()
+    for i in (1, 2):
+        if f'cdelt{i}' in meta:
+            meta[f'cdelt{i}'] = meta[f'cdelt{i}'] * factor
+        meta[f'crpix{i}'] = (meta[f'crpix{i}'] - 0.5)/factor + 0.5 #pixel edges stay in the same place
+        if f'naxis{i}' in meta:
+            meta[f'naxis{i}'] = meta[f'naxis{i}']//factor
+        for j in (1, 2):
+            if f'cd{i}_{j}' in meta:
+                meta[f'cd{i}_{j}'] = meta[f'cd{i}_{j}'] * factor
+    return meta
+
 #slices a 2d array/image from xmin to xmax and ymin to ymax
 #if any of the parameters exceeds the bounds of the array, extra zeros will be added to preserve the aspect ratio
-def slice_extend(arr, xmin, xmax, ymin, ymax):
-    # print(arr.shape, xmin, xmax, ymin, ymax)
-    w, h = arr.shape
-    diffs = [0 - xmin, xmax - w, 0 - ymin, ymax - h]
-    new = arr[max(0, xmin):min(w, xmax), max(0, ymin):min(h, ymax)]
-    if diffs[0] > 0:
-        new = np.append(np.zeros((diffs[0], h)), new, axis=0)
-        w += diffs[0]
-    if diffs[1] > 0:
-        new = np.append(new, np.zeros((diffs[1], h)), axis=0)
-        w += diffs[1]
-    if diffs[2] > 0:
-        new = np.append(np.zeros((w, diffs[2])), new, axis=1)
-    if diffs[3] > 0:
-        new = np.append(new, np.zeros((w, diffs[3])), axis=1)
-    return new
+def slice_extend(arr, xmin, xmax, ymin, ymax, pad=0): #arr[xmin:xmax, ymin:ymax], with the part of the box that is outside of arr filled with pad (see crops.Cropper)
+    return crops.Cropper(pad=pad).crop([arr], [(xmin, xmax, ymin, ymax)], arr.dtype)[0]
 